@@ -1,52 +1,220 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Blueprint, render_template, jsonify, request, send_file, g, Response
+from backends import DATA_DIR
+from backends import get_backend
+from data_store import NODE_COLUMNS
+from data_store import REALTIME_COLUMNS
+from data_store import STATIC_COLUMNS
 from data_store import ChartDataStore
 from data_store import StoryDataStore
 from data_store import SummaryDataStore
+from data_store import get_store
+from poller import realtime_poller
+from poller import start_leader_election
+from realtime import parser_totals
+from realtime import realtime_cache
+from storage import disable_group_commit
+from storage import document_cache
 from flask_cors import CORS
+from common import SIZE_BUCKETS
+from common import disable_log_rotation
+from common import log_stats
 from common import logger
+from common import metrics
+from httpcache import conditional
+from httpcache import init_app as init_http_cache
+from export import export_response
+from images import MAX_IMAGE_BYTES
+from images import ImageError
+from images import iter_stream
+from images import store_image
+from images import resolve_image
+import json
 import os
+import time
 
-app = Flask(__name__)
-chart_store = ChartDataStore()
-summary_store = SummaryDataStore()
+# 所有路由注册在 blueprint 上，由 create_app() 挂到 Flask 应用
+bp = Blueprint("reefing", __name__)
 
-# Enable CORS for the app
-CORS(app)
+
+def get_summary_store():
+    # 每个进程常驻的 store 实例（按当前后端），不在导入时绑定
+    return get_store(SummaryDataStore)
+
+
+# 每个请求的耗时和响应大小（按路由/方法/状态/uuid）。
+# after_request 按注册的倒序执行，blueprint 先于压缩注册，所以记录的是压缩之后的大小、包括压缩的时间
+@bp.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@bp.after_app_request
+def record_request_metrics(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        labels = {
+            "route": request.url_rule.rule if request.url_rule else "unmatched",
+            "method": request.method,
+            "status": response.status_code,
+            "uuid": request.args.get("uuid", ""),
+        }
+        metrics.observe("reefing_http_request_seconds", time.perf_counter() - start, **labels)
+        if response.content_length is not None:
+            metrics.observe("reefing_http_response_bytes", response.content_length, buckets=SIZE_BUCKETS,
+                            route=labels["route"])
+    return response
+
+@bp.app_errorhandler(ImageError)
+def handle_image_error(e):
+    return jsonify({"error": str(e)}), 400
+
+
+# 读接口的版本号（ETag），If-None-Match 命中时不读存储直接返回 304
+def summary_version(**kwargs):
+    return get_summary_store().backend.version("summary")
+
+
+def story_version(**kwargs):
+    uuid = request.args.get("uuid")
+    return get_backend().version("story", uuid) if uuid else None
+
+
+def chart_version(**kwargs):
+    uuid = request.args.get("uuid")
+    return get_backend().version("data", uuid) if uuid else None
+
+
+def dashboard_summary_version(**kwargs):
+    # 汇总落后于实时日志时读取会先补上，所以也要看实时数据的版本
+    uuid = request.args.get("uuid")
+    if not uuid:
+        return None
+    summary_token, summary_mtime = get_backend().version("dashboard", uuid)
+    realtime_token, realtime_mtime = get_backend().version("realtime", uuid)
+    return f"{summary_token}|{realtime_token}", max(summary_mtime or 0, realtime_mtime or 0) or None
+
+# 节点列表分页：单页最多返回的节点数
+MAX_PAGE_SIZE = 200
+PAGE_ARGS = ("limit", "after", "since", "fields")
+
+
+def page_args():
+    """解析 limit/after/since/fields 查询参数，不合法时抛 ValueError。"""
+    limit = request.args.get("limit")
+    if limit is not None:
+        limit = int(limit)
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    since = request.args.get("since")
+    fields = request.args.get("fields")
+    return {
+        "limit": limit,
+        "after": request.args.get("after") or None,
+        "since": float(since) if since else None,
+        "fields": [f.strip() for f in fields.split(",") if f.strip()] if fields else None,
+    }
+
+
+# 批量导入单次最多的条目数
+BULK_MAX_ITEMS = int(os.environ.get("REEFING_BULK_MAX_ITEMS", 50000))
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines")
+
+
+def bulk_items():
+    """
+    批量导入的请求体：JSON 数组，或 NDJSON（每行一个 JSON，按行流式读取）。
+    NDJSON 中无法解析的行作为 ValueError 放在对应位置，由导入结果逐条报告。
+    格式不对或条目太多时抛 ValueError。
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        items = []
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            if len(items) >= BULK_MAX_ITEMS:
+                raise ValueError(f"At most {BULK_MAX_ITEMS} items per request")
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(ValueError(f"Invalid JSON: {e}"))
+        return items
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        raise ValueError("Body must be a JSON array or NDJSON")
+    if len(items) > BULK_MAX_ITEMS:
+        raise ValueError(f"At most {BULK_MAX_ITEMS} items per request")
+    return items
+
+def export_rows(rows, columns, filename):
+    """
+    流式导出：rows(start, end) 返回记录迭代器。查询参数 format=ndjson|csv（默认 ndjson），
+    start/end 为时间范围，fields 为 CSV 的列（默认 columns）。参数不合法时返回 400。
+    """
+    fields = request.args.get("fields")
+    columns = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(columns)
+    try:
+        return export_response(
+            rows(request.args.get("start") or None, request.args.get("end") or None),
+            request.args.get("format", "ndjson"),
+            columns,
+            filename,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
 #############################################
 ##           Summary Functions
 #############################################
 # Get all summary items
-@app.route("/api/summary", methods=["GET"])
+# 带 limit/after/since/fields 参数时分页返回 {"items": [...], "next": cursor}
+@bp.route("/api/summary", methods=["GET"])
+@conditional(summary_version)
 def get_summary_items():
-    items = summary_store.get_summary_nodes()
-    return jsonify(items)
+    if not any(arg in request.args for arg in PAGE_ARGS):
+        items = get_summary_store().get_summary_nodes()
+        return jsonify(items)
+    try:
+        page = get_summary_store().list_summary_nodes(**page_args())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except KeyError:
+        return jsonify({"error": "Unknown cursor"}), 400
+    return jsonify(page)
 
 # Add a summary item (with image upload)
-@app.route("/api/summary", methods=["POST"])
+@bp.route("/api/summary", methods=["POST"])
 def add_summary_item():
     new_item_data = request.json
-    item = summary_store.add_summary_node(new_item_data)
+    item = get_summary_store().add_summary_node(new_item_data)
     return jsonify(item), 201
 
-@app.route('/api/summary/order', methods=['POST'])
+# 批量添加 summary 节点（JSON 数组或 NDJSON），整批一次写入，返回每条的结果
+@bp.route("/api/summary/bulk", methods=["POST"])
+def import_summary_items():
+    try:
+        items = bulk_items()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(get_summary_store().import_nodes(items))
+
+@bp.route('/api/summary/order', methods=['POST'])
 def set_summary_order():
     data = request.get_json()
     order_list = data.get('order', [])
     if not isinstance(order_list, list):
         return jsonify({'error': 'Invalid order format'}), 400
     try:
-        from app import summary_store  # 或根据你的实际导入
-        summary_store.set_summary_order(order_list)
+        get_summary_store().set_summary_order(order_list)
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
 # API endpoint to update an existing summary item
-@app.route("/api/summary/<item_id>", methods=["PUT"])
+@bp.route("/api/summary/<item_id>", methods=["PUT", "PATCH"])
 def update_summary_item(item_id):
     updated_data = request.json
-    item = summary_store.update_summary_node(item_id, updated_data)
+    item = get_summary_store().update_summary_node(item_id, updated_data)
     if item:
         return jsonify(item)
     else:
@@ -54,68 +222,97 @@ def update_summary_item(item_id):
 
 
 # API endpoint to delete a summary item
-@app.route("/api/summary/<item_id>", methods=["DELETE"])
+@bp.route("/api/summary/<item_id>", methods=["DELETE"])
 def delete_summary_item(item_id):
-    success = summary_store.delete_summary_node(item_id)
+    success = get_summary_store().delete_summary_node(item_id)
     if success:
         return jsonify({"message": "Item deleted successfully"})
     else:
         return jsonify({"error": "Item not found"}), 404
 
 
+# 导出全部 summary 节点（NDJSON/CSV 流式），start/end 按 updated_at 过滤
+@bp.route("/api/summary/export", methods=["GET"])
+def export_summary_items():
+    return export_rows(get_summary_store().export_nodes, NODE_COLUMNS, "summary")
+
+
 # Update info
-@app.route("/api/summary/info", methods=["POST"])
+@bp.route("/api/summary/info", methods=["POST"])
 def save_summary_info():
     data = request.get_json()
     if not data:
         return jsonify(success=False, error="No data received"), 400
-    summary_store.set_info(data)
+    get_summary_store().set_info(data)
     return jsonify(success=True)
 
 
-@app.route("/api/summary/info", methods=["GET"])
+@bp.route("/api/summary/info", methods=["GET"])
+@conditional(summary_version)
 def get_summary_info():
-    return jsonify(summary_store.get_info())
+    return jsonify(get_summary_store().get_info())
 
 
 #############################################
 ##           Story Functions
 #############################################
 # API endpoint to get all story nodes
-@app.route("/story")
+@bp.route("/story")
 def story():
     return render_template("story.html")
 
-@app.route("/api/story", methods=["GET"])
+@bp.route("/api/story", methods=["GET"])
+@conditional(story_version)
 def get_story_nodes():
     uuid = request.args.get("uuid")
     if not uuid:
         return jsonify({"error": "Missing uuid"}), 400
-    store = StoryDataStore(uuid)
-    nodes = store.get_story_nodes()
-    nodes_list = list(nodes.values())[::-1]
-    return jsonify(nodes_list)
+    store = get_store(StoryDataStore, uuid)
+    # 不带分页参数时返回全部节点（最新的在前）
+    if not any(arg in request.args for arg in PAGE_ARGS):
+        return jsonify(store.list_story_nodes()["items"])
+    try:
+        page = store.list_story_nodes(**page_args())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except KeyError:
+        return jsonify({"error": "Unknown cursor"}), 400
+    return jsonify(page)
 
 
 # API endpoint to add a new story node
-@app.route("/api/story", methods=["POST"])
+@bp.route("/api/story", methods=["POST"])
 def add_story_node():
     uuid = request.args.get("uuid")
     if not uuid:
         return jsonify({"error": "Missing uuid"}), 400
-    store = StoryDataStore(uuid)
+    store = get_store(StoryDataStore, uuid)
     new_node_data = request.json
     node = store.add_story_node(new_node_data)
     return jsonify(node), 201
 
 
+# 批量添加 story 节点（JSON 数组或 NDJSON），整批一次写入，返回每条的结果
+@bp.route("/api/story/bulk", methods=["POST"])
+def import_story_nodes():
+    uuid = request.args.get("uuid")
+    if not uuid:
+        return jsonify({"error": "Missing uuid"}), 400
+    try:
+        items = bulk_items()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(get_store(StoryDataStore, uuid).import_nodes(items))
+
+
 # API endpoint to get a single story node
-@app.route("/api/story/<node_id>", methods=["GET"])
+@bp.route("/api/story/<node_id>", methods=["GET"])
+@conditional(story_version)
 def get_story_node(node_id):
     uuid = request.args.get("uuid")
     if not uuid:
         return jsonify({"error": "Missing uuid"}), 400
-    store = StoryDataStore(uuid)
+    store = get_store(StoryDataStore, uuid)
     node = store.get_story_node(node_id)
     if node:
         return jsonify(node)
@@ -124,12 +321,12 @@ def get_story_node(node_id):
 
 
 # API endpoint to update an existing story node
-@app.route("/api/story/<node_id>", methods=["PUT"])
+@bp.route("/api/story/<node_id>", methods=["PUT", "PATCH"])
 def update_story_node(node_id):
     uuid = request.args.get("uuid")
     if not uuid:
         return jsonify({"error": "Missing uuid"}), 400
-    store = StoryDataStore(uuid)
+    store = get_store(StoryDataStore, uuid)
     updated_data = request.json
     node = store.update_story_node(node_id, updated_data)
     if node:
@@ -139,12 +336,12 @@ def update_story_node(node_id):
 
 
 # API endpoint to delete a story node
-@app.route("/api/story/<node_id>", methods=["DELETE"])
+@bp.route("/api/story/<node_id>", methods=["DELETE"])
 def delete_story_node(node_id):
     uuid = request.args.get("uuid")
     if not uuid:
         return jsonify({"error": "Missing uuid"}), 400
-    store = StoryDataStore(uuid)
+    store = get_store(StoryDataStore, uuid)
     success = store.delete_story_node(node_id)
     if success:
         return jsonify({"message": "Node deleted successfully"})
@@ -152,21 +349,31 @@ def delete_story_node(node_id):
         return jsonify({"error": "Node not found"}), 404
 
 
-@app.route("/api/story/info", methods=["GET"])
+# 导出一个 story 的全部节点（NDJSON/CSV 流式），start/end 按 updated_at 过滤
+@bp.route("/api/story/export", methods=["GET"])
+def export_story_nodes():
+    uuid = request.args.get("uuid")
+    if not uuid:
+        return jsonify({"error": "Missing uuid"}), 400
+    return export_rows(get_store(StoryDataStore, uuid).export_nodes, NODE_COLUMNS, f"story_{uuid}")
+
+
+@bp.route("/api/story/info", methods=["GET"])
+@conditional(story_version)
 def get_info():
     uuid = request.args.get("uuid")
     if not uuid:
         return jsonify({"error": "Missing uuid"}), 400
-    store = StoryDataStore(uuid)
+    store = get_store(StoryDataStore, uuid)
     return jsonify(store.get_info())
 
 
-@app.route("/api/story/info", methods=["POST"])
+@bp.route("/api/story/info", methods=["POST"])
 def save_info():
     uuid = request.args.get("uuid")
     if not uuid:
         return jsonify(success=False, error="Missing uuid"), 400
-    store = StoryDataStore(uuid)
+    store = get_store(StoryDataStore, uuid)
     data = request.get_json()
     if not data:
         return jsonify(success=False, error="No data received"), 400
@@ -177,81 +384,284 @@ def save_info():
 #############################################
 ##                  Dashboard Functions
 #############################################
-@app.route("/dashboard")
+@bp.route("/dashboard")
 def dashboard():
     uuid = request.args.get("uuid")
     if not uuid:
         return jsonify(success=False, error="Missing uuid"), 400
-    store = ChartDataStore(uuid)
-    data = store.load_static_data()
-    realtime_data = store.load_realtime_data()
-    return render_template(
-        "dashboard.html", chart_data=data, realtime_data=realtime_data
-    )
+    store = get_store(ChartDataStore, uuid)
+    # 没有后台 poller 时先（按缓存 TTL）抓一次 controller，汇总里才有最新的实时数据
+    store.refresh_realtime()
+    # 页面用物化的汇总渲染，实时曲线由页面再请求 /dashboard/series
+    summary = store.get_dashboard_summary()
+    return render_template("dashboard.html", summary=summary)
+
+# 物化的 dashboard 汇总（最新值、周统计、最小/最大值）
+@bp.route("/dashboard/summary", methods=["GET"])
+@conditional(dashboard_summary_version)
+def get_dashboard_summary():
+    uuid = request.args.get("uuid")
+    if not uuid:
+        return jsonify({"error": "Missing uuid"}), 400
+    return jsonify(get_store(ChartDataStore, uuid).get_dashboard_summary())
 
 # API endpoint for chart data (for radar chart in story.html)
-@app.route("/dashboard/mini", methods=["GET"])
+@bp.route("/dashboard/mini", methods=["GET"])
+@conditional(chart_version)
 def get_chart_data():
     uuid = request.args.get("uuid")
     if not uuid:
         return jsonify({"error": "Missing uuid"}), 400
-    store = ChartDataStore(uuid)
-    data = store.load_static_data()
-    # 只返回最后一条数据
-    if isinstance(data, list) and data:
-        return jsonify(data[-1])
-    return jsonify({})
+    store = get_store(ChartDataStore, uuid)
+    # 只返回最新一条数据（有序索引的最后一项）
+    return jsonify(store.latest_one() or {})
+
+# 服务端聚合/降采样的图表数据
+# 参数: params=PH,ORP,N  start/end=YYYY-MM-DD[ HH:MM:SS]  bucket=minute|hour|day|week  points=N  mode=stats|lttb
+@bp.route("/dashboard/series", methods=["GET"])
+def get_chart_series():
+    uuid = request.args.get("uuid")
+    if not uuid:
+        return jsonify({"error": "Missing uuid"}), 400
+    params = [p.strip() for p in request.args.get("params", "PH,ORP").split(",") if p.strip()]
+    try:
+        points = request.args.get("points", type=int)
+        store = get_store(ChartDataStore, uuid)
+        series = store.get_series(
+            params,
+            start=request.args.get("start") or None,
+            end=request.args.get("end") or None,
+            bucket=request.args.get("bucket") or None,
+            points=points,
+            mode=request.args.get("mode", "stats"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(series)
 
 # Add endpoint for saving static data
-@app.route("/dashboard", methods=["POST"])
+@bp.route("/dashboard", methods=["POST"])
 def add_static_data():
     uuid = request.args.get("uuid")
     if not uuid:
         return jsonify(success=False, error="Missing uuid"), 400
-    store = ChartDataStore(uuid) 
+    store = get_store(ChartDataStore, uuid)
     try:
         data = request.get_json()
         if not data:
             return jsonify(success=False, error="No data received"), 400
         store.save_static_data(data)
         return jsonify(success=True)
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
     except Exception as e:
         return jsonify(success=False, error=str(e)), 500
 
-@app.route("/dashboard/info", methods=["POST"])
+# 批量导入静态数据（手动测试记录，每条带 date），同日期覆盖，整批一次写入
+@bp.route("/dashboard/static/bulk", methods=["POST"])
+def import_static_data():
+    uuid = request.args.get("uuid")
+    if not uuid:
+        return jsonify(success=False, error="Missing uuid"), 400
+    try:
+        items = bulk_items()
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    return jsonify(get_store(ChartDataStore, uuid).import_static(items))
+
+# 批量导入实时读数（controller 格式或 {"time", "ORP", "PH", "T"}），按时间排序后一次追加
+@bp.route("/dashboard/realtime/bulk", methods=["POST"])
+def import_realtime_data():
+    uuid = request.args.get("uuid")
+    if not uuid:
+        return jsonify(success=False, error="Missing uuid"), 400
+    try:
+        result = get_store(ChartDataStore, uuid).import_realtime(bulk_items())
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    return jsonify(result)
+
+@bp.route("/dashboard/info", methods=["POST"])
 def add_info_data():
     uuid = request.args.get("uuid")
     if not uuid:
         return jsonify(success=False, error="Missing uuid"), 400
-    store = ChartDataStore(uuid) 
+    store = get_store(ChartDataStore, uuid)
     try:
         data = request.get_json()
         if not data:
             return jsonify(success=False, error="No data received"), 400
         store.set_dashboard_info(data)
+        # realtimesource 可能变了，让后台调度器立即重新发现
+        realtime_poller.poke()
         return jsonify(success=True)
     except Exception as e:
         return jsonify(success=False, error=str(e)), 500
 
-@app.route("/dashboard/info", methods=["GET"])
+@bp.route("/dashboard/info", methods=["GET"])
+@conditional(chart_version)
 def get_info_data():
     uuid = request.args.get("uuid")
     if not uuid:
         return jsonify({"error": "Missing uuid"}), 400
-    store = ChartDataStore(uuid)
+    store = get_store(ChartDataStore, uuid)
     data = store.get_dashboard_info()
     if data:
         return jsonify(data)
     return jsonify({})
 
+# 导出静态数据（NDJSON/CSV 流式），不给 start/end 时按写入顺序导出全部记录
+@bp.route("/dashboard/static/export", methods=["GET"])
+def export_static_data():
+    uuid = request.args.get("uuid")
+    if not uuid:
+        return jsonify({"error": "Missing uuid"}), 400
+    store = get_store(ChartDataStore, uuid)
+    return export_rows(store.export_static, ("date",) + STATIC_COLUMNS, f"static_{uuid}")
+
+# 导出本地实时数据日志（NDJSON/CSV 流式，按时间升序），不会去抓取 controller
+@bp.route("/dashboard/realtime/export", methods=["GET"])
+def export_realtime_data():
+    uuid = request.args.get("uuid")
+    if not uuid:
+        return jsonify({"error": "Missing uuid"}), 400
+    store = get_store(ChartDataStore, uuid)
+    return export_rows(store.export_realtime, ("time",) + REALTIME_COLUMNS, f"realtime_{uuid}")
+
+def cache_gauges():
+    """/metrics 导出时读取的缓存、解析器和 poller 状态。"""
+    for key, value in realtime_cache.stats().items():
+        yield "reefing_realtime_cache", {"stat": key}, value
+    for key, value in document_cache.stats().items():
+        yield "reefing_document_cache", {"stat": key}, value
+    for key, value in parser_totals.as_dict().items():
+        yield "reefing_realtime_parser", {"stat": key}, value
+    status = realtime_poller.status()
+    yield "reefing_poller_running", {}, int(status["running"])
+    for key in ("queue_depth", "fetching", "ingesting"):
+        yield f"reefing_poller_{key}", {}, status[key]
+    for uuid, source in status["sources"].items():
+        yield "reefing_poller_source_failures", {"uuid": uuid, "circuit": source["circuit"]}, source["failures"]
+
+
+metrics.add_collector(cache_gauges)
+
+
+# Prometheus 文本格式的指标
+@bp.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# 实时数据缓存命中情况（用于观察 controller 实际被访问的频率）
+@bp.route("/dashboard/realtime/stats", methods=["GET"])
+def get_realtime_stats():
+    stats = realtime_cache.stats()
+    stats["parser"] = parser_totals.as_dict()
+    stats["poller"] = realtime_poller.status()
+    stats["logging"] = log_stats()
+    return jsonify(stats)
+
+#############################################
+##                  Image Functions
+#############################################
+# 上传图片：请求体为图片本身（Content-Type: image/*），或 multipart 的 file 字段。
+# 分块写盘，返回的 id 在创建/更新节点时作为 avatar_image_id / original_image_id 传入
+@bp.route("/api/images", methods=["POST"])
+def upload_image():
+    if request.content_length is not None and request.content_length > MAX_IMAGE_BYTES + 64 * 1024:
+        return jsonify({"error": "Image too large"}), 413
+    if request.mimetype == "multipart/form-data":
+        upload = request.files.get("file")
+        if upload is None:
+            return jsonify({"error": "Missing file"}), 400
+        stream = upload.stream
+    else:
+        stream = request.stream
+    try:
+        image = store_image(iter_stream(stream))
+    except ImageError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(image), 201
+
+# 内容寻址的图片，?w=<宽度> 返回对应档位的 WebP 缩略图
+@bp.route("/images/<name>", methods=["GET"])
+def get_image(name):
+    resolved = resolve_image(name, request.args.get("w", type=int))
+    if resolved is None:
+        return jsonify({"error": "Image not found"}), 404
+    path, mimetype, immutable = resolved
+    response = send_file(path, mimetype=mimetype, conditional=True)
+    if immutable:
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        # 缩略图还在生成，先给原图，稍后再取
+        response.headers["Cache-Control"] = "public, max-age=60"
+    return response
+
 #############################################
 ##                  Main Entry Functions
 #############################################
 
-@app.route("/")
+@bp.route("/")
 def index():
     return render_template("index.html")
 
 
+def _multiprocess_default():
+    if "REEFING_MULTIPROCESS" in os.environ:
+        return os.environ["REEFING_MULTIPROCESS"] != "0"
+    # gunicorn 的 worker 进程会设置 SERVER_SOFTWARE
+    return "gunicorn" in os.environ.get("SERVER_SOFTWARE", "")
+
+
+def create_app(config=None):
+    """
+    WSGI 应用工厂（生产环境入口见 wsgi.py，gunicorn 不要用 --preload）。
+    config 覆盖默认配置：
+    - POLLER：是否运行后台 realtime poller（REEFING_POLLER，默认开）
+    - POLLER_LOCK：多进程之间选出唯一 poller 的锁文件（默认 data/poller.lock）
+    - MULTIPROCESS：是否多 worker 进程部署（REEFING_MULTIPROCESS，gunicorn 下自动开启），
+      开启时关闭只适合单进程的 group commit，file 日志改由外部工具轮转
+    """
+    app = Flask(__name__)
+    app.config.update(
+        POLLER=os.environ.get("REEFING_POLLER", "1") != "0",
+        POLLER_LOCK=os.environ.get("REEFING_POLLER_LOCK") or os.path.join(DATA_DIR, "poller.lock"),
+        MULTIPROCESS=_multiprocess_default(),
+    )
+    if config:
+        app.config.update(config)
+
+    # Enable CORS for the app
+    CORS(app)
+    app.register_blueprint(bp)
+    # 大的 JSON 响应做 gzip/br 压缩
+    init_http_cache(app)
+
+    if app.config["MULTIPROCESS"]:
+        if disable_group_commit():
+            logger.warning("REEFING_GROUP_COMMIT_MS is ignored when serving with multiple processes")
+        if disable_log_rotation():
+            logger.info("Log file rotation is left to external tools when serving with multiple processes")
+    if app.config["POLLER"] and not realtime_poller.is_running():
+        # 每个进程都参与选举，只有一个进程真正抓取，其它进程只读本地数据
+        start_leader_election(realtime_poller, app.config["POLLER_LOCK"])
+    return app
+
+
+# 兼容直接 import app（测试、压测、旧的启动方式）：不启动后台 poller
+app = create_app({"POLLER": False})
+
+
 if __name__ == "__main__":
-    app.run(debug=True, port=5003, host="0.0.0.0")
+    host = os.environ.get("REEFING_HOST", "0.0.0.0")
+    port = int(os.environ.get("REEFING_PORT", 5003))
+    if os.environ.get("REEFING_DEBUG", "1") != "0":
+        # debug 模式下 reloader 会启动两个进程，只在实际服务的子进程里启动后台 poller
+        if os.environ.get("REEFING_POLLER", "1") != "0" and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            realtime_poller.start()
+        app.run(debug=True, port=port, host=host)
+    else:
+        # 单进程多线程，没有 reloader 和调试器
+        app = create_app()
+        app.run(debug=False, use_reloader=False, threaded=True, port=port, host=host)
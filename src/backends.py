@@ -0,0 +1,1074 @@
+"""
+backends.py
+数据存储后端。ChartDataStore / StoryDataStore / SummaryDataStore 只通过这里的接口读写：
+- JsonBackend：每个 uuid 一个 JSON 文件（默认，与原来的文件格式完全兼容）
+- SqliteBackend：标准库 sqlite3（WAL 模式），静态数据按 (uuid, date)、实时数据按 (uuid, time)、
+  节点按 (uuid, id) 建索引
+通过环境变量 REEFING_STORAGE=json|sqlite 选择。已有的 data/*.json 可以一次性迁移到 SQLite：
+
+    python src/backends.py migrate
+"""
+
+from collections import OrderedDict
+from common import metrics
+from contextlib import contextmanager
+from realtime import Reading
+from storage import SnapshotLog
+from storage import document_cache
+from storage import file_lock
+from storage import save_json
+from storage import write_json_atomic
+from timeseries import parse_static_date
+from timeseries import parse_time
+from timeseries import resolve_yearless_dates
+import json
+import os
+import sqlite3
+import storage
+import sys
+import threading
+
+# 数据目录，可用 REEFING_DATA_DIR 指到别处（例如压测时用临时目录）
+DATA_DIR = os.environ.get("REEFING_DATA_DIR") or os.path.join(os.path.dirname(__file__), "data")
+
+# 文档种类（也是 JSON 文件名前缀）：data 为 dashboard 配置 + 静态数据，story/summary 为节点文档
+NODE_KINDS = ("story", "summary")
+
+# 静态数据：每累计多少条 WAL 记录合并回快照
+STATIC_WAL_COMPACT = int(os.environ.get("REEFING_STATIC_WAL_COMPACT", 100))
+# 常驻内存的静态数据快照 + WAL 最多保留多少个 tank（LRU，淘汰后下次访问从文件重新加载）
+STATIC_LOG_CACHE_SIZE = max(1, int(os.environ.get("REEFING_STATIC_LOG_CACHE_SIZE", 256)))
+
+
+def _static_key(entry):
+    return entry.get("date") if isinstance(entry, dict) else None
+
+
+def _resolve_static_dates(entries, today=None):
+    """
+    补全没有年份的 date（旧前端的 'Mon DD'，按写入顺序推算，见 resolve_yearless_dates），原值保存在 raw_date。
+    补全后与已有日期重复的按 upsert 的规则合并：保留先写入的位置，内容取后写入的。
+    没有需要补全的记录时返回 None，否则返回新的记录列表（保持写入顺序）。
+    """
+    dates = [_static_key(entry) for entry in entries]
+    resolved = resolve_yearless_dates(dates, today)
+    if resolved == dates:
+        return None
+    records = []
+    positions = {}
+    for entry, date in zip(entries, resolved):
+        if date != _static_key(entry):
+            entry = dict(entry, date=date, raw_date=_static_key(entry))
+        pos = positions.get(date) if isinstance(date, str) else None
+        if pos is None:
+            if isinstance(date, str):
+                positions[date] = len(records)
+            records.append(entry)
+        else:
+            records[pos] = entry
+    return records
+
+
+def _updated_after(node, since):
+    if since is None:
+        return True
+    updated_at = node.get("updated_at") if isinstance(node, dict) else None
+    return isinstance(updated_at, (int, float)) and updated_at > since
+
+
+def _sort_value(node, field):
+    value = node.get(field) if isinstance(node, dict) else None
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 99999
+
+
+def _static_time(entry):
+    """静态数据的排序键：date 对应的 epoch 秒，无法解析时为 None（不进有序索引）。"""
+    return parse_static_date(_static_key(entry))
+
+
+class StorageBackend:
+    """
+    存储后端接口。uuid 可以为 None（旧的全局文件）。
+    返回的 dict/list 可能是共享对象（JSON 后端的文档缓存）：读者不要修改，写者在锁内修改后写回。
+    """
+
+    name = None
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        # (kind, uuid) -> 进程内修订号，每次写入加一（group commit 等待写盘时文件还没变）
+        self._revisions = {}
+        self._revisions_guard = threading.Lock()
+
+    def _bump(self, kind, uuid):
+        with self._revisions_guard:
+            key = (kind, uuid or "")
+            self._revisions[key] = self._revisions.get(key, 0) + 1
+
+    def version(self, kind, uuid=None):
+        """
+        kind/uuid 数据的版本号，用于 HTTP 缓存：返回 (token, mtime)。只做 stat，不读取内容；
+        数据变化（本进程或其它进程写入）时 token 一定变化。
+        """
+        # 修订号只在启用 group commit 时需要（修改还没写盘，文件 stat 不变）；
+        # 不用它时 token 只由文件 stat 决定，多个 worker 进程对同一份数据给出相同的 ETag
+        if storage.group_committer is not None:
+            with self._revisions_guard:
+                revision = self._revisions.get((kind, uuid or ""), 0)
+        else:
+            revision = 0
+        parts = [str(revision)]
+        mtime = None
+        for path in self._version_paths(kind, uuid):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                parts.append("-")
+                continue
+            parts.append(f"{st.st_mtime_ns:x}.{st.st_size:x}.{st.st_ino:x}")
+            mtime = st.st_mtime if mtime is None else max(mtime, st.st_mtime)
+        return ":".join(parts), mtime
+
+    def _version_paths(self, kind, uuid):
+        raise NotImplementedError
+
+    def document_path(self, kind, uuid=None):
+        """kind/uuid 对应的 JSON 文件路径，也用作 file_lock 的锁路径。"""
+        name = f"{kind}_{uuid}.json" if uuid else f"{kind}.json"
+        return os.path.join(self.data_dir, name)
+
+    # dashboard 配置（realtimesource）
+    def get_chart_config(self, uuid):
+        """返回配置 dict，tank 不存在时返回 None。"""
+        raise NotImplementedError
+
+    def set_chart_config(self, uuid, config):
+        raise NotImplementedError
+
+    def list_realtime_sources(self):
+        """返回配置了 realtimesource 的 [(uuid, url)]。"""
+        raise NotImplementedError
+
+    # dashboard 汇总（由静态/实时数据派生的物化文档，丢失后可以重建）
+    def load_dashboard_summary(self, uuid):
+        """返回汇总 dict，没有时返回 None。"""
+        raise NotImplementedError
+
+    def save_dashboard_summary(self, uuid, summary):
+        raise NotImplementedError
+
+    def delete_dashboard_summary(self, uuid):
+        """删除汇总（下次读取时从数据重建）。"""
+        raise NotImplementedError
+
+    # 静态数据（手动测试记录），按 date 覆盖
+    def static_uuids(self):
+        """有静态数据的 tank uuid 列表（没有 uuid 的旧数据记为 None）。"""
+        raise NotImplementedError
+
+    def static_entries(self, uuid):
+        """全部静态数据，保持写入顺序（覆盖的日期保留原位置）。"""
+        raise NotImplementedError
+
+    def rewrite_static(self, uuid, rewrite):
+        """
+        在写锁内读取全部静态数据，rewrite(entries) 返回新的记录列表（None 表示不变）后整体替换，
+        保持列表顺序。只用于显式执行的迁移。返回是否替换了。
+        """
+        raise NotImplementedError
+
+    def upsert_static(self, uuid, entry):
+        raise NotImplementedError
+
+    def upsert_static_many(self, uuid, entries):
+        """批量 upsert（同一日期后面的覆盖前面的），一次提交。"""
+        raise NotImplementedError
+
+    def static_latest(self, uuid, n):
+        """按日期最新的 n 条静态数据（按日期升序），日期无法解析的记录不计入。"""
+        raise NotImplementedError
+
+    def static_range(self, uuid, start=None, end=None):
+        """日期（epoch 秒）在 [start, end] 内的静态数据，按日期升序。"""
+        raise NotImplementedError
+
+    def iter_static(self, uuid, start=None, end=None):
+        """
+        逐条产出静态数据（导出用）：不限范围时按写入顺序给出全部记录（包括日期无法解析的），
+        否则同 static_range。
+        """
+        if start is None and end is None:
+            return iter(list(self.static_entries(uuid)))
+        return iter(self.static_range(uuid, start, end))
+
+    # 实时数据
+    def realtime_watermark(self, uuid):
+        """已入库的最后一条 time，没有则返回 None。"""
+        raise NotImplementedError
+
+    def append_realtime(self, uuid, readings):
+        """追加 Reading 序列，返回条数。中途失败时已写入的部分保留。"""
+        raise NotImplementedError
+
+    def read_realtime(self, uuid, cursor=0):
+        """读取 cursor 之后新增的实时数据，返回 ([(time, values)], 新 cursor)。"""
+        raise NotImplementedError
+
+    def iter_realtime(self, uuid, start=None, end=None):
+        """逐条产出 time 在 [start, end]（'YYYY-MM-DD HH:MM:SS'）内的 (time, values)，按时间顺序。"""
+        raise NotImplementedError
+
+    # story/summary 节点文档
+    def load_info(self, kind, uuid=None):
+        """节点以外的文档字段（header/footer/dashboard），文档不存在时返回 None。"""
+        raise NotImplementedError
+
+    def save_info(self, kind, uuid, info):
+        raise NotImplementedError
+
+    def load_nodes(self, kind, uuid=None):
+        """{node_id: node}，保持保存时的顺序。"""
+        raise NotImplementedError
+
+    def save_nodes(self, kind, uuid, nodes):
+        raise NotImplementedError
+
+    def iter_nodes(self, kind, uuid=None):
+        """按保存顺序逐个产出节点（导出用）。"""
+        return iter(list(self.load_nodes(kind, uuid).values()))
+
+    def get_node(self, kind, uuid, node_id):
+        """单个节点，不存在时返回 None。"""
+        raise NotImplementedError
+
+    def put_node(self, kind, uuid, node_id, node):
+        """写入单个节点：已存在时原位替换，否则追加到末尾。"""
+        raise NotImplementedError
+
+    def put_nodes(self, kind, uuid, nodes):
+        """批量写入 {node_id: node}（语义同 put_node），一次提交。"""
+        raise NotImplementedError
+
+    def delete_node(self, kind, uuid, node_id):
+        """删除单个节点，返回是否存在。"""
+        raise NotImplementedError
+
+    def reorder_nodes(self, kind, uuid, patches, sort_field="order"):
+        """
+        一次批量操作：把 patches（{node_id: {字段: 值}}）合并进对应节点，再按 sort_field
+        重新排序（没有该字段的排在最后，相同时保持原顺序）。不存在的 id 忽略。
+        """
+        raise NotImplementedError
+
+    def node_page(self, kind, uuid=None, limit=None, after=None, reverse=False, since=None):
+        """
+        按保存顺序（reverse=True 时倒序）分页读取节点：after 为上一页最后一个节点 id，
+        since 只返回 updated_at 晚于它的节点。返回 (nodes, next_cursor)，没有下一页时 cursor 为 None。
+        after 不存在时抛 KeyError。
+        """
+        raise NotImplementedError
+
+
+#############################################
+##           JSON Backend
+#############################################
+
+
+class JsonBackend(StorageBackend):
+    """
+    每个 uuid 一个 JSON 文件：data_<uuid>.json（配置 + 静态数据快照，新记录先进 data_<uuid>.wal）、
+    realtime_<uuid>.jsonl（实时数据日志）+ realtime_<uuid>.state.json（high-water mark）、
+    story_<uuid>.json / summary.json（节点文档）、dashboard_<uuid>.json（dashboard 汇总）。
+    """
+
+    name = "json"
+
+    def __init__(self, data_dir=DATA_DIR, compact_every=STATIC_WAL_COMPACT):
+        super().__init__(data_dir)
+        self.compact_every = compact_every
+        # 快照路径 -> SnapshotLog
+        self._static_logs = OrderedDict()
+        self._static_logs_guard = threading.Lock()
+        # 节点文档路径 -> (nodes 对象, 有序 id 列表, id -> 位置)
+        self._node_index = {}
+        self._node_index_guard = threading.Lock()
+
+    def list_uuids(self, prefix, suffix=".json"):
+        """扫描 data 目录中 <prefix>_<uuid><suffix> 文件，返回 uuid 列表（<prefix><suffix> 记为 None）。"""
+        uuids = []
+        if not os.path.isdir(self.data_dir):
+            return uuids
+        for name in sorted(os.listdir(self.data_dir)):
+            if name == prefix + suffix:
+                uuids.append(None)
+            elif name.startswith(prefix + "_") and name.endswith(suffix):
+                tank_uuid = name[len(prefix) + 1:-len(suffix)]
+                if "." not in tank_uuid:
+                    uuids.append(tank_uuid)
+        return uuids
+
+    def _version_paths(self, kind, uuid):
+        if kind == "data":
+            # 只 stat 文件，不打开（也不常驻）静态数据日志
+            return [self.document_path("data", uuid), self._static_wal_path(uuid)]
+        if kind == "realtime":
+            return [self._realtime_paths(uuid)[0]]
+        return [self.document_path(kind, uuid)]
+
+    def _load(self, path):
+        try:
+            return document_cache.load(path)
+        except Exception:
+            return None
+
+    def get_chart_config(self, uuid):
+        file_data = self._load(self.document_path("data", uuid))
+        if file_data is None:
+            return None
+        # 兼容 dict 和 list 文件结构
+        config = file_data if isinstance(file_data, dict) else {}
+        return {"realtimesource": config.get("realtimesource")}
+
+    def set_chart_config(self, uuid, config):
+        path = self.document_path("data", uuid)
+        data = self._load(path)
+        data = dict(data) if isinstance(data, dict) else {}
+        data.update(config)
+        save_json(path, data, ensure_ascii=False, indent=2)
+        self._bump("data", uuid)
+
+    def list_realtime_sources(self):
+        sources = []
+        for tank_uuid in self.list_uuids("data"):
+            if tank_uuid is None:
+                continue
+            url = (self.get_chart_config(tank_uuid) or {}).get("realtimesource")
+            if url:
+                sources.append((tank_uuid, url))
+        return sources
+
+    def load_dashboard_summary(self, uuid):
+        summary = self._load(self.document_path("dashboard", uuid))
+        return summary if isinstance(summary, dict) else None
+
+    def save_dashboard_summary(self, uuid, summary):
+        save_json(self.document_path("dashboard", uuid), summary, ensure_ascii=False)
+        self._bump("dashboard", uuid)
+
+    def delete_dashboard_summary(self, uuid):
+        path = self.document_path("dashboard", uuid)
+        with file_lock(path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            document_cache.invalidate(path)
+        self._bump("dashboard", uuid)
+
+    def _static_wal_path(self, uuid):
+        return os.path.join(self.data_dir, f"data_{uuid}.wal" if uuid else "data.wal")
+
+    def static_log(self, uuid):
+        """
+        静态数据的快照 + WAL（每个数据文件一个，常驻内存，最多 STATIC_LOG_CACHE_SIZE 个）。
+        被淘汰的实例仍在使用时不受影响：写入都在文件锁内，每个实例写之前会先同步文件的最新状态。
+        """
+        path = self.document_path("data", uuid)
+        with self._static_logs_guard:
+            log = self._static_logs.get(path)
+            if log is None:
+                log = self._static_logs[path] = SnapshotLog(
+                    path, self._static_wal_path(uuid), key=_static_key, compact_every=self.compact_every,
+                    dump_kwargs={"indent": 2}, sort_key=_static_time,
+                )
+                while len(self._static_logs) > STATIC_LOG_CACHE_SIZE:
+                    self._static_logs.popitem(last=False)
+            else:
+                self._static_logs.move_to_end(path)
+            return log
+
+    def static_uuids(self):
+        # 未压缩前的记录只在 WAL 里
+        uuids = set(self.list_uuids("data")) | set(self.list_uuids("data", ".wal"))
+        return sorted(uuids, key=lambda tank_uuid: tank_uuid or "")
+
+    def static_entries(self, uuid):
+        return self.static_log(uuid).records()
+
+    def rewrite_static(self, uuid, rewrite):
+        with file_lock(self.document_path("data", uuid)):
+            log = self.static_log(uuid)
+            records = rewrite(list(log.records()))
+            if records is None:
+                return False
+            log.rewrite(records)
+        self._bump("data", uuid)
+        return True
+
+    def upsert_static(self, uuid, entry):
+        # 只追加到 WAL，累计到一定条数后合并回快照
+        self.static_log(uuid).upsert(entry)
+        self._bump("data", uuid)
+
+    def upsert_static_many(self, uuid, entries):
+        self.static_log(uuid).upsert_many(list(entries))
+        self._bump("data", uuid)
+
+    def static_latest(self, uuid, n):
+        return self.static_log(uuid).latest(n)
+
+    def static_range(self, uuid, start=None, end=None):
+        return self.static_log(uuid).range(start, end)
+
+    def _realtime_paths(self, uuid):
+        return (
+            os.path.join(self.data_dir, f"realtime_{uuid}.jsonl"),
+            os.path.join(self.data_dir, f"realtime_{uuid}.state.json"),
+        )
+
+    def realtime_watermark(self, uuid):
+        _, state = self._realtime_paths(uuid)
+        if not os.path.exists(state):
+            return None
+        with open(state, "r") as f:
+            try:
+                return json.load(f).get("last_time")
+            except Exception:
+                return None
+
+    def append_realtime(self, uuid, readings):
+        log, state = self._realtime_paths(uuid)
+        last_time = self.realtime_watermark(uuid)
+        count = 0
+        try:
+            with open(log, "a") as f:
+                for reading in readings:
+                    f.write(json.dumps({"time": reading.time, **reading.values}) + "\n")
+                    if last_time is None or reading.time > last_time:
+                        last_time = reading.time
+                    count += 1
+        finally:
+            # 中途失败时，已写入的部分也记录 high-water mark，避免下次重复追加
+            if count:
+                write_json_atomic(state, {"last_time": last_time})
+                self._bump("realtime", uuid)
+        return count
+
+    def read_realtime(self, uuid, cursor=0):
+        log, _ = self._realtime_paths(uuid)
+        readings = []
+        if not os.path.exists(log) or os.path.getsize(log) <= cursor:
+            return readings, cursor
+        with open(log, "rb") as f:
+            f.seek(cursor)
+            for line in f:
+                # 只读取完整的行，写了一半的行下次再读
+                if not line.endswith(b"\n"):
+                    break
+                cursor += len(line)
+                try:
+                    obj = json.loads(line)
+                    ts = obj.pop("time")
+                    parse_time(ts)
+                except Exception:
+                    continue
+                readings.append((ts, obj))
+        return readings, cursor
+
+    def iter_realtime(self, uuid, start=None, end=None):
+        log, _ = self._realtime_paths(uuid)
+        if not os.path.exists(log):
+            return
+        # 只读到开始导出时的文件末尾，导出过程中追加的数据不包含在内
+        size = os.path.getsize(log)
+        with open(log, "rb") as f:
+            for line in f:
+                size -= len(line)
+                if size < 0 or not line.endswith(b"\n"):
+                    break
+                try:
+                    obj = json.loads(line)
+                    ts = obj.pop("time")
+                except Exception:
+                    continue
+                if start is not None and ts < start:
+                    continue
+                if end is not None and ts > end:
+                    # 日志按时间追加，后面不会再有范围内的数据
+                    break
+                yield ts, obj
+
+    def load_info(self, kind, uuid=None):
+        data = self._load(self.document_path(kind, uuid))
+        if not isinstance(data, dict):
+            return None
+        nodes_key = f"{kind}_nodes"
+        return {k: v for k, v in data.items() if k != nodes_key}
+
+    def save_info(self, kind, uuid, info):
+        path = self.document_path(kind, uuid)
+        nodes_key = f"{kind}_nodes"
+        data = self._load(path)
+        nodes = data.get(nodes_key, {}) if isinstance(data, dict) else {}
+        save_json(path, {**info, nodes_key: nodes}, ensure_ascii=False, indent=2)
+        self._bump(kind, uuid)
+
+    def load_nodes(self, kind, uuid=None):
+        data = self._load(self.document_path(kind, uuid))
+        return data.get(f"{kind}_nodes", {}) if isinstance(data, dict) else {}
+
+    def save_nodes(self, kind, uuid, nodes):
+        path = self.document_path(kind, uuid)
+        data = self._load(path)
+        data = dict(data) if isinstance(data, dict) else {}
+        data[f"{kind}_nodes"] = nodes
+        save_json(path, data, ensure_ascii=False, indent=2)
+        self._bump(kind, uuid)
+        with self._node_index_guard:
+            self._node_index.pop(path, None)
+
+    def get_node(self, kind, uuid, node_id):
+        return self.load_nodes(kind, uuid).get(node_id)
+
+    def put_node(self, kind, uuid, node_id, node):
+        # 整个文档仍然要写回（文件格式决定），但不再遍历、清理或排序其它节点
+        self.put_nodes(kind, uuid, {node_id: node})
+
+    def put_nodes(self, kind, uuid, nodes):
+        merged = dict(self.load_nodes(kind, uuid))
+        merged.update(nodes)
+        self.save_nodes(kind, uuid, merged)
+
+    def delete_node(self, kind, uuid, node_id):
+        nodes = self.load_nodes(kind, uuid)
+        if node_id not in nodes:
+            return False
+        nodes = dict(nodes)
+        del nodes[node_id]
+        self.save_nodes(kind, uuid, nodes)
+        return True
+
+    def reorder_nodes(self, kind, uuid, patches, sort_field="order"):
+        nodes = dict(self.load_nodes(kind, uuid))
+        for node_id, patch in patches.items():
+            if node_id in nodes:
+                nodes[node_id] = {**nodes[node_id], **patch}
+        items = sorted(nodes.items(), key=lambda item: _sort_value(item[1], sort_field))
+        self.save_nodes(kind, uuid, dict(items))
+
+    def _ordered_ids(self, kind, uuid, nodes):
+        """节点 id 的有序列表和 id -> 位置，按文档缓存中的 nodes 对象缓存，节点变化时重建。"""
+        path = self.document_path(kind, uuid)
+        with self._node_index_guard:
+            cached = self._node_index.get(path)
+            if cached is not None and cached[0] is nodes and len(cached[1]) == len(nodes):
+                return cached[1], cached[2]
+            ids = list(nodes)
+            positions = {node_id: pos for pos, node_id in enumerate(ids)}
+            self._node_index[path] = (nodes, ids, positions)
+            return ids, positions
+
+    def node_page(self, kind, uuid=None, limit=None, after=None, reverse=False, since=None):
+        nodes = self.load_nodes(kind, uuid)
+        ids, positions = self._ordered_ids(kind, uuid, nodes)
+        n = len(ids)
+        # i 为逻辑顺序（倒序时从最后一个开始）中的下标
+        if after is None:
+            i = 0
+        else:
+            pos = positions[after]
+            i = (n - 1 - pos if reverse else pos) + 1
+        page = []
+        last_id = None
+        while i < n and (limit is None or len(page) < limit):
+            node_id = ids[n - 1 - i if reverse else i]
+            node = nodes.get(node_id)
+            i += 1
+            if node is not None and _updated_after(node, since):
+                page.append(node)
+                last_id = node_id
+        return page, (last_id if i < n else None)
+
+
+#############################################
+##           SQLite Backend
+#############################################
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    kind TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (kind, uuid)
+);
+CREATE TABLE IF NOT EXISTS static_entries (
+    id INTEGER PRIMARY KEY,
+    uuid TEXT NOT NULL,
+    date TEXT NOT NULL,
+    ts INTEGER,
+    body TEXT NOT NULL,
+    UNIQUE (uuid, date)
+);
+CREATE TABLE IF NOT EXISTS realtime (
+    id INTEGER PRIMARY KEY,
+    uuid TEXT NOT NULL,
+    time TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS static_uuid_ts ON static_entries (uuid, ts);
+CREATE INDEX IF NOT EXISTS realtime_uuid_time ON realtime (uuid, time);
+CREATE INDEX IF NOT EXISTS realtime_uuid_id ON realtime (uuid, id);
+CREATE TABLE IF NOT EXISTS nodes (
+    kind TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (kind, uuid, id)
+);
+CREATE INDEX IF NOT EXISTS nodes_position ON nodes (kind, uuid, position);
+"""
+
+
+class SqliteBackend(StorageBackend):
+    """
+    单个 SQLite 数据库（WAL 模式，读写不互相阻塞）。每个线程一个连接；
+    每次写入是一个事务，实时数据按批提交，抓取时间长也不会一直占着写锁。
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=None, data_dir=DATA_DIR, batch_size=500):
+        super().__init__(data_dir)
+        self.path = path or os.path.join(data_dir, "reefing.db")
+        self.batch_size = batch_size
+        self._local = threading.local()
+
+    def _version_paths(self, kind, uuid):
+        # 所有数据在同一个库里：任何一次提交都会改变 WAL 文件
+        return [self.path, self.path + "-wal"]
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._upgrade(conn)
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _upgrade(conn):
+        """给旧库的 static_entries 补上 ts（日期排序键）列。"""
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(static_entries)")]
+        if not columns or "ts" in columns:
+            return
+        conn.execute("ALTER TABLE static_entries ADD COLUMN ts INTEGER")
+        rows = conn.execute("SELECT id, body FROM static_entries").fetchall()
+        conn.executemany(
+            "UPDATE static_entries SET ts = ? WHERE id = ?",
+            [(_static_time(json.loads(body)), row_id) for row_id, body in rows],
+        )
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        # 包括等待写锁的时间
+        with metrics.timer("reefing_sqlite_transaction_seconds"):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _get_document(self, kind, uuid):
+        row = self._connect().execute(
+            "SELECT body FROM documents WHERE kind = ? AND uuid = ?", (kind, uuid or "")
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _put_document(self, conn, kind, uuid, body):
+        conn.execute(
+            "INSERT INTO documents (kind, uuid, body) VALUES (?, ?, ?) "
+            "ON CONFLICT (kind, uuid) DO UPDATE SET body = excluded.body",
+            (kind, uuid or "", json.dumps(body, ensure_ascii=False)),
+        )
+
+    def get_chart_config(self, uuid):
+        return self._get_document("data", uuid)
+
+    def set_chart_config(self, uuid, config):
+        with self._transaction() as conn:
+            current = self._get_document("data", uuid) or {}
+            current.update(config)
+            self._put_document(conn, "data", uuid, current)
+        self._bump("data", uuid)
+
+    def load_dashboard_summary(self, uuid):
+        return self._get_document("dashboard", uuid)
+
+    def save_dashboard_summary(self, uuid, summary):
+        with self._transaction() as conn:
+            self._put_document(conn, "dashboard", uuid, summary)
+        self._bump("dashboard", uuid)
+
+    def delete_dashboard_summary(self, uuid):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM documents WHERE kind = 'dashboard' AND uuid = ?", (uuid or "",))
+        self._bump("dashboard", uuid)
+
+    def list_realtime_sources(self):
+        sources = []
+        rows = self._connect().execute(
+            "SELECT uuid, body FROM documents WHERE kind = 'data' AND uuid != '' ORDER BY uuid"
+        )
+        for tank_uuid, body in rows:
+            url = json.loads(body).get("realtimesource")
+            if url:
+                sources.append((tank_uuid, url))
+        return sources
+
+    def static_entries(self, uuid):
+        rows = self._connect().execute(
+            "SELECT body FROM static_entries WHERE uuid = ? ORDER BY id", (uuid or "",)
+        )
+        return [json.loads(body) for (body,) in rows]
+
+    def static_uuids(self):
+        rows = self._connect().execute("SELECT DISTINCT uuid FROM static_entries ORDER BY uuid")
+        return [tank_uuid or None for (tank_uuid,) in rows]
+
+    def rewrite_static(self, uuid, rewrite):
+        # 删除后按新顺序重新插入（id 递增，写入顺序不变）
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT body FROM static_entries WHERE uuid = ? ORDER BY id", (uuid or "",)
+            ).fetchall()
+            records = rewrite([json.loads(body) for (body,) in rows])
+            if records is None:
+                return False
+            conn.execute("DELETE FROM static_entries WHERE uuid = ?", (uuid or "",))
+            conn.executemany(
+                "INSERT INTO static_entries (uuid, date, ts, body) VALUES (?, ?, ?, ?)",
+                [
+                    (uuid or "", str(_static_key(entry) or ""), _static_time(entry),
+                     json.dumps(entry, ensure_ascii=False))
+                    for entry in records
+                ],
+            )
+        self._bump("data", uuid)
+        return True
+
+    def upsert_static(self, uuid, entry):
+        self.upsert_static_many(uuid, [entry])
+
+    def upsert_static_many(self, uuid, entries):
+        # 同一日期覆盖 body，id 不变（保持原位置）
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO static_entries (uuid, date, ts, body) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (uuid, date) DO UPDATE SET ts = excluded.ts, body = excluded.body",
+                [
+                    (
+                        uuid or "",
+                        str(_static_key(entry) or ""),
+                        _static_time(entry),
+                        json.dumps(entry, ensure_ascii=False),
+                    )
+                    for entry in entries
+                ],
+            )
+        self._bump("data", uuid)
+
+    def static_latest(self, uuid, n):
+        if n <= 0:
+            return []
+        rows = self._connect().execute(
+            "SELECT body FROM static_entries WHERE uuid = ? AND ts IS NOT NULL "
+            "ORDER BY ts DESC, id DESC LIMIT ?",
+            (uuid or "", n),
+        ).fetchall()
+        return [json.loads(body) for (body,) in reversed(rows)]
+
+    def static_range(self, uuid, start=None, end=None):
+        return [json.loads(body) for (body,) in self._static_rows(uuid, start, end)]
+
+    def _static_rows(self, uuid, start=None, end=None):
+        sql = "SELECT body FROM static_entries WHERE uuid = ? AND ts IS NOT NULL"
+        args = [uuid or ""]
+        if start is not None:
+            sql += " AND ts >= ?"
+            args.append(start)
+        if end is not None:
+            sql += " AND ts <= ?"
+            args.append(end)
+        return self._connect().execute(sql + " ORDER BY ts, id", args)
+
+    def realtime_watermark(self, uuid):
+        row = self._connect().execute(
+            "SELECT MAX(time) FROM realtime WHERE uuid = ?", (uuid or "",)
+        ).fetchone()
+        return row[0] if row else None
+
+    def append_realtime(self, uuid, readings):
+        count = 0
+        batch = []
+        try:
+            for reading in readings:
+                batch.append((uuid or "", reading.time, json.dumps(reading.values)))
+                if len(batch) >= self.batch_size:
+                    count += self._insert_realtime(batch)
+                    batch = []
+        finally:
+            # 中途失败时，已解析的部分也写入
+            if batch:
+                count += self._insert_realtime(batch)
+            if count:
+                self._bump("realtime", uuid)
+        return count
+
+    def _insert_realtime(self, batch):
+        with self._transaction() as conn:
+            conn.executemany("INSERT INTO realtime (uuid, time, body) VALUES (?, ?, ?)", batch)
+        return len(batch)
+
+    def read_realtime(self, uuid, cursor=0):
+        rows = self._connect().execute(
+            "SELECT id, time, body FROM realtime WHERE uuid = ? AND id > ? ORDER BY id",
+            (uuid or "", cursor),
+        )
+        readings = []
+        for row_id, ts, body in rows:
+            readings.append((ts, json.loads(body)))
+            cursor = row_id
+        return readings, cursor
+
+    def iter_realtime(self, uuid, start=None, end=None):
+        sql = "SELECT time, body FROM realtime WHERE uuid = ?"
+        args = [uuid or ""]
+        if start is not None:
+            sql += " AND time >= ?"
+            args.append(start)
+        if end is not None:
+            sql += " AND time <= ?"
+            args.append(end)
+        # 游标逐行读取，不一次性取出全部结果
+        for ts, body in self._connect().execute(sql + " ORDER BY time, id", args):
+            yield ts, json.loads(body)
+
+    def iter_static(self, uuid, start=None, end=None):
+        if start is not None or end is not None:
+            rows = self._static_rows(uuid, start, end)
+        else:
+            rows = self._connect().execute(
+                "SELECT body FROM static_entries WHERE uuid = ? ORDER BY id", (uuid or "",)
+            )
+        return (json.loads(body) for (body,) in rows)
+
+    def iter_nodes(self, kind, uuid=None):
+        rows = self._connect().execute(
+            "SELECT body FROM nodes WHERE kind = ? AND uuid = ? ORDER BY position", (kind, uuid or "")
+        )
+        return (json.loads(body) for (body,) in rows)
+
+    def load_info(self, kind, uuid=None):
+        return self._get_document(kind, uuid)
+
+    def save_info(self, kind, uuid, info):
+        with self._transaction() as conn:
+            self._put_document(conn, kind, uuid, info)
+        self._bump(kind, uuid)
+
+    def load_nodes(self, kind, uuid=None):
+        rows = self._connect().execute(
+            "SELECT id, body FROM nodes WHERE kind = ? AND uuid = ? ORDER BY position",
+            (kind, uuid or ""),
+        )
+        return {node_id: json.loads(body) for node_id, body in rows}
+
+    def save_nodes(self, kind, uuid, nodes):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM nodes WHERE kind = ? AND uuid = ?", (kind, uuid or ""))
+            conn.executemany(
+                "INSERT INTO nodes (kind, uuid, id, position, body) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (kind, uuid or "", node_id, position, json.dumps(node, ensure_ascii=False))
+                    for position, (node_id, node) in enumerate(nodes.items())
+                ],
+            )
+        self._bump(kind, uuid)
+
+    def get_node(self, kind, uuid, node_id):
+        row = self._connect().execute(
+            "SELECT body FROM nodes WHERE kind = ? AND uuid = ? AND id = ?", (kind, uuid or "", node_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_node(self, kind, uuid, node_id, node):
+        self.put_nodes(kind, uuid, {node_id: node})
+
+    def put_nodes(self, kind, uuid, nodes):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO nodes (kind, uuid, id, position, body) VALUES (?, ?, ?, "
+                "(SELECT COALESCE(MAX(position), -1) + 1 FROM nodes WHERE kind = ? AND uuid = ?), ?) "
+                "ON CONFLICT (kind, uuid, id) DO UPDATE SET body = excluded.body",
+                [
+                    (kind, uuid or "", node_id, kind, uuid or "", json.dumps(node, ensure_ascii=False))
+                    for node_id, node in nodes.items()
+                ],
+            )
+        self._bump(kind, uuid)
+
+    def delete_node(self, kind, uuid, node_id):
+        with self._transaction() as conn:
+            deleted = conn.execute(
+                "DELETE FROM nodes WHERE kind = ? AND uuid = ? AND id = ?", (kind, uuid or "", node_id)
+            ).rowcount
+        if deleted:
+            self._bump(kind, uuid)
+        return bool(deleted)
+
+    def reorder_nodes(self, kind, uuid, patches, sort_field="order"):
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, body FROM nodes WHERE kind = ? AND uuid = ? ORDER BY position", (kind, uuid or "")
+            ).fetchall()
+            nodes = []
+            changed = []
+            for node_id, body in rows:
+                node = json.loads(body)
+                if node_id in patches:
+                    node.update(patches[node_id])
+                    changed.append((json.dumps(node, ensure_ascii=False), kind, uuid or "", node_id))
+                nodes.append((node_id, node))
+            conn.executemany("UPDATE nodes SET body = ? WHERE kind = ? AND uuid = ? AND id = ?", changed)
+            nodes.sort(key=lambda item: _sort_value(item[1], sort_field))
+            conn.executemany(
+                "UPDATE nodes SET position = ? WHERE kind = ? AND uuid = ? AND id = ?",
+                [(position, kind, uuid or "", node_id) for position, (node_id, _) in enumerate(nodes)],
+            )
+        self._bump(kind, uuid)
+
+    def node_page(self, kind, uuid=None, limit=None, after=None, reverse=False, since=None):
+        conn = self._connect()
+        sql = "SELECT id, body FROM nodes WHERE kind = ? AND uuid = ?"
+        args = [kind, uuid or ""]
+        if after is not None:
+            row = conn.execute(
+                "SELECT position FROM nodes WHERE kind = ? AND uuid = ? AND id = ?", (kind, uuid or "", after)
+            ).fetchone()
+            if row is None:
+                raise KeyError(after)
+            sql += " AND position < ?" if reverse else " AND position > ?"
+            args.append(row[0])
+        if since is not None:
+            sql += " AND json_extract(body, '$.updated_at') > ?"
+            args.append(since)
+        sql += " ORDER BY position DESC" if reverse else " ORDER BY position"
+        if limit is not None:
+            # 多取一条判断是否还有下一页
+            sql += " LIMIT ?"
+            args.append(limit + 1)
+        rows = conn.execute(sql, args).fetchall()
+        more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if limit is not None else rows
+        page = [json.loads(body) for _, body in rows]
+        return page, (rows[-1][0] if more and rows else None)
+
+
+#############################################
+##           Backend Selection & Migration
+#############################################
+_backend = None
+_backend_guard = threading.Lock()
+
+
+def get_backend():
+    """按 REEFING_STORAGE（json/sqlite）创建的全局后端。"""
+    global _backend
+    with _backend_guard:
+        if _backend is None:
+            kind = os.environ.get("REEFING_STORAGE", "json").lower()
+            if kind == "sqlite":
+                _backend = SqliteBackend(os.environ.get("REEFING_SQLITE_PATH") or None)
+            elif kind == "json":
+                _backend = JsonBackend()
+            else:
+                raise ValueError(f"Unknown REEFING_STORAGE: {kind}")
+        return _backend
+
+
+def migrate_json_to_sqlite(source=None, target=None):
+    """
+    把 JSON 文件中的全部数据导入 SQLite（可重复执行：配置和节点整体覆盖，静态数据按日期覆盖，
+    实时数据只导入比目标库中最后一条更新的部分）。返回各类数据的条数。
+    """
+    source = source or JsonBackend()
+    target = target or SqliteBackend()
+    counts = {"tanks": 0, "static": 0, "realtime": 0, "documents": 0, "nodes": 0}
+    for tank_uuid in source.list_uuids("data"):
+        config = source.get_chart_config(tank_uuid)
+        if config is not None:
+            target.set_chart_config(tank_uuid, config)
+            counts["tanks"] += 1
+        for entry in source.static_entries(tank_uuid):
+            target.upsert_static(tank_uuid, entry)
+            counts["static"] += 1
+    for tank_uuid in source.list_uuids("realtime", ".jsonl"):
+        since = target.realtime_watermark(tank_uuid)
+        readings, _ = source.read_realtime(tank_uuid, 0)
+        counts["realtime"] += target.append_realtime(
+            tank_uuid, (Reading(ts, values) for ts, values in readings if since is None or ts > since)
+        )
+    for kind in NODE_KINDS:
+        for doc_uuid in source.list_uuids(kind):
+            info = source.load_info(kind, doc_uuid)
+            if info is None:
+                continue
+            nodes = source.load_nodes(kind, doc_uuid)
+            target.save_info(kind, doc_uuid, info)
+            target.save_nodes(kind, doc_uuid, nodes)
+            counts["documents"] += 1
+            counts["nodes"] += len(nodes)
+    return counts
+
+
+def migrate_static_dates(backend=None, today=None):
+    """
+    显式执行的一次性迁移：把旧版本存下的没有年份的静态数据日期（'Mon DD'）补全为 'YYYY-MM-DD'，
+    原值保存在 raw_date，改过的 tank 删除汇总（下次读取时重建）。可重复执行。返回 tank 数和记录数。
+    """
+    backend = backend or get_backend()
+    counts = {"tanks": 0, "entries": 0}
+
+    def undated(entries):
+        return sum(1 for entry in entries if _static_time(entry) is None)
+
+    def rewrite(entries):
+        records = _resolve_static_dates(entries, today)
+        if records is not None:
+            counts["entries"] += undated(entries) - undated(records)
+        return records
+
+    for tank_uuid in backend.static_uuids():
+        if backend.rewrite_static(tank_uuid, rewrite):
+            backend.delete_dashboard_summary(tank_uuid)
+            counts["tanks"] += 1
+    return counts
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["migrate"]:
+        db_path = sys.argv[2] if len(sys.argv) > 2 else os.environ.get("REEFING_SQLITE_PATH")
+        print(json.dumps(migrate_json_to_sqlite(target=SqliteBackend(db_path or None))))
+    elif sys.argv[1:2] == ["migrate-dates"]:
+        print(json.dumps(migrate_static_dates()))
+    else:
+        print("usage: python src/backends.py migrate [sqlite_path] | migrate-dates")
+        sys.exit(2)
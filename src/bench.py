@@ -0,0 +1,379 @@
+"""
+bench.py
+性能基准：生成合成的 tank 数据（静态数据、由 standin 提供的 controller 实时数据、带图片的
+story/summary 节点），分别测 store 方法、Flask 路由（test client）和并发负载，
+输出 p50/p95/p99 延迟、吞吐和峰值 RSS（JSON），用于不同版本之间对比。
+
+    python src/bench.py --sizes 10,10000 --output bench.json
+    python src/bench.py --sizes 10,10000 --backend sqlite --baseline bench.json
+
+所有数据写在临时目录里（REEFING_DATA_DIR / REEFING_IMAGE_DIR），不影响 src/data。
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_SIZES = "10,1000,10000"
+# 并发负载的请求组合（路径模板，{tank}/{story} 替换为当前规模的 uuid）
+LOAD_MIX = (
+    "/dashboard/mini?uuid={tank}",
+    "/dashboard/info?uuid={tank}",
+    "/dashboard/series?uuid={tank}&params=PH,ORP,N",
+    "/api/story?uuid={story}&limit=20",
+    "/api/summary?limit=50",
+    "/api/story/info?uuid={story}",
+)
+
+
+def peak_rss_mb():
+    """进程至今的峰值 RSS（MB）。"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位是 KB，macOS 上是字节
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize(samples, elapsed=None):
+    """延迟样本（秒）的统计，elapsed 为总耗时（并发负载时用于计算吞吐）。"""
+    if not samples:
+        return {"n": 0}
+    ms = np.asarray(samples) * 1000
+    elapsed = elapsed if elapsed is not None else float(np.sum(samples))
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "n": len(samples),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "ops_per_sec": round(len(samples) / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def measure(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def measure_once(fn):
+    start = time.perf_counter()
+    fn()
+    return summarize([time.perf_counter() - start])
+
+
+def synthetic_images(count=4):
+    """生成几张不同的 PNG（有 Pillow 时为 800x600 的渐变图，否则为 1x1 像素图）。"""
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+    images = []
+    for i in range(count):
+        if Image is not None:
+            img = Image.linear_gradient("L").resize((800, 600)).convert("RGB")
+            img.putpixel((0, 0), (i, i, i))
+            buf = io.BytesIO()
+            img.save(buf, "PNG")
+            images.append(buf.getvalue())
+        else:
+            images.append(
+                b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x02\x00\x00\x00\x90wS"
+                b"\xde\x00\x00\x00\x0cIDATx\x9cc" + bytes([i, i, i]) + b"\x00\x00\x00\x04\x00\x01\x00\x00\x00\x00IEND\xaeB`\x82"
+            )
+    return images
+
+
+class Bench:
+    def __init__(self, args, controller):
+        # 环境变量已在 main() 里设置好，这里再导入
+        from app import app
+        from backends import get_backend
+        from data_store import ChartDataStore
+        from data_store import StoryDataStore
+        from data_store import SummaryDataStore
+        from data_store import get_store
+        from images import store_image
+
+        self.args = args
+        self.app = app
+        self.backend = get_backend()
+        self.get_store = get_store
+        self.ChartDataStore = ChartDataStore
+        self.StoryDataStore = StoryDataStore
+        self.SummaryDataStore = SummaryDataStore
+        self.store_image = store_image
+        self.controller = controller
+        self.rng = random.Random(args.seed)
+        self.client = app.test_client()
+
+    def repeat(self, size):
+        """大数据量时减少重复次数，避免单项跑太久。"""
+        if size <= 10000:
+            return self.args.repeat
+        return max(3, self.args.repeat * 10000 // size)
+
+    # 数据生成
+    def populate(self, size):
+        tank, story = f"tank-{size}", f"story-{size}"
+        base = datetime.date(2000, 1, 1)
+        entries = []
+        for i in range(size):
+            entries.append({
+                "date": (base + datetime.timedelta(days=i)).isoformat(),
+                "N": round(self.rng.uniform(0, 10), 2),
+                "P": round(self.rng.uniform(0, 0.2), 3),
+                "CA": self.rng.randint(380, 460),
+                "MG": self.rng.randint(1250, 1450),
+                "KH": round(self.rng.uniform(6.5, 9), 1),
+            })
+            if len(entries) >= 10000:
+                self.backend.upsert_static_many(tank, entries)
+                entries = []
+        if entries:
+            self.backend.upsert_static_many(tank, entries)
+
+        self.controller.feeds.pop(tank, None)
+        self.controller.fill(tank, count=size, seed=self.args.seed)
+        self.backend.set_chart_config(tank, {"realtimesource": self.controller.url(tank)})
+
+        urls = [self.store_image(iter([data]))["url"] for data in synthetic_images()]
+        now = time.time()
+
+        def make_nodes(count, ordered):
+            nodes = {}
+            for i in range(count):
+                node_id = f"n{i:08d}"
+                nodes[node_id] = {
+                    "id": node_id,
+                    "title": f"Node {i}",
+                    "content": "Lorem ipsum dolor sit amet, " * 4,
+                    "color": "#3388ff",
+                    "avatar_image": urls[i % len(urls)],
+                    "original_image": urls[i % len(urls)],
+                    "updated_at": round(now - count + i, 3),
+                }
+                if ordered:
+                    nodes[node_id]["order"] = i
+            return nodes
+
+        self.backend.save_nodes("story", story, make_nodes(size, False))
+        self.backend.save_nodes("summary", None, make_nodes(min(size, self.args.summary_size), True))
+        return tank, story
+
+    # store 方法
+    def bench_store(self, size, tank, story):
+        repeat = self.repeat(size)
+        chart = self.get_store(self.ChartDataStore, tank)
+        story_store = self.get_store(self.StoryDataStore, story)
+        url = self.controller.url(tank)
+        dates = iter(datetime.date(1900, 1, 1) + datetime.timedelta(days=i) for i in range(repeat + 1))
+        mid = datetime.date(2000, 1, 1) + datetime.timedelta(days=size // 2)
+        results = {
+            "static.save_static_data": measure(
+                lambda: chart.save_static_data({"date": next(dates).isoformat(), "KH": 8.0}), repeat
+            ),
+            "static.load_static_data": measure(chart.load_static_data, repeat),
+            "static.latest_one": measure(chart.latest_one, repeat),
+            "static.range_30d": measure(
+                lambda: chart.range(mid.isoformat(), (mid + datetime.timedelta(days=30)).isoformat()), repeat
+            ),
+            # 首次增量抓取：解析并写入全部 size 条读数
+            "realtime.ingest_cold": measure_once(lambda: chart.refresh_realtime_log(url)),
+            # 没有新数据的增量抓取：只按 high-water mark 跳过
+            "realtime.refresh_warm": measure(lambda: chart.refresh_realtime_log(url), max(3, repeat // 5)),
+            "realtime.load_realtime_data": measure(chart.load_realtime_data, repeat),
+            "story.get_story_nodes": measure(story_store.get_story_nodes, repeat),
+            "story.list_story_nodes": measure(lambda: story_store.list_story_nodes(limit=20), repeat),
+            "story.update_story_node": measure(
+                lambda: story_store.update_story_node("n00000000", {"title": "updated"}), repeat
+            ),
+        }
+        return results
+
+    # Flask 路由（test client，单线程）
+    def bench_routes(self, size, tank, story):
+        repeat = self.repeat(size)
+        client = self.client
+
+        def get(path, **kwargs):
+            def run():
+                response = client.get(path, **kwargs)
+                assert response.status_code in (200, 304), (path, response.status_code)
+            return run
+
+        etag = client.get(f"/api/story?uuid={story}&limit=20").headers.get("ETag")
+        return {
+            "GET /api/story": measure(get(f"/api/story?uuid={story}"), repeat),
+            "GET /api/story?limit=20": measure(get(f"/api/story?uuid={story}&limit=20"), repeat),
+            "GET /api/story?limit=20 (304)": measure(
+                get(f"/api/story?uuid={story}&limit=20", headers={"If-None-Match": etag or ""}), repeat
+            ),
+            "GET /api/summary?limit=50": measure(get("/api/summary?limit=50"), repeat),
+            "GET /dashboard": measure(get(f"/dashboard?uuid={tank}"), repeat),
+            "GET /dashboard/summary": measure(get(f"/dashboard/summary?uuid={tank}"), repeat),
+            "GET /dashboard/mini": measure(get(f"/dashboard/mini?uuid={tank}"), repeat),
+            "GET /dashboard/series": measure(get(f"/dashboard/series?uuid={tank}&params=PH,ORP,N"), repeat),
+            "POST /dashboard": measure(
+                lambda: client.post(f"/dashboard?uuid={tank}", json={"date": "1899-12-31", "KH": 8.1}), repeat
+            ),
+        }
+
+    # 并发负载
+    def bench_load(self, size, tank, story):
+        paths = [p.format(tank=tank, story=story) for p in LOAD_MIX]
+        deadline = time.perf_counter() + self.args.duration
+        samples = {path: [] for path in paths}
+        errors = [0]
+        guard = threading.Lock()
+
+        def worker(seed):
+            client = self.app.test_client()
+            rng = random.Random(seed)
+            local = {path: [] for path in paths}
+            failed = 0
+            while time.perf_counter() < deadline:
+                path = rng.choice(paths)
+                start = time.perf_counter()
+                response = client.get(path)
+                local[path].append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    failed += 1
+            with guard:
+                for path, values in local.items():
+                    samples[path].extend(values)
+                errors[0] += failed
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            list(pool.map(worker, range(self.args.concurrency)))
+        elapsed = time.perf_counter() - start
+        everything = [value for values in samples.values() for value in values]
+        return {
+            "concurrency": self.args.concurrency,
+            "duration_s": round(elapsed, 2),
+            "errors": errors[0],
+            "all": summarize(everything, elapsed),
+            "routes": {path.split("?")[0]: summarize(values, elapsed) for path, values in samples.items()},
+        }
+
+    def run(self):
+        results = {}
+        for size in self.args.sizes:
+            start = time.perf_counter()
+            tank, story = self.populate(size)
+            result = {"populate_s": round(time.perf_counter() - start, 2)}
+            result["store"] = self.bench_store(size, tank, story)
+            result["routes"] = self.bench_routes(size, tank, story)
+            if self.args.duration > 0:
+                result["load"] = self.bench_load(size, tank, story)
+            result["peak_rss_mb"] = peak_rss_mb()
+            results[str(size)] = result
+            print(f"size {size} done in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        return results
+
+
+def compare(current, baseline):
+    """与上一次结果对比：每个指标的 p50/p95 比值（>1 表示变慢）。"""
+    changes = {}
+
+    def walk(cur, base, path):
+        if not isinstance(cur, dict) or not isinstance(base, dict):
+            return
+        if "p95_ms" in cur and base.get("p95_ms"):
+            changes[path] = {
+                "p50_ratio": round(cur["p50_ms"] / base["p50_ms"], 3) if base.get("p50_ms") else None,
+                "p95_ratio": round(cur["p95_ms"] / base["p95_ms"], 3),
+            }
+            return
+        for key, value in cur.items():
+            walk(value, base.get(key), f"{path}/{key}" if path else key)
+
+    walk(current.get("results"), baseline.get("results"), "")
+    return changes
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="reefing.memory benchmarks")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help=f"record counts per synthetic tank, comma-separated (default {DEFAULT_SIZES})")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--repeat", type=int, default=50, help="samples per measurement (default 50)")
+    parser.add_argument("--summary-size", type=int, default=200, help="max summary nodes (default 200)")
+    parser.add_argument("--concurrency", type=int, default=8, help="load generator threads (default 8)")
+    parser.add_argument("--duration", type=float, default=5.0,
+                        help="seconds of concurrent load per size, 0 to skip (default 5)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="previous JSON report to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary data directory")
+    args = parser.parse_args(argv)
+    args.sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="reefing-bench-")
+    os.environ["REEFING_DATA_DIR"] = os.path.join(workdir, "data")
+    os.environ["REEFING_IMAGE_DIR"] = os.path.join(workdir, "images")
+    os.environ["REEFING_STORAGE"] = args.backend
+    os.environ.pop("REEFING_SQLITE_PATH", None)
+    os.makedirs(os.environ["REEFING_DATA_DIR"])
+
+    from standin import StandInController
+
+    try:
+        with StandInController() as controller:
+            results = Bench(args, controller).run()
+    finally:
+        if args.keep:
+            print(f"data kept in {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "backend": args.backend,
+            "sizes": args.sizes,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare(report, json.load(f))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
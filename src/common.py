@@ -3,32 +3,303 @@ common.py
 通用工具方法文件。可在此添加 logger、通用校验、格式化、转换等方法。
 """
 
+import atexit
+import bisect
+import functools
 import logging
 import logging.handlers
+import os
+import queue
+import threading
+import time
+
+#############################################
+##           Logging
+#############################################
+# 日志级别、输出（syslog/file/stderr，逗号分隔）和队列大小
+LOG_LEVEL = os.environ.get("REEFING_LOG_LEVEL", "INFO").upper()
+LOG_SINKS = os.environ.get("REEFING_LOG_SINKS", "syslog")
+LOG_FILE = os.environ.get("REEFING_LOG_FILE") or os.path.join(os.path.dirname(__file__), "logs", "reefing.log")
+LOG_FILE_MAX_BYTES = int(os.environ.get("REEFING_LOG_FILE_MAX_BYTES", 10 * 1024 * 1024))
+LOG_FILE_BACKUPS = int(os.environ.get("REEFING_LOG_FILE_BACKUPS", 5))
+LOG_QUEUE_SIZE = int(os.environ.get("REEFING_LOG_QUEUE_SIZE", 10000))
+SYSLOG_ADDRESSES = ("/dev/log", "/var/run/syslog")
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志并计数，不阻塞调用线程。"""
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _syslog_handler():
+    for address in SYSLOG_ADDRESSES:
+        if os.path.exists(address):
+            try:
+                return logging.handlers.SysLogHandler(address=address)
+            except OSError:
+                continue
+    return None
+
+
+# 多进程部署时关闭自带轮转（见 disable_log_rotation）
+_rotate_log_file = True
+
+
+def _file_handler(path):
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if not _rotate_log_file:
+            return logging.handlers.WatchedFileHandler(path, encoding="utf-8")
+        return logging.handlers.RotatingFileHandler(
+            path, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding="utf-8"
+        )
+    except OSError:
+        return None
+
+
+def build_sinks(names=LOG_SINKS):
+    """按名字创建输出 handler；不可用的跳过，一个都没有时退回 stderr。返回 [(名字, handler)]。"""
+    sinks = []
+    for name in (n.strip().lower() for n in names.split(",")):
+        if name == "syslog":
+            handler = _syslog_handler()
+        elif name == "file":
+            handler = _file_handler(LOG_FILE)
+        elif name == "stderr":
+            handler = logging.StreamHandler()
+        else:
+            handler = None
+        if handler is not None:
+            sinks.append((name, handler))
+    if not sinks:
+        sinks.append(("stderr", logging.StreamHandler()))
+    return sinks
+
+
+_listener = None
+_queue_handler = None
+_sink_names = []
+
 
 def setup_logger(name="REEFING"):
-    """Configure and return a logger with syslog handler."""
+    """
+    日志经有界队列交给后台线程写出（QueueHandler/QueueListener），请求线程里只做一次入队；
+    队列满时丢弃并计数。级别由 REEFING_LOG_LEVEL，输出由 REEFING_LOG_SINKS 配置。
+    """
+    global _listener, _queue_handler, _sink_names
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(LOG_LEVEL)
 
-    # Remove any existing handlers
+    if _listener is not None:
+        _listener.stop()
+    for handler in logger.handlers:
+        handler.close()
     logger.handlers = []
 
-    # Create syslog handler
-    syslog_handler = logging.handlers.SysLogHandler(address="/dev/log")
-    syslog_handler.setLevel(logging.DEBUG)
-
-    # Create formatter
     formatter = logging.Formatter("%(name)s: %(levelname)s - %(message)s")
-    syslog_handler.setFormatter(formatter)
+    sinks = build_sinks()
+    for _, handler in sinks:
+        handler.setFormatter(formatter)
+    _sink_names = [sink_name for sink_name, _ in sinks]
 
-    # Add handler to logger
-    logger.addHandler(syslog_handler)
+    _queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *(h for _, h in sinks))
+    _listener.start()
+    logger.addHandler(_queue_handler)
 
     # Prevent propagation to root logger
     logger.propagate = False
 
     return logger
 
+
+def disable_log_rotation():
+    """
+    多进程部署时 file 输出改用 WatchedFileHandler：每个 worker 各自按大小轮转同一个文件会互相覆盖，
+    改由 logrotate 等外部工具轮转，各进程发现文件被换掉后重新打开。返回是否重建了 file 输出。
+    """
+    global _rotate_log_file
+    if not _rotate_log_file:
+        return False
+    _rotate_log_file = False
+    if "file" not in _sink_names:
+        return False
+    setup_logger()
+    return True
+
+
+def log_stats():
+    return {
+        "sinks": list(_sink_names),
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+    }
+
+
+@atexit.register
+def _flush_logs():
+    # 退出前写完队列里剩下的日志
+    if _listener is not None:
+        _listener.stop()
+
+
 # Global logger instance
 logger = setup_logger()
+
+
+#############################################
+##           Metrics
+#############################################
+# 延迟直方图的桶（秒）和大小直方图的桶（字节）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+# 每个指标最多的标签组合数（例如 uuid 很多时），超出的都记到 "_other"
+METRICS_MAX_SERIES = int(os.environ.get("REEFING_METRICS_MAX_SERIES", 1000))
+
+
+class _Timer:
+    """metrics.timer() 的返回值：既是上下文管理器，也是装饰器。退出后 elapsed 为耗时（秒）。"""
+
+    __slots__ = ("metrics", "name", "labels", "start", "elapsed")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.start = None
+        self.elapsed = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.metrics.observe(self.name, self.elapsed, **self.labels)
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Timer(self.metrics, self.name, self.labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class Metrics:
+    """
+    进程内指标：计数器（inc）和直方图（observe / timer），标签用关键字参数给出。
+    render() 输出 Prometheus 文本格式；add_collector 注册在导出时才读取的 gauge（缓存统计等）。
+    """
+
+    def __init__(self, max_series=METRICS_MAX_SERIES):
+        self.max_series = max_series
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def _series(self, table, labels, create):
+        key = tuple(sorted(labels.items()))
+        series = table.get(key)
+        if series is None:
+            if len(table) >= self.max_series:
+                key = tuple((k, "_other") for k, _ in key)
+                series = table.get(key)
+                if series is not None:
+                    return series
+            series = table[key] = create()
+        return series
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            series = self._series(self._counters.setdefault(name, {}), labels, lambda: [0])
+            series[0] += value
+
+    def observe(self, name, value, buckets=None, **labels):
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = (buckets or LATENCY_BUCKETS, {})
+            bounds, table = self._histograms[name]
+            # [每个桶的计数..., +Inf 桶, sum]
+            series = self._series(table, labels, lambda: [0] * (len(bounds) + 1) + [0.0])
+            series[bisect.bisect_left(bounds, value)] += 1
+            series[-1] += value
+
+    def timer(self, name, **labels):
+        """with metrics.timer("x_seconds", op="load"): ... 或 @metrics.timer("x_seconds")"""
+        return _Timer(self, name, labels)
+
+    def add_collector(self, collector):
+        """collector() 返回 [(name, {labels}, value)]，导出时作为 gauge；以 _total 结尾的作为 counter（只增不减）。"""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = {name: {key: series[0] for key, series in table.items()} for name, table in self._counters.items()}
+            histograms = {
+                name: (bounds, {key: list(series) for key, series in table.items()})
+                for name, (bounds, table) in self._histograms.items()
+            }
+        for name, table in sorted(counters.items()):
+            self._header(lines, name, "counter")
+            for key, value in table.items():
+                lines.append(f"{name}{_labels(key)} {value}")
+        for name, (bounds, table) in sorted(histograms.items()):
+            self._header(lines, name, "histogram")
+            for key, series in table.items():
+                total = 0
+                for bound, count in zip(bounds + (float("inf"),), series):
+                    total += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_labels(key + (('le', le),))} {total}")
+                lines.append(f"{name}_sum{_labels(key)} {series[-1]:.6f}")
+                lines.append(f"{name}_count{_labels(key)} {total}")
+        gauges = {}
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    gauges.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        for name, samples in sorted(gauges.items()):
+            self._header(lines, name, "counter" if name.endswith("_total") else "gauge")
+            for key, value in samples:
+                lines.append(f"{name}{_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines, name, kind):
+        if name in self._help:
+            lines.append(f"# HELP {name} {self._help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in key) + "}"
+
+
+# 全局指标
+metrics = Metrics()
+metrics.add_collector(lambda: [
+    ("reefing_log_queue_depth", {}, log_stats()["queued"]),
+    ("reefing_log_dropped_total", {}, log_stats()["dropped"]),
+])
@@ -1,238 +1,922 @@
+from backends import get_backend
 from common import logger
+from common import metrics
+from images import lookup_image
+from images import save_base64_image
+from realtime import PROBES
+from realtime import ParseStats
+from realtime import Reading
+from realtime import extract_values
+from realtime import fetch_readings
+from realtime import iter_readings
+from realtime import realtime_cache
+from storage import file_lock
+from timeseries import BUCKETS
+from timeseries import WEEK_ORIGIN
+from timeseries import TimeSeries
+from timeseries import format_time
+from timeseries import format_times
+from timeseries import full_static_date
+from timeseries import lttb
+from timeseries import parse_static_date
+from timeseries import parse_time
+from timeseries import round_column
+from timeseries import round_values
 import numpy as np
+import collections
+import functools
 import json
+import math
 import os
-import requests
+import threading
+import time
 import uuid
+import weakref
+
+# 是否启用实时数据增量模式（本地日志 + high-water mark）
+REALTIME_INCREMENTAL = os.environ.get("REEFING_REALTIME_INCREMENTAL", "1") != "0"
+
+# 实时数据列（controller 上报的探头）
+REALTIME_COLUMNS = ("ORP", "PH", "T")
+# 手动测试的静态数据列
+STATIC_COLUMNS = ("N", "P", "CA", "MG", "KH")
+# 导出 story/summary 节点为 CSV 时默认的列
+NODE_COLUMNS = ("id", "title", "content", "color", "avatar_image", "original_image", "order", "updated_at")
+# /dashboard/series 默认的目标点数和均值小数位
+DEFAULT_SERIES_POINTS = 500
+MEAN_DECIMALS = 2
+# dashboard 汇总：带上最近多少条静态记录（添加记录弹窗前后翻页用），保留最近多少周的周统计
+SUMMARY_RECENT_STATIC = 20
+SUMMARY_WEEKS = max(1, int(os.environ.get("REEFING_SUMMARY_WEEKS", 52)))
+WEEK_SECONDS = BUCKETS["week"]
+
+# 常驻内存的列式实时数据最多保留多少个 tank（LRU，淘汰后下次访问从存储重新读取）
+REALTIME_SERIES_CACHE_SIZE = max(1, int(os.environ.get("REEFING_REALTIME_SERIES_CACHE_SIZE", 32)))
+
+# 锁只在有人持有时保留（弱引用），不会随 uuid 无限增长
+_realtime_locks = weakref.WeakValueDictionary()
+_realtime_locks_guard = threading.Lock()
+# (后端, uuid) -> [TimeSeries, 后端读取游标]，LRU
+_realtime_series = collections.OrderedDict()
+_realtime_series_guard = threading.Lock()
+
+
+_background_polling = False
+
+
+def _locked(path_attr):
+    """装饰器：整个 read-modify-write 在数据文件锁内执行，并发请求不会互相覆盖。"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with file_lock(getattr(self, path_attr)):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _timed(op):
+    """装饰器：按 kind/op/uuid 记录 store 方法的耗时（包括等锁的时间）。"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with metrics.timer("reefing_store_seconds", kind=self.kind, op=op, uuid=self.uuid or ""):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_background_polling(enabled):
+    """后台 poller 运行时，请求只读取本地已抓取的数据，不再直连 controller。"""
+    global _background_polling
+    _background_polling = bool(enabled)
+
+
+def list_realtime_sources():
+    """返回配置了 realtimesource 的 [(uuid, url)]。"""
+    return get_backend().list_realtime_sources()
+
+
+def _realtime_lock(key):
+    """每个 uuid 一把锁，避免并发追加同一段数据。"""
+    with _realtime_locks_guard:
+        lock = _realtime_locks.get(key)
+        if lock is None:
+            lock = _realtime_locks[key] = threading.RLock()
+        return lock
+
+
+def _static_bound(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    ts = parse_static_date(value)
+    if ts is None:
+        raise ValueError(f"Invalid date: {value}")
+    return ts
+
+
+def _realtime_bound(value):
+    """实时数据的时间范围边界，统一成日志里的 'YYYY-MM-DD HH:MM:SS'，无法解析时抛 ValueError。"""
+    if value is None:
+        return None
+    return format_time(parse_time(value))
+
+
+def _static_values(entry):
+    """静态记录里的数值字段（date/time 以外的 int/float）。"""
+    return {
+        k: v for k, v in entry.items()
+        if k not in ("date", "time") and isinstance(v, (int, float)) and not isinstance(v, bool)
+    }
+
+
+#############################################
+##           Dashboard summary
+#############################################
+# 每个 tank 一份物化的汇总文档：最近 SUMMARY_WEEKS 周的按周统计（周一开始），以及由它得到的
+# 各参数最新值和最小/最大值。
+# 写入静态/实时数据时增量更新，/dashboard 页面直接用它渲染，图表序列再按需请求 /dashboard/series。
+
+def _week_start(ts):
+    return ts - (ts - WEEK_ORIGIN) % WEEK_SECONDS
+
+
+def _empty_summary(uuid):
+    return {
+        "uuid": uuid,
+        "static": {"weeks": [], "latest": {}, "ranges": {}, "recent": []},
+        "realtime": {"count": 0, "watermark": None, "weeks": [], "latest": {}, "ranges": {}},
+    }
+
+
+def _add_value(stats, name, value, ts):
+    """把一个读数计入 stats[name]（count/sum/mean/min/max 和按时间最新的 last）。"""
+    s = stats.get(name)
+    if s is None:
+        s = stats[name] = {"count": 0, "sum": 0, "mean": value, "min": value, "max": value, "last": value, "time": ts}
+    s["count"] += 1
+    s["sum"] += value
+    s["mean"] = round(s["sum"] / s["count"], MEAN_DECIMALS)
+    s["min"] = min(s["min"], value)
+    s["max"] = max(s["max"], value)
+    if ts >= s["time"]:
+        s["last"] = value
+        s["time"] = ts
+
+
+def _merge_stats(stats, other):
+    """把 other（时间上更晚的一段）的统计合并进 stats。"""
+    for name, o in other.items():
+        s = stats.get(name)
+        if s is None:
+            stats[name] = dict(o)
+            continue
+        s["count"] += o["count"]
+        s["sum"] += o["sum"]
+        s["mean"] = round(s["sum"] / s["count"], MEAN_DECIMALS)
+        s["min"] = min(s["min"], o["min"])
+        s["max"] = max(s["max"], o["max"])
+        s["last"] = o["last"]
+        s["time"] = o["time"]
+
+
+def _finish_section(section):
+    """只保留最近 SUMMARY_WEEKS 周，再由周统计得到各参数的最新值和最小/最大值。"""
+    del section["weeks"][:-SUMMARY_WEEKS]
+    section["latest"] = latest = {}
+    section["ranges"] = ranges = {}
+    for week in section["weeks"]:
+        for name, s in week["values"].items():
+            latest[name] = {"value": s["last"], "time": s["time"]}
+            r = ranges.get(name)
+            if r is None:
+                ranges[name] = {"min": s["min"], "max": s["max"]}
+            else:
+                r["min"] = min(r["min"], s["min"])
+                r["max"] = max(r["max"], s["max"])
+
+
+def _static_week(week_ts, entries):
+    """一周内的静态记录（按日期升序）汇总成 {"week": 周一日期, "values": {参数: 统计}}。"""
+    values = {}
+    for entry in entries:
+        ts = parse_static_date(entry.get("date"))
+        if ts is None:
+            continue
+        day = format_time(ts)[:10]
+        for name, value in _static_values(entry).items():
+            _add_value(values, name, value, day)
+    return {"week": format_time(week_ts)[:10], "values": values}
+
+
+class _RealtimeFolder:
+    """
+    把按时间追加的实时读数折叠进汇总的 realtime 部分（默认折叠进一个空的增量，之后用 merge_into 合并）。
+    不晚于 watermark 的读数忽略。
+    """
+
+    def __init__(self, section=None):
+        self.section = section if section is not None else _empty_summary(None)["realtime"]
+        self.first = None
+        self._day = None
+        self._week = None
+
+    def add(self, ts, values):
+        section = self.section
+        if section["watermark"] is not None and ts <= section["watermark"]:
+            return
+        if ts[:10] != self._day:
+            # 同一天的读数属于同一周，只在日期变化时计算周
+            self._day = ts[:10]
+            week = format_time(_week_start(parse_time(self._day)))[:10]
+            weeks = section["weeks"]
+            if not weeks or weeks[-1]["week"] != week:
+                weeks.append({"week": week, "values": {}})
+            self._week = weeks[-1]["values"]
+        for name, value in values.items():
+            _add_value(self._week, name, value, ts)
+        if self.first is None:
+            self.first = ts
+        section["watermark"] = ts
+        section["count"] += 1
+
+    def extend(self, readings):
+        for ts, values in readings:
+            self.add(ts, values)
+        return self
+
+    def tap(self, readings):
+        """边产出边折叠（写入存储的同时计算增量，不在内存里保留整批读数）。"""
+        for reading in readings:
+            self.add(*reading)
+            yield reading
+
+    def merge_into(self, section):
+        """把增量合并进已有的 realtime 部分（增量的读数都晚于 section 的 watermark）。"""
+        delta = self.section
+        for week in delta["weeks"]:
+            if section["weeks"] and section["weeks"][-1]["week"] == week["week"]:
+                _merge_stats(section["weeks"][-1]["values"], week["values"])
+            else:
+                section["weeks"].append(week)
+        section["count"] += delta["count"]
+        section["watermark"] = delta["watermark"]
+
+
+def project_nodes(nodes, fields=None):
+    """字段投影：只保留 fields 中的字段（id 总是保留），fields 为空时原样返回。"""
+    if not fields:
+        return list(nodes)
+    keep = set(fields) | {"id"}
+    return [{k: v for k, v in node.items() if k in keep} for node in nodes]
+
+
+def scrub_node(node):
+    """清理节点里残留的 base64：data URL 形式的 image 字段和 *base64 字段。"""
+    if (
+        "image" in node
+        and isinstance(node["image"], str)
+        and node["image"].startswith("data:image/")
+    ):
+        node.pop("image")
+    for k in list(node.keys()):
+        if k.endswith("base64"):
+            node.pop(k)
+    return node
+
+
+def _prepare_node(node_data):
+    """写入前处理传入的节点数据：记录修改时间、换成图片 URL、清理 base64。"""
+    node_data["updated_at"] = round(time.time(), 3)
+    attach_node_images(node_data)
+    return scrub_node(node_data)
+
+
+def _bulk_error(index, error):
+    return {"index": index, "ok": False, "error": str(error)}
+
+
+def _bulk_objects(items, results):
+    """批量导入：逐条产出 (index, item)，不是 JSON 对象（或解析失败）的条目直接记为错误。"""
+    for index, item in enumerate(items):
+        if isinstance(item, Exception):
+            results.append(_bulk_error(index, item))
+        elif not isinstance(item, dict):
+            results.append(_bulk_error(index, "Item must be a JSON object"))
+        else:
+            yield index, item
 
 
-def save_node_image(node_id, image_base64):
-    """保存 base64 图片到 images 目录，返回图片路径"""
+def save_node_image(image_base64):
+    """保存 base64 图片（按内容去重，后台生成缩略图），返回图片 URL"""
     if not image_base64:
         return None
-    import base64
-    image_data = image_base64.split(",", 1)[-1]
-    image_bytes = base64.b64decode(image_data)
-    
-    image_dir = os.path.join(os.path.dirname(__file__), "static/images")
-    os.makedirs(image_dir, exist_ok=True)
-    image_path = os.path.join(image_dir, f"{node_id}.png")
-    with open(image_path, "wb") as f:
-        f.write(image_bytes)
-    return f"static/images/{node_id}.png"
+    return save_base64_image(image_base64)
+
+
+def attach_node_images(node_data):
+    """
+    把节点数据里的图片换成图片 URL：avatar_image_id/original_image_id 为 /api/images 上传返回的 id，
+    旧的 *_image_base64 仍然支持。id 不存在时抛 ImageError。
+    """
+    for field in ("avatar_image", "original_image"):
+        image_id = node_data.pop(f"{field}_id", None)
+        image_base64 = node_data.pop(f"{field}_base64", None)
+        if image_id:
+            node_data[field] = lookup_image(image_id)
+        elif image_base64:
+            node_data[field] = save_node_image(image_base64)
 
 
 class ChartDataStore:
-    
-    def __init__(self, uuid=None):
-        if uuid:
-            self.filename = os.path.join(os.path.dirname(__file__), "data", f"data_{uuid}.json")
-        else:
-            self.filename = os.path.join(os.path.dirname(__file__), "data", "data.json")
+    kind = "data"
+
+    def __init__(self, uuid=None, backend=None):
+        self.uuid = uuid
+        self.backend = backend or get_backend()
+        # 数据文件路径（JSON 后端的存储位置，也是 read-modify-write 的锁路径）
+        self.filename = self.backend.document_path("data", uuid)
+        # 追加实时数据时的跨进程锁路径
+        self.realtime_lock_path = self.backend.document_path("realtime", uuid)
+        # dashboard 汇总的 read-modify-write 锁路径
+        self.summary_path = self.backend.document_path("dashboard", uuid)
 
     def get_dashboard_info(self):
-        # 只返回 realtimesource 字段，兼容 dict 和 list 文件结构
-        config = {}
-        if os.path.exists(self.filename):
-            with open(self.filename, "r") as f:
-                try:
-                    file_data = json.load(f)
-                except Exception:
-                    file_data = {}
-            if isinstance(file_data, dict):
-                config = file_data
-            else:
-                config = {}
+        # 只返回 realtimesource 字段
+        config = self.backend.get_chart_config(self.uuid) or {}
         return {"realtimesource": config.get("realtimesource")}
 
+    @_locked("filename")
     def set_dashboard_info(self, config):
-        data = {}
-        if os.path.exists(self.filename):
-            with open(self.filename, "r") as f:
-                try:
-                    data = json.load(f)
-                except Exception:
-                    data = {}
         if "realtimesource" in config:
-            data["realtimesource"] = config["realtimesource"]
-        with open(self.filename, "w") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+            self.backend.set_chart_config(self.uuid, {"realtimesource": config["realtimesource"]})
 
+    def static_entries(self):
+        """全部静态数据（按写入顺序），共享列表，不要修改。"""
+        return self.backend.static_entries(self.uuid)
+
+    def latest(self, n):
+        """按日期最新的 n 条静态数据（按日期升序）。"""
+        return self.backend.static_latest(self.uuid, n)
+
+    def latest_one(self):
+        """最新的一条静态数据，没有时返回 None。"""
+        data = self.latest(1)
+        return data[0] if data else None
+
+    def range(self, start=None, end=None):
+        """
+        日期在 [start, end] 内的静态数据（按日期升序）。start/end 可以是 'YYYY-MM-DD'、'Mon DD'
+        或 epoch 秒，无法解析时抛 ValueError。
+        """
+        return self.backend.static_range(self.uuid, _static_bound(start), _static_bound(end))
+
+    def export_static(self, start=None, end=None):
+        """
+        逐条产出静态数据（导出用）。不给范围时按写入顺序给出全部记录，否则按日期升序给出范围内的记录。
+        边界无法解析时立即抛 ValueError（在开始产出之前）。
+        """
+        return self.backend.iter_static(self.uuid, _static_bound(start), _static_bound(end))
+
+    def export_realtime(self, start=None, end=None):
+        """逐条产出 {"time", 列...}（按时间升序），边界无法解析时立即抛 ValueError。"""
+        rows = self.backend.iter_realtime(self.uuid, _realtime_bound(start), _realtime_bound(end))
+        return ({"time": ts, **values} for ts, values in rows)
+
+    @_timed("load_static_data")
     def load_static_data(self):
-        if not os.path.exists(self.filename):
+        # 最多返回最新的20行，不再每次读取并排序全部历史
+        data = self.latest(20)
+        if not data and self.backend.get_chart_config(self.uuid) is None:
             return {"labels": [], "values": []}
-        with open(self.filename, "r") as f:
-            file_data = json.load(f)
-        # 如果是 dict，提取 static data
-        data = file_data.get("data", [])
-        # 限制最多返回20行（最后的）
-        if isinstance(data, list):
-            data = sorted(data, key=lambda d: d.get("time", ""))
-            data = data[-20:]
         return data
 
+    @_timed("save_static_data")
+    @_locked("filename")
     def save_static_data(self, data):
-        # Load existing data
-        realtimesource = None
-        if os.path.exists(self.filename):
-            with open(self.filename, "r") as f:
-                try:
-                    file_data = json.load(f)
-                except Exception:
-                    file_data = []
-            # 如果是 dict，提取 realtimesource 和 static data
-            realtimesource = file_data.get("realtimesource")
-            all_data = file_data.get("data", [])
-        else:
-            all_data = []
-        # 查找是否有同日期记录
-        found = False
-        for idx, entry in enumerate(all_data):
-            if entry.get("date") == data.get("date"):
-                all_data[idx] = data
-                found = True
-                break
-        if not found:
-            all_data.append(data)
-        # Save back, 保留 realtimesource 字段
-        if realtimesource is not None:
-            save_obj = {"realtimesource": realtimesource, "data": all_data}
-        else:
-            save_obj = {"data": all_data}
-        with open(self.filename, "w") as f:
-            json.dump(save_obj, f, indent=2)
-
-    def load_realtime_data(self, url=None):
+        # 日期补全年份后存储，同日期的记录覆盖旧值
+        date = full_static_date(data.get("date"))
+        if date is None:
+            raise ValueError(f"Invalid date: {data.get('date')}")
+        data = dict(data, date=date)
+        self.backend.upsert_static(self.uuid, data)
+        self._summary_changed(lambda summary: self._refresh_static_summary(summary, [data]))
+
+    @_timed("import_static")
+    @_locked("filename")
+    def import_static(self, items):
+        """
+        批量导入静态数据（每条必须有可解析的 date，'Mon DD' 补全为 'YYYY-MM-DD'），整批一次写入。
+        返回 {"written": 条数, "results": [{"index", "ok", "date"（存储的日期）或 "error"}]}。
+        """
+        results = []
+        entries = []
+        for index, item in _bulk_objects(items, results):
+            date = full_static_date(item.get("date"))
+            if date is None:
+                results.append(_bulk_error(index, f"Invalid date: {item.get('date')}"))
+                continue
+            entries.append(dict(item, date=date))
+            results.append({"index": index, "ok": True, "date": date})
+        if entries:
+            self.backend.upsert_static_many(self.uuid, entries)
+            self._summary_changed(lambda summary: self._refresh_static_summary(summary, entries))
+        results.sort(key=lambda r: r["index"])
+        return {"written": len(entries), "results": results}
+
+    @_timed("import_realtime")
+    def import_realtime(self, items):
+        """
+        批量导入实时读数：每条为 controller 格式 {"time", "content"}，或 {"time", "ORP", "PH", "T"}。
+        实时日志只能按时间追加，不晚于已入库数据（或本批中更早条目）的读数记为 skipped。
+        数值按探头注册的转换存储（与轮询入库一致）；出现未注册的探头名时抛 ValueError，整批不写入。
+        """
+        unknown = sorted({
+            key for item in items if isinstance(item, dict) and "content" not in item
+            for key in item if key != "time" and key not in PROBES
+        })
+        if unknown:
+            # 未注册的探头没有对应的列和类型转换，整批拒绝，不做部分写入
+            raise ValueError(f"Unknown probes: {', '.join(unknown)}")
+        results = []
+        readings = []
+        for index, item in _bulk_objects(items, results):
+            try:
+                ts = format_time(parse_time(item.get("time")))
+                if "content" in item:
+                    values = extract_values(item["content"])
+                    if values is None:
+                        raise ValueError("Missing required probes")
+                else:
+                    values = {
+                        name: PROBES[name].convert(item[name]) for name in REALTIME_COLUMNS
+                        if item.get(name) is not None
+                    }
+                    if not values:
+                        raise ValueError(f"No values for {', '.join(REALTIME_COLUMNS)}")
+            except (ValueError, TypeError) as e:
+                results.append(_bulk_error(index, e))
+                continue
+            readings.append((ts, index, values))
+        readings.sort(key=lambda r: (r[0], r[1]))
+        accepted = []
+        with _realtime_lock((self.backend.name, self.uuid)), file_lock(self.realtime_lock_path):
+            last = self.get_realtime_watermark()
+            for ts, index, values in readings:
+                if last is not None and ts <= last:
+                    results.append({"index": index, "ok": False, "skipped": True, "time": ts,
+                                    "error": "Not newer than stored readings"})
+                    continue
+                last = ts
+                accepted.append(Reading(ts, values))
+                results.append({"index": index, "ok": True, "time": ts})
+            written = self.backend.append_realtime(self.uuid, accepted) if accepted else 0
+            if written:
+                self._realtime_summary_changed(_RealtimeFolder().extend(accepted))
+        results.sort(key=lambda r: r["index"])
+        return {"written": written, "results": results}
+
+    def get_realtime_url(self):
+        config = self.backend.get_chart_config(self.uuid)
+        return config.get("realtimesource") if config else None
+
+    @_timed("load_realtime_data")
+    def load_realtime_data(self, url=None, use_cache=True):
         # 如果未指定 url，则尝试从 dashboard 配置读取
         if url is None:
-            # 兼容 dict 和 list 文件结构
-            if os.path.exists(self.filename):
-                with open(self.filename, "r") as f:
-                    try:
-                        file_data = json.load(f)
-                    except Exception:
-                        file_data = {}
-                if isinstance(file_data, dict):
-                    url = file_data.get("realtimesource")
-                else:
-                    url = None
-            else:
-                url = None
+            url = self.get_realtime_url()
+        if not url:
+            return []
+        # 有 uuid 时走增量模式：与 /dashboard 共用 refresh_realtime 抓取，再从本地日志返回
+        if self.uuid and REALTIME_INCREMENTAL:
+            self.refresh_realtime(url, use_cache)
+            return self.load_realtime_log()
+        loader = lambda: self.fetch_realtime_data(url)
         try:
-            resp = requests.get(url, timeout=10)
-            raw = resp.json()
-            lines = raw.get("data", "").split("\n")
-            cleaned = []
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                    time = obj.get("time")
-                    content = obj.get("content", "")
-                    vals = {}
-                    for entry in content.split("\n"):
-                        entry = entry.strip()
-                        if entry.startswith("ORP"):
-                            vals["ORP"] = float(entry.split()[1])
-                        elif entry.startswith("PH"):
-                            vals["PH"] = float(entry.split()[1])
-                        elif entry.startswith("T"):
-                            vals["T"] = float(entry.split()[1])
-                    if "ORP" in vals and "PH" in vals and "T" in vals:
-                        cleaned.append(
-                            {
-                                "time": time,
-                                "ORP": int(round(vals["ORP"])),
-                                "PH": round(vals["PH"], 1),
-                                "T": vals["T"],
-                            }
-                        )
-                except Exception:
-                    continue
-
-            # 按小时分组（不做时间筛选）
-            def get_hour(ts):
-                return ts[:13] if ts else ""
-
-            hour_map = {}
-            for d in cleaned:
-                hour = get_hour(d["time"])
-                if hour not in hour_map:
-                    hour_map[hour] = []
-                hour_map[hour].append(d)
-
-            filtered = []
-            for hour, entries in hour_map.items():
-                filtered.extend(entries)
-            print(
-                f"Filtered {len(cleaned)} entries to {len(filtered)} after hour grouping (no time limit)"
-            )
-
-            # 按时间倒序返回所有数据（不限制行数）
-            filtered_sorted = sorted(filtered, key=lambda d: d["time"], reverse=True)
-            print(
-                f"Processed {len(filtered_sorted)} entries from real-time data after hour grouping"
-            )
-
-            # 如果没有数据，返回空列表
-            if not filtered_sorted:
-                return []
-
-            return filtered_sorted
+            # 同一 uuid 在 TTL 内复用结果，并发请求合并为一次抓取；缓存的是列式数据，记录列表按需生成
+            series = realtime_cache.get((self.uuid, url), loader) if use_cache else loader()
+            return series.to_records(reverse=True)
         except Exception as e:
-            print(f"Error loading real-time data: {e}")
+            logger.warning(f"Error loading real-time data for {self.uuid}: {type(e).__name__}: {e}")
             return []
 
+    def refresh_realtime(self, url=None, use_cache=True):
+        """
+        增量抓取的唯一入口（/dashboard、/dashboard/series 和 load_realtime_data 共用）：没有后台 poller 时，
+        按 realtime 缓存的 TTL 对每个 (uuid, url) 抓取一次（并发请求合并），只写入本地日志和汇总，不读出数据。
+        后台 poller 运行时什么也不做。抓取失败只记日志，调用方照常读取已入库的数据。
+        """
+        if not self.uuid or not REALTIME_INCREMENTAL or _background_polling:
+            return
+        if url is None:
+            url = self.get_realtime_url()
+        if not url:
+            return
+        try:
+            if use_cache:
+                realtime_cache.get((self.uuid, url), lambda: self.ingest_realtime_data(url))
+            else:
+                self.ingest_realtime_data(url)
+        except Exception as e:
+            logger.warning(f"Error refreshing real-time data for {self.uuid}: {type(e).__name__}: {e}")
+
+    @_timed("fetch_realtime_data")
+    def fetch_realtime_data(self, url):
+        """直接从 controller 流式抓取并解析实时数据（不走缓存），返回列式的 TimeSeries，失败时抛异常。"""
+        stats = ParseStats()
+        series = TimeSeries(REALTIME_COLUMNS)
+        with metrics.timer("reefing_realtime_parse_seconds", mode="full") as timer:
+            series.extend(fetch_readings(url, stats))
+
+        logger.info(f"Processed {len(series)} real-time entries in {timer.elapsed * 1000:.1f}ms: {stats}")
+        return series
+
+    def refresh_realtime_log(self, url):
+        """增量抓取后返回本地日志中的全部实时数据（按时间倒序）。"""
+        self.ingest_realtime_data(url)
+        return self.load_realtime_log()
+
+    def ingest_realtime_data(self, url):
+        """
+        流式抓取 controller 数据，只完整解析比 high-water mark 更新的行并追加到本地日志。
+        返回新增的条数。
+        """
+        return self._append_readings(lambda stats, since: fetch_readings(url, stats, since=since))
+
+    def ingest_realtime_lines(self, lines):
+        """把已经取回的 controller 数据行（例如后台 poller 抓到的）增量写入本地日志。"""
+        return self._append_readings(lambda stats, since: iter_readings(lines, stats, since=since))
+
+    @_timed("ingest_realtime")
+    def _append_readings(self, make_readings):
+        stats = ParseStats()
+        # 进程内一把线程锁，再加跨进程的文件锁（多个 worker 不会重复追加同一段数据）
+        with _realtime_lock((self.backend.name, self.uuid)), file_lock(self.realtime_lock_path):
+            since = self.get_realtime_watermark()
+            folder = _RealtimeFolder()
+            with metrics.timer("reefing_realtime_parse_seconds", mode="incremental") as timer:
+                count = self.backend.append_realtime(self.uuid, folder.tap(make_readings(stats, since)))
+            if count:
+                self._realtime_summary_changed(folder)
+        metrics.inc("reefing_realtime_ingested_total", count, uuid=self.uuid or "")
+        logger.info(
+            f"Ingested {count} new real-time entries for {self.uuid} in {timer.elapsed * 1000:.1f}ms: {stats}"
+        )
+        return count
+
+    def get_realtime_watermark(self):
+        """返回已入库的最后一条 time，没有则返回 None。"""
+        return self.backend.realtime_watermark(self.uuid)
 
-class StoryDataStore:
-    def __init__(self, uuid=None):
-        if uuid:
-            self.data_path = os.path.join(os.path.dirname(__file__), "data", f"story_{uuid}.json")
+    def realtime_series(self):
+        """
+        返回该 uuid 的列式实时数据（常驻内存，最多 REALTIME_SERIES_CACHE_SIZE 个 tank）。
+        首次访问时读取全部已入库数据，之后只读取新增的部分。
+        """
+        key = (self.backend.name, self.uuid)
+        with _realtime_lock(key):
+            with _realtime_series_guard:
+                entry = _realtime_series.get(key)
+                if entry is None:
+                    entry = _realtime_series[key] = [TimeSeries(REALTIME_COLUMNS), 0]
+                _realtime_series.move_to_end(key)
+                while len(_realtime_series) > REALTIME_SERIES_CACHE_SIZE:
+                    _realtime_series.popitem(last=False)
+            series, cursor = entry
+            readings, entry[1] = self.backend.read_realtime(self.uuid, cursor)
+            series.extend(readings)
+            return series
+
+    def load_realtime_log(self):
+        """读取本地实时数据，按时间倒序返回。"""
+        if not self.uuid:
+            return []
+        return self.realtime_series().to_records(reverse=True)
+
+
+    def static_series(self):
+        """把全部静态数据转换为列式时间序列（按日期排序）。"""
+        series = TimeSeries(STATIC_COLUMNS)
+        readings = []
+        for entry in self.range():
+            ts = parse_static_date(entry.get("date"))
+            if ts is None:
+                continue
+            readings.append((ts, _static_values(entry)))
+        series.extend(readings)
+        return series
+
+    @_timed("dashboard_summary")
+    def get_dashboard_summary(self):
+        """
+        物化的 dashboard 汇总：{"uuid", "static": {weeks, latest, ranges, recent}, "realtime": {count,
+        watermark, weeks, latest, ranges}}。共享对象，不要修改。
+        还没有汇总（旧数据）时从全部数据重建；实时数据比汇总新时（例如增量更新失败）只补上新增的部分。
+        """
+        summary = self.backend.load_dashboard_summary(self.uuid)
+        watermark = self.get_realtime_watermark()
+        if summary is None and watermark is None and not self.latest(1):
+            if self.backend.get_chart_config(self.uuid) is None:
+                # 不存在的 tank 不写文件
+                return _empty_summary(self.uuid)
+        if summary is None or summary["realtime"]["watermark"] != watermark:
+            summary = self._update_summary(self._fold_new_readings)
+        return summary
+
+    def _build_summary(self):
+        summary = _empty_summary(self.uuid)
+        self._refresh_static_summary(summary)
+        _RealtimeFolder(summary["realtime"]).extend(self.backend.iter_realtime(self.uuid))
+        _finish_section(summary["realtime"])
+        return summary
+
+    def _update_summary(self, update):
+        """在汇总锁内对汇总的副本执行 update(summary) 并写回，还没有汇总时先重建。返回新的汇总。"""
+        with file_lock(self.summary_path):
+            summary = self.backend.load_dashboard_summary(self.uuid)
+            # 缓存里的是共享对象，改之前先复制（JSON 往返比 deepcopy 快）
+            summary = self._build_summary() if summary is None else json.loads(json.dumps(summary))
+            update(summary)
+            _finish_section(summary["static"])
+            _finish_section(summary["realtime"])
+            self.backend.save_dashboard_summary(self.uuid, summary)
+            return summary
+
+    def _summary_changed(self, update):
+        """数据写入后更新汇总。汇总是派生数据，失败只记日志，不影响已经完成的写入。"""
+        try:
+            self._update_summary(update)
+        except Exception as e:
+            logger.warning(f"Error updating dashboard summary for {self.uuid}: {type(e).__name__}: {e}")
+
+    def _realtime_summary_changed(self, folder):
+        """把刚追加的读数（folder 里的增量）合并进汇总，调用方持有实时数据锁。"""
+        def update(summary):
+            realtime = summary["realtime"]
+            if realtime["watermark"] is None or realtime["watermark"] < folder.first:
+                folder.merge_into(realtime)
+            else:
+                # 汇总已经包含其中一部分（其它进程读取时补上的），从存储补齐剩下的
+                self._fold_new_readings(summary)
+        self._summary_changed(update)
+
+    def _fold_new_readings(self, summary):
+        realtime = summary["realtime"]
+        _RealtimeFolder(realtime).extend(self.backend.iter_realtime(self.uuid, start=realtime["watermark"]))
+
+    def _refresh_static_summary(self, summary, entries=None):
+        """重新计算 entries 所在的周（None 时全部重算）和最近的记录。"""
+        static = summary["static"]
+        if entries is None:
+            weeks = {}
+            groups = collections.defaultdict(list)
+            for entry in self.range():
+                ts = parse_static_date(entry.get("date"))
+                if ts is not None:
+                    groups[_week_start(ts)].append(entry)
         else:
-            self.data_path = os.path.join(os.path.dirname(__file__), "data", "story.json")
+            weeks = {week["week"]: week for week in static["weeks"]}
+            dates = (parse_static_date(entry.get("date")) for entry in entries)
+            starts = {_week_start(ts) for ts in dates if ts is not None}
+            groups = {w: self.backend.static_range(self.uuid, w, w + WEEK_SECONDS - 1) for w in starts}
+        for week_ts, group in groups.items():
+            week = _static_week(week_ts, group)
+            if week["values"]:
+                weeks[week["week"]] = week
+            else:
+                weeks.pop(week["week"], None)
+        static["weeks"] = [weeks[key] for key in sorted(weeks)]
+        _finish_section(static)
+        static["recent"] = [dict(entry) for entry in self.latest(SUMMARY_RECENT_STATIC)]
 
-    def load_data(self):
-        if os.path.exists(self.data_path):
-            with open(self.data_path, "r") as f:
-                return json.load(f)
+    @_timed("get_series")
+    def get_series(self, params, start=None, end=None, bucket=None, points=None, mode="stats"):
+        """
+        服务端聚合的图表数据。mode="stats" 时按 bucket（minute/hour/day/week）或目标点数 points
+        分桶，返回每桶 min/mean/max/count；mode="lttb" 时返回 LTTB 降采样后的原始点。
+        参数不合法时抛 ValueError。
+        """
+        if mode not in ("stats", "lttb"):
+            raise ValueError(f"Unknown mode: {mode}")
+        if bucket is not None and bucket not in BUCKETS:
+            raise ValueError(f"Unknown bucket: {bucket}")
+        if points is not None and points < 1:
+            raise ValueError("points must be positive")
+        static = realtime = None
+        result = {}
+        for name in params:
+            if name in STATIC_COLUMNS:
+                if static is None:
+                    static = self.static_series()
+                series = static
+            else:
+                if realtime is None:
+                    # 只做（带缓存的）增量抓取，不生成记录列表，然后直接读常驻的列式数据
+                    self.refresh_realtime()
+                    realtime = self.realtime_series()
+                series = realtime
+            result[name] = self._series_payload(series, name, start, end, bucket, points, mode)
+        return {"mode": mode, "bucket": bucket, "series": result}
+
+    def _series_payload(self, series, name, start, end, bucket, points, mode):
+        times, cols = series.slice(start, end, [name])
+        values = cols.get(name)
+        if mode == "lttb":
+            if values is None:
+                return {"time": [], "value": []}
+            valid = ~np.isnan(values)
+            t, v = lttb(times[valid], values[valid], points or DEFAULT_SERIES_POINTS)
+            return {"time": format_times(t), "value": round_column(name, v)}
+
+        if bucket:
+            seconds = BUCKETS[bucket]
+        elif points and len(times):
+            seconds = max(BUCKETS["minute"], math.ceil((int(times[-1]) - int(times[0]) + 1) / points))
+        else:
+            seconds = BUCKETS["hour"]
+        payload = {"bucket_seconds": seconds, "time": [], "min": [], "mean": [], "max": [], "count": []}
+        if values is None or not len(times):
+            return payload
+        if bucket == "week":
+            origin = WEEK_ORIGIN
+        elif not bucket and points:
+            # 按目标点数分桶时从第一条数据开始对齐，保证桶数不超过 points
+            origin = int(times[0])
+        else:
+            origin = 0
+        bucket_times, stats = series.aggregate(seconds, start, end, [name], origin=origin)
+        stats = stats[name]
+        payload.update(
+            time=format_times(bucket_times),
+            min=round_column(name, stats["min"]),
+            mean=round_values(stats["mean"], MEAN_DECIMALS),
+            max=round_column(name, stats["max"]),
+            count=stats["count"].tolist(),
+        )
+        return payload
+
+
+class NodeDataStore:
+    """
+    story / summary 共用的节点存储：info（header/footer）加一组有序节点。
+    子类只需要设置 kind、默认 info 和排序方式；节点的增删改都只写单个节点。
+    """
+
+    kind = None
+    # 分页时是否倒序（最新添加的在前）
+    reverse = False
+    # 按哪个字段排序（None 表示保持添加顺序）
+    sort_field = None
+
+    def __init__(self, uuid=None, backend=None):
+        self.uuid = uuid
+        self.backend = backend or get_backend()
+        # 文档路径（JSON 后端的存储位置，也是 read-modify-write 的锁路径）
+        self.data_path = self.backend.document_path(self.kind, uuid)
+
+    def default_info(self):
         return {
             "header": {
                 "main_title": "THE LOVE STORY",
                 "subtitle": "A Journey Through Time for you or what you love",
             },
             "footer": {"footer_text": "© 2024 The love Company. All rights reserved."},
-            "story_nodes": {},
         }
 
-    def save_data(self, data):
-        with open(self.data_path, "w") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-
-    def get_story_nodes(self):
-        data = self.load_data()
-        return data.get("story_nodes", {})
-
-    def set_story_nodes(self, nodes):
-        for node_id, node in nodes.items():
-            # 清理 image 字段中的 base64
-            if (
-                "image" in node
-                and isinstance(node["image"], str)
-                and node["image"].startswith("data:image/")
-            ):
-                node.pop("image")
-            # 清理 avatar_image_base64/original_image_base64 等 base64 字段
-            for k in list(node.keys()):
-                if k.endswith("base64"):
-                    node.pop(k)
-        data = self.load_data()
-        data["story_nodes"] = nodes
-        self.save_data(data)
+    def load_info(self):
+        return {**self.default_info(), **(self.backend.load_info(self.kind, self.uuid) or {})}
+
+    def get_info(self):
+        data = self.load_info()
+        return {"header": data.get("header", {}), "footer": data.get("footer", {})}
+
+    @_locked("data_path")
+    def set_info(self, info):
+        data = dict(self.load_info())
+        data["header"] = info.get("header", {})
+        data["footer"] = info.get("footer", {})
+        self.backend.save_info(self.kind, self.uuid, data)
+
+    @_timed("get_nodes")
+    def get_nodes(self):
+        return self.backend.load_nodes(self.kind, self.uuid)
+
+    @_timed("list_nodes")
+    def list_nodes(self, limit=None, after=None, since=None, fields=None):
+        """
+        分页列出节点。after 为上一页返回的 next，since 为 updated_at（epoch 秒），
+        fields 为要返回的字段。返回 {"items": [...], "next": cursor 或 None}，after 不存在时抛 KeyError。
+        """
+        nodes, cursor = self.backend.node_page(
+            self.kind, self.uuid, limit, after, reverse=self.reverse, since=since
+        )
+        return {"items": project_nodes(nodes, fields), "next": cursor}
+
+    @_timed("set_nodes")
+    @_locked("data_path")
+    def set_nodes(self, nodes):
+        """整体替换所有节点。"""
+        for node in nodes.values():
+            scrub_node(node)
+        if self.sort_field:
+            nodes = dict(sorted(nodes.items(), key=lambda x: x[1].get(self.sort_field, 99999)))
+        self.backend.save_nodes(self.kind, self.uuid, nodes)
+
+    @_timed("get_node")
+    def get_node(self, node_id):
+        return self.backend.get_node(self.kind, self.uuid, node_id)
+
+    def export_nodes(self, start=None, end=None):
+        """按保存顺序逐个产出节点，给出范围时只要 updated_at 在 [start, end] 内的。"""
+        start, end = _static_bound(start), _static_bound(end)
+        nodes = self.backend.iter_nodes(self.kind, self.uuid)
+        if start is None and end is None:
+            return nodes
+        return (
+            node for node in nodes
+            if node.get("updated_at") is not None
+            and (start is None or node["updated_at"] >= start)
+            and (end is None or node["updated_at"] <= end)
+        )
+
+    @_timed("import_nodes")
+    @_locked("data_path")
+    def import_nodes(self, items):
+        """
+        批量添加节点（和 add_node 一样分配 id、处理图片），整批一次写入，需要时只重新排序一次。
+        返回 {"written": 条数, "results": [{"index", "ok", "id" 或 "error"}]}。
+        """
+        results = []
+        nodes = {}
+        for index, item in _bulk_objects(items, results):
+            item["id"] = str(uuid.uuid4())
+            try:
+                _prepare_node(item)
+            except ValueError as e:
+                results.append(_bulk_error(index, e))
+                continue
+            nodes[item["id"]] = item
+            results.append({"index": index, "ok": True, "id": item["id"]})
+        if nodes:
+            resort = bool(self.sort_field) and any(self.sort_field in node for node in nodes.values())
+            self.backend.put_nodes(self.kind, self.uuid, nodes)
+            if resort:
+                self.backend.reorder_nodes(self.kind, self.uuid, {}, self.sort_field)
+        results.sort(key=lambda r: r["index"])
+        return {"written": len(nodes), "results": results}
+
+    def _needs_resort(self, node):
+        """新写入的节点排序值比当前最后一个节点小时，需要重新排序。"""
+        if not self.sort_field or self.sort_field not in node:
+            return False
+        last, _ = self.backend.node_page(self.kind, self.uuid, 1, reverse=True)
+        return bool(last) and node[self.sort_field] < last[0].get(self.sort_field, 99999)
+
+    @_timed("add_node")
+    @_locked("data_path")
+    def add_node(self, node_data):
+        new_node_id = str(uuid.uuid4())
+        node_data["id"] = new_node_id
+        _prepare_node(node_data)
+        resort = self._needs_resort(node_data)
+        self.backend.put_node(self.kind, self.uuid, new_node_id, node_data)
+        if resort:
+            self.backend.reorder_nodes(self.kind, self.uuid, {}, self.sort_field)
+        return node_data
+
+    @_timed("update_node")
+    @_locked("data_path")
+    def update_node(self, node_id, updated_data):
+        """只合并传入的字段，只写这一个节点；排序字段变化时在同一次写入里重新排序。"""
+        node = self.get_node(node_id)
+        if node is None:
+            return None
+        _prepare_node(updated_data)
+        if (
+            self.sort_field
+            and self.sort_field in updated_data
+            and updated_data[self.sort_field] != node.get(self.sort_field)
+        ):
+            self.backend.reorder_nodes(self.kind, self.uuid, {node_id: updated_data}, self.sort_field)
+            return self.get_node(node_id)
+        node.update(updated_data)
+        self.backend.put_node(self.kind, self.uuid, node_id, node)
+        return node
+
+    @_timed("delete_node")
+    @_locked("data_path")
+    def delete_node(self, node_id):
+        return self.backend.delete_node(self.kind, self.uuid, node_id)
+
+
+class StoryDataStore(NodeDataStore):
+    """单个 story（按 uuid），节点按添加顺序保存，分页时最新的在前。"""
+
+    kind = "story"
+    reverse = True
 
     def get_info(self):
-        data = self.load_data()
+        data = self.load_info()
         # Return header, footer, and is_dashboard info
         return {
             "header": data.get("header", {}),
@@ -240,165 +924,100 @@ class StoryDataStore:
             "dashboard": data.get("dashboard", False)
         }
 
+    @_locked("data_path")
     def set_info(self, info):
-        data = self.load_data()
+        data = dict(self.load_info())
         data["header"] = info.get("header", {})
         data["footer"] = info.get("footer", {})
         # 新增  dashboard 字段
         if "dashboard" in info:
             data["dashboard"] = info["dashboard"]
-        self.save_data(data)
-
-    def add_story_node(self, node_data):
-        nodes = self.get_story_nodes()
-        new_node_id = str(uuid.uuid4())
-        node_data["id"] = new_node_id
-        avatar_base64 = node_data.pop("avatar_image_base64", None)
-        original_base64 = node_data.pop("original_image_base64", None)
-        if avatar_base64:
-            node_data["avatar_image"] = save_node_image(f"{new_node_id}_avatar", avatar_base64)
-        if original_base64:
-            node_data["original_image"] = save_node_image(f"{new_node_id}_original", original_base64)
-        nodes[new_node_id] = node_data
-        self.set_story_nodes(nodes)
-        return node_data
+        self.backend.save_info(self.kind, self.uuid, data)
 
-    def update_story_node(self, node_id, updated_data):
-        nodes = self.get_story_nodes()
-        if node_id not in nodes:
-            return None
-        avatar_base64 = updated_data.pop("avatar_image_base64", None)
-        original_base64 = updated_data.pop("original_image_base64", None)
-        if avatar_base64:
-            updated_data["avatar_image"] = save_node_image(f"{node_id}_avatar", avatar_base64)
-        if original_base64:
-            updated_data["original_image"] = save_node_image(f"{node_id}_original", original_base64)
-        nodes[node_id].update(updated_data)
-        self.set_story_nodes(nodes)
-        return nodes[node_id]
-
-    def delete_story_node(self, node_id):
-        nodes = self.get_story_nodes()
-        if node_id not in nodes:
-            return False
-        del nodes[node_id]
-        self.set_story_nodes(nodes)
-        return True
+    get_story_nodes = NodeDataStore.get_nodes
+    list_story_nodes = NodeDataStore.list_nodes
+    set_story_nodes = NodeDataStore.set_nodes
+    add_story_node = NodeDataStore.add_node
+    update_story_node = NodeDataStore.update_node
+    delete_story_node = NodeDataStore.delete_node
+    get_story_node = NodeDataStore.get_node
 
-    def get_story_node(self, node_id):
-        nodes = self.get_story_nodes()
-        return nodes.get(node_id)
 
+class SummaryDataStore(NodeDataStore):
+    """全局 summary，节点按 order 排序（没有 order 的排在最后）。"""
 
-class SummaryDataStore:
-    def __init__(self):
-        self.data_path = os.path.join(os.path.dirname(__file__), "data", "summary.json")
+    kind = "summary"
+    sort_field = "order"
 
-    def load_data(self):
-        if os.path.exists(self.data_path):
-            with open(self.data_path, "r") as f:
-                return json.load(f)
-        return {
-            "header": {
-                "main_title": "THE LOVE STORY",
-                "subtitle": "A Journey Through Time for you or what you love",
-            },
-            "footer": {"footer_text": "© 2024 The love Company. All rights reserved."},
-            "summary_nodes": {},
-        }
-
-    def save_data(self, data):
-        with open(self.data_path, "w") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    def __init__(self, backend=None):
+        super().__init__(None, backend)
 
     def get_summary_nodes(self):
-        data = self.load_data()
-        logger.debug(f"Summary nodes: {data.get('summary_nodes', {})}")
-        return data.get("summary_nodes", {})
+        nodes = self.get_nodes()
+        # 只记录条数，不输出整个节点内容
+        logger.debug(f"Loaded {len(nodes)} summary nodes")
+        return nodes
 
+    @_locked("data_path")
     def set_summary_order(self, order_list):
         """
         根据传入的节点 id 顺序列表，更新每个节点的 order 字段并保存。
+        列表可以只包含部分节点（例如分页时只加载了前几页）：传入的节点按列表顺序重新排列在
+        它们原来占据的位置上，没有传入的节点位置不变；不存在的 id 忽略。
         """
         if not isinstance(order_list, list):
             raise ValueError("order_list must be a list of node ids")
-        nodes = self.get_summary_nodes()
-        # 只更新存在的节点
-        for idx, node_id in enumerate(order_list):
-            if node_id in nodes:
-                nodes[node_id]['order'] = idx
-        self.set_summary_nodes(nodes)
-        
-
-    def set_summary_nodes(self, nodes):
-        for node_id, node in nodes.items():
-            # 清理 image 字段中的 base64
-            if (
-                "image" in node
-                and isinstance(node["image"], str)
-                and node["image"].startswith("data:image/")
-            ):
-                node.pop("image")
-            # 清理 avatar_image_base64/original_image_base64 等 base64 字段
-            for k in list(node.keys()):
-                if k.endswith("base64"):
-                    node.pop(k)
-        # 按 order 排序 nodes
-        sorted_items = sorted(
-            nodes.items(),
-            key=lambda x: x[1].get("order", 99999)
-        )
-        sorted_nodes = {k: v for k, v in sorted_items}
-        data = self.load_data()
-        data["summary_nodes"] = sorted_nodes
-        self.save_data(data)
-
-    def get_info(self):
-        data = self.load_data()
-        return {"header": data.get("header", {}), "footer": data.get("footer", {})}
-
-    def set_info(self, info):
-        data = self.load_data()
-        data["header"] = info.get("header", {})
-        data["footer"] = info.get("footer", {})
-        self.save_data(data)
-
-    def add_summary_node(self, node_data):
-        nodes = self.get_summary_nodes()
-        new_node_id = str(uuid.uuid4())
-        node_data["id"] = new_node_id
-        avatar_base64 = node_data.pop("avatar_image_base64", None)
-        original_base64 = node_data.pop("original_image_base64", None)
-        if avatar_base64:
-            node_data["avatar_image"] = save_node_image(f"{new_node_id}_avatar", avatar_base64)
-        if original_base64:
-            node_data["original_image"] = save_node_image(f"{new_node_id}_original", original_base64)
-        nodes[new_node_id] = node_data
-        self.set_summary_nodes(nodes)
-        return node_data
-
-    def update_summary_node(self, node_id, updated_data):
-        nodes = self.get_summary_nodes()
-        if node_id not in nodes:
-            return None
-        avatar_base64 = updated_data.pop("avatar_image_base64", None)
-        original_base64 = updated_data.pop("original_image_base64", None)
-        if avatar_base64:
-            updated_data["avatar_image"] = save_node_image(f"{node_id}_avatar", avatar_base64)
-        if original_base64:
-            updated_data["original_image"] = save_node_image(f"{node_id}_original", original_base64)
-        nodes[node_id].update(updated_data)
-        self.set_summary_nodes(nodes)
-        return nodes[node_id]
-
-    def delete_summary_node(self, node_id):
-        nodes = self.get_summary_nodes()
-        if node_id not in nodes:
-            return False
-        del nodes[node_id]
-        self.set_summary_nodes(nodes)
-        return True
-
-    def get_summary_node(self, node_id):
-        nodes = self.get_summary_nodes()
-        return nodes.get(node_id)
+        nodes = self.backend.load_nodes(self.kind, None)
+        ids = list(nodes)
+        posted = [node_id for node_id in dict.fromkeys(order_list) if node_id in nodes]
+        position = {node_id: pos for pos, node_id in enumerate(ids)}
+        slots = sorted(position[node_id] for node_id in posted)
+        for pos, node_id in zip(slots, posted):
+            ids[pos] = node_id
+        # 一次批量写入 order 有变化的节点并重新排序
+        now = round(time.time(), 3)
+        patches = {
+            node_id: {"order": idx, "updated_at": now}
+            for idx, node_id in enumerate(ids)
+            if nodes[node_id].get("order") != idx
+        }
+        self.backend.reorder_nodes(self.kind, None, patches, self.sort_field)
+
+    list_summary_nodes = NodeDataStore.list_nodes
+    set_summary_nodes = NodeDataStore.set_nodes
+    add_summary_node = NodeDataStore.add_node
+    update_summary_node = NodeDataStore.update_node
+    delete_summary_node = NodeDataStore.delete_node
+    get_summary_node = NodeDataStore.get_node
+
+
+#############################################
+##           Store registry
+#############################################
+# 常驻的 store 实例数上限（按 (类型, 后端, uuid) 计，超出时淘汰最久未用的）
+STORE_CACHE_SIZE = int(os.environ.get("REEFING_STORE_CACHE_SIZE", 256))
+
+_stores = collections.OrderedDict()
+_stores_guard = threading.Lock()
+
+
+def get_store(cls, uuid=None):
+    """
+    取 cls(uuid) 的常驻实例（LRU），请求之间共享路径、缓存和索引，不用每次重新构造。
+    SummaryDataStore 没有 uuid，传 None。
+    """
+    backend = get_backend()
+    key = (cls, backend.name, uuid)
+    with _stores_guard:
+        store = _stores.get(key)
+        if store is not None:
+            _stores.move_to_end(key)
+            return store
+    store = cls(backend=backend) if cls is SummaryDataStore else cls(uuid, backend=backend)
+    with _stores_guard:
+        # 并发构造时以先放进来的为准
+        store = _stores.setdefault(key, store)
+        _stores.move_to_end(key)
+        while len(_stores) > STORE_CACHE_SIZE:
+            _stores.popitem(last=False)
+    return store
@@ -0,0 +1,54 @@
+"""
+export.py
+流式导出：把逐条产出的记录编码为 NDJSON 或 CSV，边生成边发送，不在内存里拼出整个响应。
+"""
+
+from flask import Response
+import csv
+import io
+import json
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def iter_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def iter_csv(rows, columns):
+    """固定列的 CSV，缺少的字段为空，嵌套的值（dict/list）写成 JSON。"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    writer.writerow(columns)
+    yield flush()
+    for row in rows:
+        writer.writerow([_csv_value(row.get(column)) for column in columns])
+        yield flush()
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def export_response(rows, fmt, columns, filename):
+    """流式响应（作为附件下载）。fmt 不支持时抛 ValueError。"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    body = iter_ndjson(rows) if fmt == "ndjson" else iter_csv(rows, columns)
+    return Response(
+        body,
+        mimetype=FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
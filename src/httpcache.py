@@ -0,0 +1,95 @@
+"""
+httpcache.py
+读接口的 HTTP 缓存层：
+- conditional：按底层文档的版本号（文件 stat + 进程内修订号）生成 ETag/Last-Modified，
+  If-None-Match 命中时直接返回 304，不读存储、不序列化（Last-Modified 只精确到秒，
+  同一秒内的修改无法区分，所以不按 If-Modified-Since 返回 304）
+- init_app：对较大的 JSON 响应做 gzip（安装了 brotli 时优先 br）压缩
+"""
+
+from flask import make_response
+from flask import request
+import datetime
+import functools
+import gzip
+import hashlib
+import os
+
+try:
+    import brotli
+except ImportError:  # brotli 是可选依赖
+    brotli = None
+
+# 超过这个大小（字节）的 JSON 响应才压缩
+COMPRESS_MIN_BYTES = int(os.environ.get("REEFING_COMPRESS_MIN_BYTES", 1024))
+# > 0 时允许客户端在这段时间（秒）内不重新验证直接用缓存
+HTTP_MAX_AGE = int(os.environ.get("REEFING_HTTP_MAX_AGE", 0))
+
+
+def conditional(version):
+    """
+    装饰器：version(**view_kwargs) 返回 (token, mtime) 或 None（不缓存）。
+    ETag 由请求路径（含查询参数）和 token 计算，数据不变时同一个 URL 的 ETag 不变。
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            current = version(**kwargs)
+            if current is None:
+                return view(*args, **kwargs)
+            token, mtime = current
+            etag = hashlib.sha1(f"{request.full_path}|{token}".encode()).hexdigest()[:20]
+            last_modified = (
+                datetime.datetime.fromtimestamp(int(mtime), datetime.timezone.utc) if mtime else None
+            )
+            if request.if_none_match and request.if_none_match.contains_weak(etag):
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            # 压缩后的响应内容不同，用弱 ETag
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            if HTTP_MAX_AGE > 0:
+                response.headers["Cache-Control"] = f"private, max-age={HTTP_MAX_AGE}"
+            else:
+                response.headers["Cache-Control"] = "no-cache"
+            return response
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    """注册响应压缩。"""
+    app.after_request(compress_response)
+    return app
+
+
+def compress_response(response):
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or response.mimetype != "application/json"
+    ):
+        return response
+    accept = request.headers.get("Accept-Encoding", "")
+    if brotli is not None and "br" in accept:
+        encoding = "br"
+    elif "gzip" in accept:
+        encoding = "gzip"
+    else:
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    if encoding == "br":
+        body = brotli.compress(body, quality=5)
+    else:
+        body = gzip.compress(body, compresslevel=6)
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
@@ -0,0 +1,237 @@
+"""
+images.py
+节点图片：
+- 分块解码/写盘，按文件头识别真实格式（png/jpeg/gif/webp/bmp）
+- 按内容的 sha256 命名（images/<hash>.<ext>），相同的图片只存一份
+- 后台线程池生成按宽度分档的 WebP 缩略图（需要 Pillow，没有安装时只提供原图）
+- /images/<name> 提供文件，内容不可变，可以长期缓存
+- POST /api/images 流式上传（原始请求体或 multipart），返回的 id 在创建/更新节点时引用
+"""
+
+from common import SIZE_BUCKETS
+from common import logger
+from common import metrics
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow 是可选依赖
+    Image = None
+
+IMAGE_DIR = os.environ.get("REEFING_IMAGE_DIR") or os.path.join(os.path.dirname(__file__), "static", "images")
+# 图片 URL 前缀（相对页面路径，与原来的 static/images/... 一致）
+IMAGE_URL_PREFIX = "images/"
+
+# 缩略图宽度档位（像素）
+THUMB_WIDTHS = (160, 480, 1024)
+THUMB_QUALITY = 80
+# 单张图片的最大字节数
+MAX_IMAGE_BYTES = int(os.environ.get("REEFING_MAX_IMAGE_BYTES", 20 * 1024 * 1024))
+CHUNK_SIZE = 64 * 1024
+
+# 文件头 -> (扩展名, mimetype)
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png", "image/png"),
+    (b"\xff\xd8\xff", "jpg", "image/jpeg"),
+    (b"GIF87a", "gif", "image/gif"),
+    (b"GIF89a", "gif", "image/gif"),
+    (b"BM", "bmp", "image/bmp"),
+)
+MIMETYPES = {"png": "image/png", "jpg": "image/jpeg", "gif": "image/gif", "webp": "image/webp", "bmp": "image/bmp"}
+_NAME = re.compile(r"^([0-9a-f]{40})\.(png|jpg|gif|webp|bmp)$")
+
+
+class ImageError(ValueError):
+    """上传的不是支持的图片，或超过大小限制。"""
+
+
+def detect_format(head):
+    """按文件头识别格式，返回扩展名，无法识别时返回 None。"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for signature, ext, _ in _SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    return None
+
+
+def is_image_id(name):
+    return bool(name) and _NAME.match(name) is not None
+
+
+def image_url(image_id):
+    return IMAGE_URL_PREFIX + image_id
+
+
+def lookup_image(image_id):
+    """已上传图片的 URL，id 不合法或文件不存在时抛 ImageError。"""
+    if not is_image_id(image_id) or not os.path.exists(os.path.join(IMAGE_DIR, image_id)):
+        raise ImageError(f"Unknown image id: {image_id}")
+    return image_url(image_id)
+
+
+def store_image(chunks, max_bytes=MAX_IMAGE_BYTES):
+    """
+    把字节块流写成内容寻址的图片文件，边写边计算 sha256，内存里只有当前块。
+    返回 {"id", "url", "format", "size", "created"}；格式不支持或超过 max_bytes 时抛 ImageError。
+    """
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    head = b""
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=IMAGE_DIR, prefix=".upload.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ImageError(f"Image larger than {max_bytes} bytes")
+                if len(head) < 16:
+                    head += chunk[:16 - len(head)]
+                digest.update(chunk)
+                f.write(chunk)
+        ext = detect_format(head)
+        if ext is None:
+            raise ImageError("Unsupported image format")
+        image_id = f"{digest.hexdigest()[:40]}.{ext}"
+        path = os.path.join(IMAGE_DIR, image_id)
+        created = not os.path.exists(path)
+        if created:
+            os.replace(tmp, path)
+        else:
+            os.unlink(tmp)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    metrics.observe("reefing_image_upload_bytes", size, buckets=SIZE_BUCKETS, created=str(created).lower())
+    if created:
+        schedule_thumbnails(image_id)
+    return {"id": image_id, "url": image_url(image_id), "format": ext, "size": size, "created": created}
+
+
+def iter_stream(stream, chunk_size=CHUNK_SIZE):
+    """按块读取文件对象（请求体、上传文件）。"""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def iter_base64(data, chunk_size=CHUNK_SIZE):
+    """
+    分块解码 base64 / data URL 字符串，不生成整份解码后的副本。
+    允许夹带空白和换行（例如 MIME 的 76 列折行）：每块去掉空白后只解码 4 的整数倍个字符，余下的留到下一块。
+    """
+    if data.startswith("data:"):
+        data = data.split(",", 1)[-1]
+    step = chunk_size // 3 * 4
+    pending = ""
+    try:
+        for i in range(0, len(data), step):
+            pending += "".join(data[i:i + step].split())
+            usable = len(pending) - len(pending) % 4
+            if usable:
+                yield base64.b64decode(pending[:usable])
+                pending = pending[usable:]
+        if pending:
+            yield base64.b64decode(pending)
+    except binascii.Error as e:
+        raise ImageError(f"Invalid base64 image: {e}")
+
+
+def save_base64_image(data):
+    """保存 base64 / data URL 图片，返回图片 URL（images/<hash>.<ext>）。"""
+    return store_image(iter_base64(data))["url"]
+
+
+#############################################
+##           Thumbnails
+#############################################
+_executor = None
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def _thumb_name(image_id, width):
+    return f"{image_id.split('.', 1)[0]}_{width}.webp"
+
+
+def schedule_thumbnails(image_id):
+    """在后台线程池生成缩略图（已在生成中时忽略）。"""
+    global _executor
+    if Image is None:
+        return
+    with _pending_lock:
+        if image_id in _pending:
+            return
+        _pending.add(image_id)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.environ.get("REEFING_IMAGE_WORKERS", 2)), thread_name_prefix="thumbnail"
+            )
+    _executor.submit(_make_thumbnails, image_id)
+
+
+def _make_thumbnails(image_id):
+    start = time.perf_counter()
+    try:
+        with Image.open(os.path.join(IMAGE_DIR, image_id)) as img:
+            img.seek(0)
+            img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+            for width in THUMB_WIDTHS:
+                path = os.path.join(IMAGE_DIR, _thumb_name(image_id, width))
+                if os.path.exists(path):
+                    continue
+                thumb = img.copy()
+                # 比档位小的图片不放大，只转成 WebP
+                thumb.thumbnail((width, width * 4))
+                fd, tmp = tempfile.mkstemp(dir=IMAGE_DIR, prefix=".thumb.")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        thumb.save(f, "WEBP", quality=THUMB_QUALITY)
+                    os.replace(tmp, path)
+                except BaseException:
+                    os.unlink(tmp)
+                    raise
+    except Exception as e:
+        logger.warning(f"Error generating thumbnails for {image_id}: {e}")
+    else:
+        metrics.observe("reefing_thumbnail_seconds", time.perf_counter() - start)
+    finally:
+        with _pending_lock:
+            _pending.discard(image_id)
+
+
+def resolve_image(name, width=None):
+    """
+    /images/<name>?w=<width> 对应的文件：返回 (路径, mimetype, 是否可长期缓存)，不存在时返回 None。
+    请求宽度时给出不小于它的最小档位的 WebP；缩略图还没生成时先给原图（不长期缓存）。
+    """
+    if not is_image_id(name):
+        return None
+    path = os.path.join(IMAGE_DIR, name)
+    if not os.path.exists(path):
+        return None
+    original = (path, MIMETYPES[name.rsplit(".", 1)[1]], True)
+    if not width or Image is None:
+        return original
+    bucket = next((w for w in THUMB_WIDTHS if w >= width), None)
+    if bucket is None:
+        return original
+    thumb = os.path.join(IMAGE_DIR, _thumb_name(name, bucket))
+    if os.path.exists(thumb):
+        return thumb, "image/webp", True
+    schedule_thumbnails(name)
+    return path, original[1], False
@@ -0,0 +1,359 @@
+"""
+poller.py
+后台实时数据调度：发现所有配置了 realtimesource 的 tank（data/data_<uuid>.json），
+由独立线程的 asyncio 事件循环按间隔（带抖动）调度，每个来源有独立的超时、指数退避和熔断。
+抓取（requests）和写入本地实时日志都在线程池里执行，请求处理只读本地数据。
+"""
+
+from common import SIZE_BUCKETS
+from common import logger
+from common import metrics
+from data_store import ChartDataStore
+from data_store import get_store
+from data_store import list_realtime_sources
+from data_store import set_background_polling
+from concurrent.futures import ThreadPoolExecutor
+from realtime import fetch_feed
+from realtime import iter_feed_lines
+import asyncio
+import os
+import random
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有跨进程锁，每个进程都当 leader
+    fcntl = None
+
+
+class SourceState:
+    """
+    单个 realtimesource 的抓取状态：按 interval（带抖动）调度；连续失败时指数退避，
+    失败次数达到阈值后熔断（open），冷却时间过后放行一次试探（half-open），成功则恢复（closed）。
+    """
+
+    def __init__(self, uuid, url):
+        self.uuid = uuid
+        self.url = url
+        self.failures = 0
+        self.circuit = "closed"
+        self.next_attempt = 0.0
+        self.inflight = False
+        self.polls = 0
+        self.total_failures = 0
+        self.last_success = None
+        self.last_error = None
+        self.last_latency_ms = None
+        self.avg_latency_ms = None
+        self.last_count = 0
+
+    def due(self, now):
+        return not self.inflight and now >= self.next_attempt
+
+    def _record_latency(self, latency_ms):
+        self.polls += 1
+        self.last_latency_ms = latency_ms
+        if self.avg_latency_ms is None:
+            self.avg_latency_ms = latency_ms
+        else:
+            self.avg_latency_ms = 0.8 * self.avg_latency_ms + 0.2 * latency_ms
+
+    def record_success(self, now, latency_ms, count, delay):
+        self._record_latency(latency_ms)
+        self.failures = 0
+        self.circuit = "closed"
+        self.last_success = time.time()
+        self.last_error = None
+        self.last_count = count
+        self.next_attempt = now + delay
+
+    def record_failure(self, now, latency_ms, error, delay, max_backoff, threshold, cooldown):
+        self._record_latency(latency_ms)
+        self.failures += 1
+        self.total_failures += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+        if self.failures >= threshold:
+            self.circuit = "open"
+            self.next_attempt = now + cooldown
+        else:
+            self.next_attempt = now + min(max_backoff, delay * 2 ** (self.failures - 1))
+
+    def as_dict(self):
+        return {
+            "uuid": self.uuid,
+            "url": self.url,
+            "circuit": self.circuit,
+            "inflight": self.inflight,
+            "polls": self.polls,
+            "failures": self.failures,
+            "total_failures": self.total_failures,
+            "last_success": self.last_success,
+            "last_error": self.last_error,
+            "last_latency_ms": self.last_latency_ms,
+            "avg_latency_ms": self.avg_latency_ms,
+            "last_count": self.last_count,
+        }
+
+
+class RealtimePoller:
+    """
+    后台调度器：定期发现所有配置了 realtimesource 的 tank，每个来源按 interval（±jitter）独立调度。
+    asyncio 事件循环只负责调度；抓取（requests）和解析写日志都在线程池里执行，同时抓取数受
+    max_concurrency 限制，同时写日志数受 workers 限制。start() 后请求处理不再直连 controller。
+    """
+
+    def __init__(self, interval=60, timeout=10, jitter=0.1, max_concurrency=4, workers=2,
+                 discover_interval=60, max_backoff=900, failure_threshold=5, cooldown=600,
+                 discover=list_realtime_sources):
+        self.interval = interval
+        self.timeout = timeout
+        self.jitter = jitter
+        self.max_concurrency = max_concurrency
+        self.workers = workers
+        self.discover_interval = discover_interval
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.discover = discover
+        self.sources = {}
+        self._queued = 0
+        self._fetching = 0
+        self._ingesting = 0
+        self._last_discovery = None
+        self._loop = None
+        self._thread = None
+        self._stop = None
+        self._wake = None
+        self._executor = None
+        self._ingest_slots = None
+        # standalone：直接 start()；leader/follower：由 start_leader_election 决定
+        self.role = "standalone"
+        self.leader_lock = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running():
+            return self
+        # 抓取和写日志共用线程池，分别由各自的信号量限流，抓取不会占满写日志的线程
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency + self.workers, thread_name_prefix="realtime-poller"
+        )
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name="realtime-poller", daemon=True)
+        self._thread.start()
+        ready.wait()
+        set_background_polling(True)
+        return self
+
+    def stop(self, timeout=5):
+        if not self.is_running():
+            return
+        set_background_polling(False)
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=False)
+
+    def poke(self):
+        """立即重新发现来源（例如 dashboard 配置刚被修改）。"""
+        if self.is_running():
+            self._loop.call_soon_threadsafe(self._request_discovery)
+
+    def status(self):
+        return {
+            "running": self.is_running(),
+            "role": self.role,
+            "queue_depth": self._queued,
+            "fetching": self._fetching,
+            "ingesting": self._ingesting,
+            "max_concurrency": self.max_concurrency,
+            "workers": self.workers,
+            "last_discovery": self._last_discovery,
+            "sources": {uuid: state.as_dict() for uuid, state in list(self.sources.items())},
+        }
+
+    def _next_delay(self):
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _request_discovery(self):
+        self._next_discovery = 0.0
+        self._wake.set()
+
+    def _run(self, ready):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._stop = asyncio.Event()
+        self._wake = asyncio.Event()
+        ready.set()
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    async def _main(self):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._ingest_slots = asyncio.Semaphore(self.workers)
+        tasks = set()
+        self._next_discovery = 0.0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= self._next_discovery:
+                await self._discover()
+                self._next_discovery = time.monotonic() + self.discover_interval
+            now = time.monotonic()
+            for state in list(self.sources.values()):
+                if state.due(now):
+                    if state.circuit == "open":
+                        # 冷却结束，放行一次试探
+                        state.circuit = "half-open"
+                    state.inflight = True
+                    task = asyncio.ensure_future(self._poll_source(state, semaphore))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            # 睡到下一个来源到期（或被 stop/poke 唤醒）
+            pending = [st.next_attempt for st in self.sources.values() if not st.inflight]
+            wake_at = min(pending + [self._next_discovery])
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(0.05, min(wake_at - time.monotonic(), 5)))
+            except asyncio.TimeoutError:
+                pass
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _discover(self):
+        loop = asyncio.get_running_loop()
+        try:
+            discovered = await loop.run_in_executor(self._executor, self.discover)
+        except Exception as e:
+            # 保留上一次发现的来源，下个 discover_interval 再试
+            logger.warning(f"Discovering realtime sources failed: {type(e).__name__}: {e}")
+            return
+        now = time.monotonic()
+        current = {}
+        for uuid, url in discovered:
+            state = self.sources.get(uuid)
+            if state is None or state.url != url:
+                state = SourceState(uuid, url)
+                # 新来源随机错开首次抓取，避免同时打到所有 controller
+                state.next_attempt = now + random.uniform(0, self.jitter * self.interval)
+            current[uuid] = state
+        self.sources = current
+        self._last_discovery = time.time()
+
+    async def _poll_source(self, state, semaphore):
+        loop = asyncio.get_running_loop()
+        self._queued += 1
+        try:
+            async with semaphore:
+                self._queued -= 1
+                start = time.monotonic()
+                try:
+                    self._fetching += 1
+                    try:
+                        body = await loop.run_in_executor(self._executor, fetch_feed, state.url, self.timeout)
+                    finally:
+                        self._fetching -= 1
+                    # 解析和写日志在线程池里做，不阻塞事件循环
+                    async with self._ingest_slots:
+                        self._ingesting += 1
+                        try:
+                            count = await loop.run_in_executor(self._executor, self._ingest, state.uuid, body)
+                        finally:
+                            self._ingesting -= 1
+                except Exception as e:
+                    now = time.monotonic()
+                    metrics.observe("reefing_upstream_fetch_seconds", now - start, source="poller", result="error")
+                    state.record_failure(
+                        now, (now - start) * 1000, e, self._next_delay(), self.max_backoff,
+                        self.failure_threshold, self.cooldown,
+                    )
+                    logger.warning(f"Poll {state.uuid} failed after {(now - start) * 1000:.0f}ms: {state.last_error}")
+                else:
+                    now = time.monotonic()
+                    metrics.observe("reefing_upstream_fetch_seconds", now - start, source="poller", result="ok")
+                    metrics.observe("reefing_upstream_fetch_bytes", len(body), buckets=SIZE_BUCKETS, source="poller")
+                    state.record_success(now, (now - start) * 1000, count, self._next_delay())
+        finally:
+            state.inflight = False
+            self._wake.set()
+
+    @staticmethod
+    def _ingest(uuid, body):
+        text = body.decode("utf-8", errors="replace")
+        return get_store(ChartDataStore, uuid).ingest_realtime_lines(iter_feed_lines([text]))
+
+
+class LeaderLock:
+    """
+    跨进程的 leader 锁：非阻塞 fcntl.flock，抢到后一直持有打开的文件，进程退出时由系统释放。
+    没有 fcntl（Windows）时总是成功。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def try_acquire(self):
+        if self._file is not None:
+            return True
+        if fcntl is None:
+            self._file = True
+            return True
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        f = open(self.path, "a+")
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        f.seek(0)
+        f.truncate()
+        f.write(f"{os.getpid()}\n")
+        f.flush()
+        self._file = f
+        return True
+
+    def release(self):
+        if self._file not in (None, True):
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+        self._file = None
+
+
+def start_leader_election(poller, lock_path, retry=30):
+    """
+    多 worker 部署时只让一个进程运行 poller：抢到 lock_path 的进程成为 leader 并 start()，
+    其它进程每 retry 秒重试一次（leader 退出后由它们接管）。所有进程的请求都只读本地实时数据，
+    不再直连 controller。返回后台线程。
+    """
+    lock = LeaderLock(lock_path)
+    # 锁对象挂在 poller 上，选举线程结束后文件也不会被回收关闭（否则锁会被释放）
+    poller.leader_lock = lock
+    set_background_polling(True)
+    poller.role = "follower"
+
+    def run():
+        while not lock.try_acquire():
+            time.sleep(retry)
+        poller.role = "leader"
+        logger.info(f"Process {os.getpid()} is the realtime poller leader")
+        poller.start()
+
+    thread = threading.Thread(target=run, name="poller-election", daemon=True)
+    thread.start()
+    return thread
+
+
+# 全局 poller，由 app 启动时决定是否 start()
+realtime_poller = RealtimePoller(
+    interval=float(os.environ.get("REEFING_POLL_INTERVAL", 60)),
+    timeout=float(os.environ.get("REEFING_POLL_TIMEOUT", 10)),
+    jitter=float(os.environ.get("REEFING_POLL_JITTER", 0.1)),
+    max_concurrency=int(os.environ.get("REEFING_POLL_CONCURRENCY", 4)),
+    workers=int(os.environ.get("REEFING_POLL_WORKERS", 2)),
+)
@@ -0,0 +1,405 @@
+"""
+realtime.py
+实时数据（controller feed）相关工具：
+- 流式解析 controller 返回的 {"data": "<每行一个 JSON>"}，内存只占一行
+- 表驱动的探头字段提取（可注册新的探头名）
+- 按 uuid 缓存抓取结果，避免每次打开 dashboard 都直连设备
+"""
+
+from collections import OrderedDict
+from collections import namedtuple
+from common import SIZE_BUCKETS
+from common import metrics
+from timeseries import parse_time
+import codecs
+import json
+import os
+import re
+import requests
+import threading
+import time
+
+
+#############################################
+##           Streaming Parser
+#############################################
+Reading = namedtuple("Reading", ["time", "values"])
+
+
+class Probe:
+    """一个探头字段：名称（也是输出的列名）、别名、类型转换、是否必须。"""
+
+    __slots__ = ("name", "aliases", "convert", "required", "prefix")
+
+    def __init__(self, name, aliases=(), convert=float, required=False, prefix=False):
+        self.name = name
+        self.aliases = tuple(aliases)
+        self.convert = convert
+        self.required = required
+        self.prefix = prefix
+
+
+# content 中每行形如 "ORP 312.4"，第一个词为探头名
+PROBES = OrderedDict()
+_probe_lookup = {}
+
+
+def register_probe(name, aliases=(), convert=float, required=False, prefix=False):
+    """
+    注册一个探头。先按名称/别名精确匹配；prefix=True 时，没有精确匹配的行按前缀匹配
+    （兼容旧的 startswith 逻辑，例如 "Temp" 归到 T）。
+    """
+    probe = Probe(name, aliases, convert, required, prefix)
+    PROBES[name] = probe
+    for key in (name,) + probe.aliases:
+        _probe_lookup[key] = probe
+    return probe
+
+
+register_probe("ORP", convert=lambda v: int(round(float(v))), required=True, prefix=True)
+register_probe("PH", convert=lambda v: round(float(v), 1), required=True, prefix=True)
+register_probe("T", required=True, prefix=True)
+
+
+def _match_probe(token):
+    probe = _probe_lookup.get(token)
+    if probe is not None:
+        return probe
+    for probe in PROBES.values():
+        if probe.prefix and token.startswith(probe.name):
+            return probe
+    return None
+
+
+class ParseStats:
+    """解析计数：lines 总行数，readings 有效读数，skipped 已入库跳过，errors 坏行，incomplete 缺必需探头。"""
+
+    FIELDS = ("lines", "readings", "skipped", "errors", "incomplete")
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def merge(self, other):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self):
+        return f"ParseStats({self.as_dict()})"
+
+
+# 累计解析计数（所有 uuid）
+parser_totals = ParseStats()
+_parser_totals_lock = threading.Lock()
+
+_DATA_KEY = re.compile(r'"data"\s*:\s*"')
+_STRING_SPECIAL = re.compile(r'[\\"]')
+_TIME_FIELD = re.compile(r'"time"\s*:\s*"([^"]*)"')
+
+
+def iter_feed_lines(chunks):
+    """
+    从文本块流中逐行取出 {"data": "..."} 里的每一行（已反转义）。
+    只在内存中保留当前这一行：行内容先保持 JSON 转义形式，遇到转义的换行（\\n）再解码。
+    """
+    chunks = iter(chunks)
+    head = ""
+    for chunk in chunks:
+        head += chunk
+        m = _DATA_KEY.search(head)
+        if m:
+            head = head[m.end():]
+            break
+    else:
+        return
+
+    def remaining():
+        yield head
+        yield from chunks
+
+    line = []
+    escape = False
+    for chunk in remaining():
+        i = 0
+        n = len(chunk)
+        if escape and n:
+            escape = False
+            if chunk[0] == "n":
+                yield _decode_line(line)
+                line = []
+            else:
+                line.append("\\" + chunk[0])
+            i = 1
+        while i < n:
+            m = _STRING_SPECIAL.search(chunk, i)
+            if m is None:
+                line.append(chunk[i:])
+                break
+            j = m.start()
+            line.append(chunk[i:j])
+            if chunk[j] == '"':
+                yield _decode_line(line)
+                return
+            if j + 1 >= n:
+                escape = True
+                break
+            if chunk[j + 1] == "n":
+                yield _decode_line(line)
+                line = []
+            else:
+                line.append(chunk[j:j + 2])
+            i = j + 2
+    if line:
+        yield _decode_line(line)
+
+
+def _decode_line(parts):
+    raw = "".join(parts)
+    if "\\" not in raw:
+        return raw
+    try:
+        return json.loads('"' + raw + '"')
+    except ValueError:
+        return raw
+
+
+def extract_values(content):
+    """按探头表从 content 中提取数值，缺少必需探头时返回 None，数值非法时抛 ValueError。"""
+    values = {}
+    for entry in content.split("\n"):
+        parts = entry.split()
+        if len(parts) < 2:
+            continue
+        probe = _match_probe(parts[0])
+        if probe is None:
+            continue
+        values[probe.name] = probe.convert(parts[1])
+    for probe in PROBES.values():
+        if probe.required and probe.name not in values:
+            return None
+    return values
+
+
+def iter_readings(lines, stats=None, since=None):
+    """
+    把 controller 数据行解析为 Reading 生成器。since 为已入库的最后 time，
+    不晚于它的行只做一次正则取 time 就跳过，不做完整 JSON 解析。
+    """
+    stats = stats if stats is not None else ParseStats()
+    try:
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            stats.lines += 1
+            if since is not None:
+                m = _TIME_FIELD.search(line)
+                if m and m.group(1) <= since:
+                    stats.skipped += 1
+                    continue
+            try:
+                obj = json.loads(line)
+                ts = obj.get("time")
+                parse_time(ts)
+                values = extract_values(obj.get("content", ""))
+            except Exception:
+                stats.errors += 1
+                continue
+            if values is None:
+                stats.incomplete += 1
+                continue
+            if since is not None and ts <= since:
+                stats.skipped += 1
+                continue
+            stats.readings += 1
+            yield Reading(ts, values)
+    finally:
+        with _parser_totals_lock:
+            parser_totals.merge(stats)
+
+
+def fetch_readings(url, stats=None, since=None, timeout=10, chunk_size=64 * 1024):
+    """流式抓取 controller feed 并逐条返回 Reading，失败时抛异常。"""
+    start = time.perf_counter()
+    received = 0
+    result = "error"
+
+    def counted(raw):
+        nonlocal received
+        for chunk in raw:
+            received += len(chunk)
+            yield chunk
+
+    try:
+        with requests.get(url, timeout=timeout, stream=True) as resp:
+            resp.raise_for_status()
+            decoder = codecs.getincrementaldecoder(resp.encoding or "utf-8")(errors="replace")
+            chunks = (decoder.decode(chunk) for chunk in counted(resp.iter_content(chunk_size=chunk_size)))
+            yield from iter_readings(iter_feed_lines(chunks), stats, since)
+        result = "ok"
+    finally:
+        # 抓取 + 流式解析的总耗时
+        metrics.observe("reefing_upstream_fetch_seconds", time.perf_counter() - start, source="direct", result=result)
+        metrics.observe("reefing_upstream_fetch_bytes", received, buckets=SIZE_BUCKETS, source="direct")
+
+
+def fetch_feed(url, timeout=10, max_bytes=64 * 1024 * 1024, chunk_size=64 * 1024):
+    """
+    一次性抓取 controller feed 的原始响应体（bytes），非 2xx 时抛异常。
+    timeout 限制整次抓取的总时长（requests 自身的 timeout 只限制单次读），body 超过 max_bytes 时抛 ValueError。
+    """
+    deadline = time.monotonic() + timeout
+    with requests.get(url, timeout=timeout, stream=True) as resp:
+        resp.raise_for_status()
+        body = bytearray()
+        for chunk in resp.iter_content(chunk_size=chunk_size):
+            body += chunk
+            if len(body) > max_bytes:
+                raise ValueError("Response too large")
+            if time.monotonic() > deadline:
+                raise requests.Timeout(f"Fetching {url} took longer than {timeout}s")
+        return bytes(body)
+
+
+#############################################
+##           Realtime Cache
+#############################################
+
+
+class _Entry:
+    __slots__ = ("value", "fetched_at")
+
+    def __init__(self, value, fetched_at):
+        self.value = value
+        self.fetched_at = fetched_at
+
+
+class _Flight:
+    """一次正在进行中的抓取，其它并发请求等待它的结果。"""
+
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class RealtimeCache:
+    """
+    实时数据缓存：
+    - ttl 内直接返回缓存（hit）
+    - 过期但在 stale_ttl 内：先返回旧数据，后台刷新（stale-while-revalidate）
+    - 同一个 key 的并发 miss 只触发一次抓取（single-flight）
+    - 超过 max_entries 时按 LRU 淘汰
+    loader 抓取失败时应抛异常，旧数据会被保留。
+    """
+
+    def __init__(self, ttl=60, stale_ttl=600, max_entries=32, wait_timeout=15):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "refreshes": 0,
+            "errors": 0,
+            "evictions": 0,
+            "refresh_ms_total": 0.0,
+            "refresh_ms_last": 0.0,
+            "refresh_ms_max": 0.0,
+        }
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                age = now - entry.fetched_at
+                if age < self.ttl:
+                    self._stats["hits"] += 1
+                    return entry.value
+                if age < self.ttl + self.stale_ttl:
+                    self._stats["stale_hits"] += 1
+                    if key not in self._inflight:
+                        flight = _Flight()
+                        self._inflight[key] = flight
+                        threading.Thread(
+                            target=self._run_refresh,
+                            args=(key, loader, flight),
+                            daemon=True,
+                        ).start()
+                    return entry.value
+            self._stats["misses"] += 1
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+            else:
+                self._stats["coalesced"] += 1
+
+        if leader:
+            self._run_refresh(key, loader, flight)
+        elif not flight.event.wait(self.wait_timeout):
+            raise TimeoutError(f"Timed out waiting for realtime refresh of {key!r}")
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["inflight"] = len(self._inflight)
+        refreshes = stats["refreshes"]
+        stats["refresh_ms_avg"] = stats["refresh_ms_total"] / refreshes if refreshes else 0.0
+        return stats
+
+    def _run_refresh(self, key, loader, flight):
+        start = time.perf_counter()
+        try:
+            flight.value = loader()
+        except Exception as e:
+            flight.error = e
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._stats["refreshes"] += 1
+            self._stats["refresh_ms_total"] += elapsed_ms
+            self._stats["refresh_ms_last"] = elapsed_ms
+            self._stats["refresh_ms_max"] = max(self._stats["refresh_ms_max"], elapsed_ms)
+            if flight.error is not None:
+                self._stats["errors"] += 1
+            else:
+                self._entries[key] = _Entry(flight.value, time.monotonic())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats["evictions"] += 1
+        flight.event.set()
+
+
+# 全局实时数据缓存，可通过环境变量调整
+realtime_cache = RealtimeCache(
+    ttl=float(os.environ.get("REEFING_REALTIME_TTL", 60)),
+    stale_ttl=float(os.environ.get("REEFING_REALTIME_STALE_TTL", 600)),
+    max_entries=int(os.environ.get("REEFING_REALTIME_CACHE_SIZE", 32)),
+)
@@ -0,0 +1,117 @@
+"""
+standin.py
+本地的 controller 替身（HTTP 服务），用于测试和压测。
+返回与真实 controller 相同格式的 {"data": "<每行一个 JSON>"}，可模拟慢响应和错误。
+
+    with StandInController() as controller:
+        controller.fill("tank1", count=1000)
+        url = controller.url("tank1")
+"""
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import datetime
+import json
+import random
+import threading
+import time
+
+
+class StandInController:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.feeds = {}
+        # 模拟 controller 状态：响应延迟（秒）、HTTP 状态码和响应体的分界方式
+        # （"length"：Content-Length，"close"：读到连接关闭，"chunked"：分块传输）
+        self.delay = 0.0
+        self.status = 200
+        self.framing = "length"
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def url(self, feed="default"):
+        return f"http://{self.host}:{self.port}/{feed}"
+
+    def add_reading(self, time_str, feed="default", **values):
+        """追加一条 controller 记录，values 为探头读数，例如 ORP=310, PH=8.1, T=25.4。"""
+        content = "\n".join(f"{name} {value}" for name, value in values.items())
+        with self._lock:
+            self.feeds.setdefault(feed, []).append(json.dumps({"time": time_str, "content": content}))
+
+    def fill(self, feed="default", count=100, start=None, step=60, seed=0):
+        """生成 count 条合成读数（每 step 秒一条）。"""
+        rng = random.Random(seed)
+        start = start or datetime.datetime(2025, 1, 1)
+        for i in range(count):
+            ts = (start + datetime.timedelta(seconds=i * step)).strftime("%Y-%m-%d %H:%M:%S")
+            self.add_reading(
+                ts,
+                feed=feed,
+                ORP=round(rng.uniform(280, 360), 1),
+                PH=round(rng.uniform(7.9, 8.4), 2),
+                T=round(rng.uniform(24.5, 26.5), 1),
+            )
+
+    def payload(self, feed="default"):
+        with self._lock:
+            lines = list(self.feeds.get(feed, []))
+        return json.dumps({"data": "\n".join(lines)}).encode()
+
+    def start(self):
+        controller = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with controller._lock:
+                    controller.requests += 1
+                if controller.delay:
+                    time.sleep(controller.delay)
+                if controller.status != 200:
+                    self.send_response(controller.status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = controller.payload(self.path.strip("/") or "default")
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    if controller.framing == "chunked":
+                        self.send_header("Transfer-Encoding", "chunked")
+                    elif controller.framing == "length":
+                        self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    if controller.framing == "chunked":
+                        for i in range(0, len(body), 4096):
+                            chunk = body[i:i + 4096]
+                            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                        self.wfile.write(b"0\r\n\r\n")
+                    else:
+                        self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端超时断开
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_port
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
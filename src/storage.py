@@ -0,0 +1,491 @@
+"""
+storage.py
+JSON 数据文件的底层读写：
+- DocumentCache：进程内文档缓存，用 stat 校验
+- file_lock：按文件的锁（线程锁 + fcntl 跨进程咨询锁），保护 read-modify-write
+- write_json_atomic：写临时文件 + fsync + os.replace，崩溃时不会留下半个文件
+- 可选的 group commit：短时间内的多次保存合并为一次写盘
+- SnapshotLog：快照 + 追加日志，单条记录的写入不再重写整个文件
+"""
+
+from collections import OrderedDict
+from common import SIZE_BUCKETS
+from common import metrics
+import atexit
+import bisect
+import json
+import os
+import tempfile
+import threading
+import weakref
+
+try:
+    import fcntl
+except ImportError:  # Windows 下只有进程内的线程锁
+    fcntl = None
+
+
+class DocumentCache:
+    """
+    进程内的 JSON 文档缓存：按路径保存解析后的对象，每次读取用 os.stat 的
+    (mtime_ns, size, inode) 校验，文件没变就不再读盘和解析；按 LRU 限制条目数和总字节数。
+    返回的是共享对象：读者不要修改；写者应在 file_lock 内修改并通过 save_json 写回（失败时缓存会被丢弃）。
+    """
+
+    def __init__(self, max_entries=64, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _signature(st):
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def load(self, path):
+        """返回解析后的文档；文件不存在时返回 None，JSON 非法时抛异常。"""
+        pending = self._pending.get(path)
+        if pending is not None:
+            return pending
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.invalidate(path)
+            return None
+        signature = self._signature(st)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        with metrics.timer("reefing_json_load_seconds"):
+            with open(path, "r") as f:
+                obj = json.load(f)
+        metrics.observe("reefing_json_load_bytes", st.st_size, buckets=SIZE_BUCKETS)
+        self._put(path, signature, obj)
+        return obj
+
+    def store(self, path, obj):
+        """写盘之后调用：用新文件的 stat 更新缓存。"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.invalidate(path)
+            return
+        self._put(path, self._signature(st), obj)
+
+    def set_pending(self, path, obj):
+        """group commit 等待写盘期间，读取直接返回这份最新内容。"""
+        with self._lock:
+            self._pending[path] = obj
+
+    def clear_pending(self, path, obj):
+        with self._lock:
+            if self._pending.get(path) is obj:
+                del self._pending[path]
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                entry = self._entries.pop(path, None)
+                if entry is not None:
+                    self._bytes -= entry[0][1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _put(self, path, signature, obj):
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._bytes -= old[0][1]
+            self._entries[path] = (signature, obj)
+            self._bytes += signature[1]
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                _, (old_signature, _) = self._entries.popitem(last=False)
+                self._bytes -= old_signature[1]
+                self.evictions += 1
+
+
+# 所有 JSON 数据文件共享的文档缓存
+document_cache = DocumentCache(
+    max_entries=int(os.environ.get("REEFING_DOC_CACHE_SIZE", 64)),
+    max_bytes=int(os.environ.get("REEFING_DOC_CACHE_BYTES", 256 * 1024 * 1024)),
+)
+
+
+class _FileLock:
+    """
+    可重入的文件锁：同一线程可以嵌套获取；最外层获取时再加 fcntl.flock，
+    让多个 worker 进程之间的 read-modify-write 也互斥。
+    """
+
+    def __init__(self, path):
+        self.lock_path = path + ".lock"
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                except Exception:
+                    os.close(fd)
+                    raise
+            except Exception:
+                self._lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+        self._lock.release()
+
+
+# 弱引用：锁只在有人持有（with 块内）时保留，不随访问过的路径无限增长
+_file_locks = weakref.WeakValueDictionary()
+_file_locks_guard = threading.Lock()
+
+
+def file_lock(path):
+    """
+    返回 path 对应的文件锁（同一路径共用一把），用法：with file_lock(path): ...
+    只在 with 块内持有返回值，不要保存下来在别处释放。
+    """
+    path = os.path.abspath(path)
+    with _file_locks_guard:
+        lock = _file_locks.get(path)
+        if lock is None:
+            lock = _file_locks[path] = _FileLock(path)
+        return lock
+
+
+def write_json_atomic(path, obj, **dump_kwargs):
+    """写临时文件并 fsync，再 os.replace 到目标路径（原子替换）。"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with metrics.timer("reefing_json_write_seconds"), os.fdopen(fd, "w") as f:
+            json.dump(obj, f, **dump_kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        metrics.observe("reefing_json_write_bytes", size, buckets=SIZE_BUCKETS)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    if hasattr(os, "O_DIRECTORY"):
+        # 目录也 fsync，保证 rename 本身落盘
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class GroupCommitter:
+    """
+    把 window 秒内对同一文件的多次保存合并为一次写盘。等待期间新内容通过文档缓存的
+    pending 覆盖层对本进程可见。只适合单进程部署（其它进程在写盘前看不到修改），
+    进程崩溃会丢失最近 window 秒内的修改。
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.commits = 0
+        self.coalesced = 0
+
+    def submit(self, path, obj, dump_kwargs):
+        with self._lock:
+            first = path not in self._pending
+            if not first:
+                self.coalesced += 1
+            self._pending[path] = (obj, dump_kwargs)
+        document_cache.set_pending(path, obj)
+        if first:
+            timer = threading.Timer(self.window, self.flush, args=(path,))
+            timer.daemon = True
+            timer.start()
+
+    def flush(self, path=None):
+        """把等待中的修改写盘；path 为 None 时写全部。"""
+        with self._lock:
+            paths = list(self._pending) if path is None else [path]
+        for p in paths:
+            with file_lock(p):
+                with self._lock:
+                    item = self._pending.pop(p, None)
+                if item is None:
+                    continue
+                obj, dump_kwargs = item
+                _commit(p, obj, dump_kwargs)
+                document_cache.clear_pending(p, obj)
+                self.commits += 1
+
+
+def _commit(path, obj, dump_kwargs):
+    try:
+        write_json_atomic(path, obj, **dump_kwargs)
+    except Exception:
+        document_cache.invalidate(path)
+        raise
+    document_cache.store(path, obj)
+
+
+# REEFING_GROUP_COMMIT_MS > 0 时启用 group commit
+GROUP_COMMIT_MS = float(os.environ.get("REEFING_GROUP_COMMIT_MS", 0))
+group_committer = GroupCommitter(GROUP_COMMIT_MS / 1000.0) if GROUP_COMMIT_MS > 0 else None
+if group_committer is not None:
+    atexit.register(group_committer.flush)
+
+
+def disable_group_commit():
+    """多进程部署时关闭 group commit（其它进程看不到还没写盘的修改），先把等待中的修改写盘。"""
+    global group_committer
+    committer, group_committer = group_committer, None
+    if committer is not None:
+        committer.flush()
+    return committer is not None
+
+
+def save_json(path, obj, **dump_kwargs):
+    """
+    保存 JSON 文档并更新文档缓存。默认原子写盘；启用 group commit 时先进入合并队列。
+    写失败时丢弃缓存，避免保留未落盘的修改。调用方在 read-modify-write 时应持有 file_lock(path)。
+    """
+    if group_committer is not None:
+        group_committer.submit(path, obj, dump_kwargs)
+    else:
+        _commit(path, obj, dump_kwargs)
+
+
+class SnapshotLog:
+    """
+    快照 + 追加日志（WAL）：快照文件中 list_field 是一个记录列表，upsert 时只往 WAL 追加一行，
+    内存里维护合并后的记录和 key -> 位置的索引，所以写入开销与单条记录成正比。
+    WAL 累计 compact_every 条后把日志合并回快照（原子写）并清空 WAL。
+    给出 sort_key 时另外维护一个按 sort_key 有序的索引（sort_key 返回 None 的记录不进索引），
+    latest/range 只做二分查找和切片，不排序也不复制全部记录。
+    调用 upsert/compact 时应持有 file_lock(snapshot_path)。
+    """
+
+    def __init__(self, snapshot_path, wal_path, key, list_field="data", compact_every=100, dump_kwargs=None,
+                 sort_key=None):
+        self.snapshot_path = snapshot_path
+        self.wal_path = wal_path
+        self.key = key
+        self.list_field = list_field
+        self.compact_every = compact_every
+        self.dump_kwargs = dump_kwargs or {}
+        self.sort_key = sort_key
+        self._signature = False
+        self._offset = 0
+        self._records = []
+        self._index = {}
+        # 有序索引：[(sort_key, seq, record)]，以及 key -> (sort_key, seq)
+        self._sorted = []
+        self._sorted_pos = {}
+        self._seq = 0
+        self._wal_count = 0
+        self._lock = threading.RLock()
+
+    def records(self):
+        """合并后的全部记录（共享列表，调用方不要修改）。"""
+        with self._lock:
+            self._sync()
+            return self._records
+
+    def latest(self, n):
+        """按 sort_key 最大的 n 条记录（升序）。"""
+        with self._lock:
+            self._sync()
+            if n <= 0:
+                return []
+            return [item[2] for item in self._sorted[-n:]]
+
+    def range(self, start=None, end=None):
+        """sort_key 在 [start, end] 内的记录（升序），start/end 为 None 表示不限。"""
+        with self._lock:
+            self._sync()
+            lo = 0 if start is None else bisect.bisect_left(self._sorted, (start,))
+            hi = len(self._sorted) if end is None else bisect.bisect_right(self._sorted, (end, float("inf")))
+            return [item[2] for item in self._sorted[lo:hi]]
+
+    def wal_size(self):
+        with self._lock:
+            self._sync()
+            return self._wal_count
+
+    def upsert(self, record):
+        """按 key 覆盖已有记录或追加新记录。"""
+        self.upsert_many([record])
+
+    def upsert_many(self, records):
+        """批量 upsert：一次写入 WAL、一次 fsync，超过阈值时只合并一次。"""
+        if not records:
+            return
+        with self._lock:
+            self._sync()
+            data = b"".join((json.dumps(record, ensure_ascii=False) + "\n").encode() for record in records)
+            with open(self.wal_path, "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._offset += len(data)
+            for record in records:
+                self._apply(record)
+            self._wal_count += len(records)
+            if self.compact_every and self._wal_count >= self.compact_every:
+                self.compact()
+
+    def rewrite(self, records):
+        """用 records 整体替换合并后的记录（数据迁移用）：直接写快照并清空 WAL。"""
+        with self._lock:
+            self._sync()
+            self._records = list(records)
+            self._index = {}
+            for pos, record in enumerate(self._records):
+                self._index.setdefault(self.key(record), pos)
+            self._rebuild_sorted()
+            self.compact()
+
+    def compact(self):
+        """把 WAL 合并回快照：先原子写快照，再清空 WAL（中途崩溃时重放 WAL 是幂等的）。"""
+        with self._lock:
+            if group_committer is not None:
+                # 先把等待中的快照修改写盘，避免它之后覆盖掉合并结果
+                group_committer.flush(self.snapshot_path)
+            self._sync()
+            try:
+                doc = document_cache.load(self.snapshot_path)
+            except Exception:
+                doc = None
+            doc = dict(doc) if isinstance(doc, dict) else {}
+            doc[self.list_field] = list(self._records)
+            _commit(self.snapshot_path, doc, self.dump_kwargs)
+            with open(self.wal_path, "wb") as f:
+                os.fsync(f.fileno())
+            self._signature = _stat_signature(self.snapshot_path)
+            self._offset = 0
+            self._wal_count = 0
+
+    def _apply(self, record):
+        key = self.key(record)
+        pos = self._index.get(key)
+        if pos is None:
+            self._index[key] = len(self._records)
+            self._records.append(record)
+        else:
+            self._records[pos] = record
+        if self.sort_key is not None:
+            self._reindex(key, record)
+
+    def _reindex(self, key, record):
+        old = self._sorted_pos.pop(key, None)
+        if old is not None:
+            del self._sorted[bisect.bisect_left(self._sorted, old)]
+            seq = old[1]
+        else:
+            self._seq += 1
+            seq = self._seq
+        sort_key = self.sort_key(record)
+        if sort_key is None:
+            return
+        self._sorted_pos[key] = (sort_key, seq)
+        bisect.insort(self._sorted, (sort_key, seq, record))
+
+    def _rebuild_sorted(self):
+        self._sorted = []
+        self._sorted_pos = {}
+        self._seq = len(self._records)
+        if self.sort_key is None:
+            return
+        for key, pos in self._index.items():
+            sort_key = self.sort_key(self._records[pos])
+            if sort_key is not None:
+                self._sorted_pos[key] = (sort_key, pos)
+                self._sorted.append((sort_key, pos, self._records[pos]))
+        self._sorted.sort(key=lambda item: item[:2])
+
+    def _sync(self):
+        signature = _stat_signature(self.snapshot_path)
+        if signature != self._signature:
+            # 快照变了（首次加载、别的进程 compact 或改了配置）：从快照重建再重放整个 WAL
+            try:
+                doc = document_cache.load(self.snapshot_path)
+            except Exception:
+                doc = None
+            records = doc.get(self.list_field, []) if isinstance(doc, dict) else []
+            self._records = list(records) if isinstance(records, list) else []
+            self._index = {}
+            for pos, record in enumerate(self._records):
+                self._index.setdefault(self.key(record), pos)
+            self._rebuild_sorted()
+            self._signature = signature
+            self._offset = 0
+            self._wal_count = 0
+        try:
+            size = os.path.getsize(self.wal_path)
+        except OSError:
+            return
+        if size < self._offset:
+            # WAL 被别的进程清空了，下次快照签名变化时会重建
+            self._offset = 0
+        if size == self._offset:
+            return
+        with open(self.wal_path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._offset += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self._apply(record)
+                self._wal_count += 1
+
+
+def _stat_signature(path):
+    try:
+        return DocumentCache._signature(os.stat(path))
+    except FileNotFoundError:
+        return None
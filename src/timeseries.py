@@ -0,0 +1,318 @@
+"""
+timeseries.py
+基于 numpy 的列式时间序列存储：时间戳为 int64（epoch 秒），每个参数一列 float32。
+时间按 "YYYY-MM-DD HH:MM:SS" 的本地钟面时间存储（当作 UTC 计算），读写保持原样。
+"""
+
+import calendar
+import datetime
+import math
+import re
+import threading
+
+import numpy as np
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 输出时每列保留的小数位（ORP 为整数），未列出的列保留 2 位
+ROUNDING = {"ORP": 0, "PH": 1, "T": 2}
+DEFAULT_DECIMALS = 2
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# 分桶粒度（秒）；周从周一开始，1970-01-05 是周一
+BUCKETS = {"minute": 60, "hour": 3600, "day": 86400, "week": 7 * 86400}
+WEEK_ORIGIN = 4 * 86400
+
+
+def parse_time(ts):
+    """把 'YYYY-MM-DD HH:MM[:SS]' / ISO 字符串转换为 epoch 秒，无法解析时抛 ValueError。"""
+    if isinstance(ts, (int, float)):
+        return int(ts)
+    text = str(ts).strip().replace("T", " ")
+    if len(text) >= 19:
+        dt = datetime.datetime.strptime(text[:19], TIME_FORMAT)
+    elif len(text) == 16:
+        dt = datetime.datetime.strptime(text, "%Y-%m-%d %H:%M")
+    else:
+        dt = datetime.datetime.strptime(text[:10], "%Y-%m-%d")
+    return calendar.timegm(dt.timetuple())
+
+
+def parse_static_date(date_str):
+    """
+    静态数据的日期 'YYYY-MM-DD'，返回 epoch 秒，无法解析时返回 None。
+    没有年份的旧格式 'Mon DD' 不猜年份（同样返回 None）：写入时由 full_static_date 补全，
+    存量数据用 python src/backends.py migrate-dates 显式迁移。
+    """
+    if not date_str or not isinstance(date_str, str) or not re.match(r"^\d{4}-\d{2}-\d{2}", date_str):
+        return None
+    try:
+        return parse_time(date_str)
+    except ValueError:
+        return None
+
+
+def _yearless_date(date_str):
+    """'Mon DD' -> (月, 日)，不是这种格式时返回 None。"""
+    if not isinstance(date_str, str):
+        return None
+    try:
+        # 用闰年解析，2 月 29 日也合法
+        dt = datetime.datetime.strptime(f"{date_str.strip()} 2000", "%b %d %Y")
+    except ValueError:
+        return None
+    return dt.month, dt.day
+
+
+def _nearest_date(month, day, ref, limit):
+    """month/day 离 ref 最近、且不晚于 limit 的那一次（2 月 29 日只落在闰年）。"""
+    candidates = []
+    for year in range(ref.year - 4, ref.year + 2):
+        try:
+            date = datetime.date(year, month, day)
+        except ValueError:
+            continue
+        if date <= limit:
+            candidates.append(date)
+    return min(candidates, key=lambda date: (abs((date - ref).days), -date.toordinal()))
+
+
+def full_static_date(date_str, today=None):
+    """
+    写入前把静态数据的日期补全为 'YYYY-MM-DD'：已带年份的原样返回；
+    'Mon DD'（旧前端的格式）取不晚于今天的最近一次（容许一天的时区差）。无法解析时返回 None。
+    """
+    if parse_static_date(date_str) is not None:
+        return date_str
+    month_day = _yearless_date(date_str)
+    if month_day is None:
+        return None
+    limit = (today or datetime.date.today()) + datetime.timedelta(days=1)
+    return _nearest_date(*month_day, limit, limit).isoformat()
+
+
+def resolve_yearless_dates(dates, today=None):
+    """
+    迁移旧数据用（python src/backends.py migrate-dates）：dates 按写入顺序排列，
+    返回把 'Mon DD' 补全年份后的列表（其它日期原样保留）。
+    从最后写入的一条往前推：最后一条取不晚于今天的最近一次，之前的每条取离后一条最近的那一次，
+    所以跨年的记录按写入顺序落在相邻的年份里。带年份的记录可能是后来补录的历史数据，不作为参照。
+    """
+    limit = (today or datetime.date.today()) + datetime.timedelta(days=1)
+    ref = limit
+    resolved = list(dates)
+    for i in range(len(resolved) - 1, -1, -1):
+        month_day = _yearless_date(resolved[i])
+        if month_day is None or parse_static_date(resolved[i]) is not None:
+            continue
+        ref = _nearest_date(*month_day, ref, limit)
+        resolved[i] = ref.isoformat()
+    return resolved
+
+
+def format_time(epoch):
+    return (_EPOCH + datetime.timedelta(seconds=int(epoch))).strftime(TIME_FORMAT)
+
+
+def format_times(times):
+    """批量把 epoch 秒数组格式化为字符串列表。"""
+    if len(times) == 0:
+        return []
+    text = np.datetime_as_string(np.asarray(times).astype("datetime64[s]"), unit="s")
+    return np.char.replace(text, "T", " ").tolist()
+
+
+def round_values(values, decimals):
+    """向量化取整，返回 python 列表（NaN 变为 None，0 位小数时为 int）。"""
+    rounded = np.round(np.asarray(values, dtype=np.float64), decimals)
+    missing = np.isnan(rounded)
+    if not missing.any():
+        return rounded.astype(np.int64).tolist() if decimals == 0 else rounded.tolist()
+    return [
+        None if m else (int(v) if decimals == 0 else v)
+        for v, m in zip(rounded.tolist(), missing.tolist())
+    ]
+
+
+def round_column(name, values):
+    """按 ROUNDING 做向量化取整。"""
+    return round_values(values, ROUNDING.get(name, DEFAULT_DECIMALS))
+
+
+def lttb(times, values, threshold):
+    """
+    Largest-Triangle-Three-Buckets 降采样：保留视觉形状，返回 (times, values)。
+    values 中不能有 NaN（调用前先过滤）。
+    """
+    n = len(times)
+    if threshold >= n or threshold < 3:
+        return times, values
+    x = np.asarray(times, dtype=np.float64)
+    y = np.asarray(values, dtype=np.float64)
+    every = (n - 2) / (threshold - 2)
+    picked = np.empty(threshold, dtype=np.int64)
+    picked[0] = 0
+    a = 0
+    for i in range(threshold - 2):
+        avg_start = int(math.floor((i + 1) * every)) + 1
+        avg_end = min(int(math.floor((i + 2) * every)) + 1, n)
+        avg_x = x[avg_start:avg_end].mean()
+        avg_y = y[avg_start:avg_end].mean()
+        lo = int(math.floor(i * every)) + 1
+        hi = int(math.floor((i + 1) * every)) + 1
+        area = np.abs(
+            (x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        picked[i + 1] = a
+    picked[-1] = n - 1
+    return np.asarray(times)[picked], np.asarray(values)[picked]
+
+
+class TimeSeries:
+    """
+    追加为主的列式时间序列，时间戳保持升序：
+    - append/extend：按时间插入（通常在末尾，摊还 O(1)）
+    - slice：二分查找时间范围，返回 numpy 视图，不复制
+    - to_records / aggregate：向量化取整与分桶统计
+    """
+
+    def __init__(self, columns=(), capacity=1024):
+        capacity = max(int(capacity), 16)
+        self._times = np.empty(capacity, dtype=np.int64)
+        self._cols = {name: np.empty(capacity, dtype=np.float32) for name in columns}
+        self._size = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def columns(self):
+        return list(self._cols.keys())
+
+    @property
+    def times(self):
+        return self._times[: self._size]
+
+    def column(self, name):
+        return self._cols[name][: self._size]
+
+    def nbytes(self):
+        return self._times.nbytes + sum(col.nbytes for col in self._cols.values())
+
+    def ensure_column(self, name):
+        with self._lock:
+            if name not in self._cols:
+                col = np.empty(len(self._times), dtype=np.float32)
+                col[: self._size] = np.nan
+                self._cols[name] = col
+
+    def _grow(self, needed):
+        capacity = len(self._times)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        times = np.empty(capacity, dtype=np.int64)
+        times[: self._size] = self._times[: self._size]
+        self._times = times
+        for name, col in self._cols.items():
+            new_col = np.empty(capacity, dtype=np.float32)
+            new_col[: self._size] = col[: self._size]
+            self._cols[name] = new_col
+
+    def append(self, ts, values):
+        """追加一条记录；ts 可以是 epoch 秒或时间字符串，values 为 {列名: 数值}。"""
+        self.extend([(ts, values)])
+
+    def extend(self, readings):
+        """批量追加 (ts, values) 记录。"""
+        readings = list(readings)
+        if not readings:
+            return
+        with self._lock:
+            for _, values in readings:
+                for name in values:
+                    if name not in self._cols:
+                        self.ensure_column(name)
+            self._grow(self._size + len(readings))
+            for ts, values in readings:
+                epoch = parse_time(ts)
+                idx = self._size
+                if idx and epoch < self._times[idx - 1]:
+                    # 乱序数据：找到插入位置并整体后移
+                    idx = int(np.searchsorted(self._times[: self._size], epoch, side="right"))
+                    self._times[idx + 1: self._size + 1] = self._times[idx: self._size]
+                    for col in self._cols.values():
+                        col[idx + 1: self._size + 1] = col[idx: self._size]
+                self._times[idx] = epoch
+                for name, col in self._cols.items():
+                    value = values.get(name)
+                    col[idx] = np.nan if value is None else value
+                self._size += 1
+
+    def slice_index(self, start=None, end=None):
+        """返回 [start, end] 时间范围对应的下标区间（二分查找）。"""
+        times = self.times
+        lo = 0 if start is None else int(np.searchsorted(times, parse_time(start), side="left"))
+        hi = self._size if end is None else int(np.searchsorted(times, parse_time(end), side="right"))
+        return lo, max(lo, hi)
+
+    def slice(self, start=None, end=None, columns=None):
+        """返回 (times, {列名: values})，均为 numpy 视图。"""
+        with self._lock:
+            lo, hi = self.slice_index(start, end)
+            names = self.columns if columns is None else [c for c in columns if c in self._cols]
+            return self._times[lo:hi], {name: self._cols[name][lo:hi] for name in names}
+
+    def latest_time(self):
+        if not self._size:
+            return None
+        return int(self._times[self._size - 1])
+
+    def to_records(self, start=None, end=None, reverse=True):
+        """转换为 [{"time", 列...}] 列表，默认按时间倒序（与 dashboard 原格式一致）。"""
+        times, cols = self.slice(start, end)
+        if reverse:
+            times = times[::-1]
+            cols = {name: values[::-1] for name, values in cols.items()}
+        keys = ["time"] + list(cols.keys())
+        columns = [format_times(times)] + [round_column(name, values) for name, values in cols.items()]
+        records = []
+        for row in zip(*columns):
+            records.append({k: v for k, v in zip(keys, row) if v is not None})
+        return records
+
+    def aggregate(self, bucket_seconds, start=None, end=None, columns=None, origin=0):
+        """
+        按固定时间桶统计 min/mean/max/count，桶边界对齐到 origin（epoch 秒）。
+        返回 (bucket_start_times, {列名: {"min", "mean", "max", "count"}})，均为 numpy 数组。
+        """
+        times, cols = self.slice(start, end, columns)
+        if len(times) == 0:
+            return np.empty(0, dtype=np.int64), {name: _empty_stats() for name in cols}
+        bucket_seconds = int(bucket_seconds)
+        keys = (times - origin) // bucket_seconds * bucket_seconds + origin
+        bucket_times, offsets = np.unique(keys, return_index=True)
+        stats = {}
+        for name, values in cols.items():
+            values = values.astype(np.float64)
+            valid = ~np.isnan(values)
+            count = np.add.reduceat(valid.astype(np.int64), offsets)
+            total = np.add.reduceat(np.where(valid, values, 0.0), offsets)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = np.where(count > 0, total / np.maximum(count, 1), np.nan)
+            stats[name] = {
+                "min": np.fmin.reduceat(values, offsets),
+                "mean": mean,
+                "max": np.fmax.reduceat(values, offsets),
+                "count": count,
+            }
+        return bucket_times, stats
+
+
+def _empty_stats():
+    empty = np.empty(0, dtype=np.float64)
+    return {"min": empty, "mean": empty, "max": empty, "count": np.empty(0, dtype=np.int64)}
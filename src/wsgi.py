@@ -0,0 +1,12 @@
+"""
+wsgi.py
+生产环境入口，例如：
+
+    gunicorn --chdir src -w 4 --threads 8 wsgi:app
+
+每个 worker 各自创建应用；后台 poller 通过文件锁只在一个 worker 里运行。
+"""
+
+from app import create_app
+
+app = create_app()
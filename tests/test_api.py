@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+import backends
+import data_store
+from app import create_app
+from backends import JsonBackend
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # 每个测试一个独立的数据目录，常驻的 store 实例也要清掉
+    monkeypatch.setattr(backends, "_backend", JsonBackend(data_dir=str(tmp_path)))
+    monkeypatch.setattr(data_store, "_stores", data_store.collections.OrderedDict())
+    return create_app({"POLLER": False, "MULTIPROCESS": False}).test_client()
+
+
+def _add_summary(client, count, order=None):
+    items = [{"title": f"item {i}", "order": i if order is None else order} for i in range(count)]
+    return [client.post("/api/summary", json=item).get_json()["id"] for item in items]
+
+
+def test_summary_pages_follow_cursor(client):
+    ids = _add_summary(client, 5)
+    seen, after = [], None
+    while True:
+        query = {"limit": 2, "fields": "title"} | ({"after": after} if after else {})
+        page = client.get("/api/summary", query_string=query).get_json()
+        assert all(set(item) == {"id", "title"} for item in page["items"])
+        seen += [item["id"] for item in page["items"]]
+        after = page["next"]
+        if after is None:
+            break
+    assert seen == ids
+    # 不带分页参数时仍返回 {id: node} 的全部节点
+    assert set(client.get("/api/summary").get_json()) == set(ids)
+
+
+@pytest.mark.parametrize("query", [{"limit": 0}, {"limit": 201}, {"limit": "abc"}, {"since": "yesterday"},
+                                   {"limit": 2, "after": "missing"}])
+def test_summary_page_rejects_bad_arguments(client, query):
+    _add_summary(client, 3)
+    response = client.get("/api/summary", query_string=query)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_summary_page_since_returns_updated_nodes(client):
+    ids = _add_summary(client, 3)
+    since = time.time()
+    time.sleep(0.01)
+    client.patch(f"/api/summary/{ids[1]}", json={"title": "changed"})
+    page = client.get("/api/summary", query_string={"since": since}).get_json()
+    assert [item["id"] for item in page["items"]] == [ids[1]]
+    assert page["next"] is None
+
+
+def test_summary_etag_revalidates_until_a_write(client):
+    _add_summary(client, 2)
+    first = client.get("/api/summary")
+    etag = first.headers["ETag"]
+    cached = client.get("/api/summary", headers={"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.data == b""
+
+    _add_summary(client, 1)
+    changed = client.get("/api/summary", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag and len(changed.get_json()) == 3
+
+
+def test_static_write_invalidates_chart_etag(client):
+    client.post("/dashboard", query_string={"uuid": "tank"}, json={"date": "2025-01-01", "N": 1})
+    etag = client.get("/dashboard/mini", query_string={"uuid": "tank"}).headers["ETag"]
+    assert client.get("/dashboard/mini", query_string={"uuid": "tank"},
+                      headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/dashboard", query_string={"uuid": "tank"}, json={"date": "2025-01-02", "N": 2})
+    changed = client.get("/dashboard/mini", query_string={"uuid": "tank"}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.get_json()["N"] == 2
+
+
+def test_metrics_export_log_drops_as_counter(client):
+    text = client.get("/metrics").get_data(as_text=True)
+    assert "# TYPE reefing_log_dropped_total counter" in text
+    assert "# TYPE reefing_log_queue_depth gauge" in text
+
+
+def test_summary_order_keeps_nodes_that_were_not_posted(client):
+    # order 相同（例如批量导入）的节点按添加顺序排列
+    ids = _add_summary(client, 5, order=0)
+    # 只加载了第一页时，只提交前三个节点的新顺序
+    response = client.post("/api/summary/order", json={"order": [ids[2], ids[0], ids[1], "missing"]})
+    assert response.get_json() == {"success": True}
+    nodes = client.get("/api/summary", query_string={"limit": 10}).get_json()["items"]
+    assert [node["id"] for node in nodes] == [ids[2], ids[0], ids[1], ids[3], ids[4]]
+    assert [node["order"] for node in nodes] == [0, 1, 2, 3, 4]
@@ -0,0 +1,72 @@
+import datetime
+
+import pytest
+
+from backends import JsonBackend
+from backends import SqliteBackend
+from realtime import Reading
+
+
+@pytest.fixture(params=[JsonBackend, SqliteBackend])
+def backend(request, tmp_path):
+    return request.param(data_dir=str(tmp_path))
+
+
+def _epoch(date):
+    return datetime.datetime.strptime(date, "%Y-%m-%d").timestamp()
+
+
+def test_static_upsert_keeps_position_and_orders_by_date(backend):
+    backend.upsert_static_many("tank", [
+        {"date": "2025-01-03", "N": 1},
+        {"date": "2025-01-01", "N": 2},
+        {"date": "2025-01-03", "N": 3},
+    ])
+    backend.upsert_static("tank", {"date": "2025-01-02", "N": 4})
+    assert [entry["N"] for entry in backend.static_entries("tank")] == [3, 2, 4]
+    assert [entry["N"] for entry in backend.static_latest("tank", 2)] == [4, 3]
+    in_range = backend.static_range("tank", _epoch("2025-01-02"), _epoch("2025-01-03"))
+    assert [entry["date"] for entry in in_range] == ["2025-01-02", "2025-01-03"]
+    assert backend.static_entries("other") == []
+
+
+def test_realtime_append_and_read_from_cursor(backend):
+    assert backend.realtime_watermark("tank") is None
+    first = [Reading(f"2025-01-01 00:0{i}:00", {"PH": 8.0 + i / 10}) for i in range(3)]
+    assert backend.append_realtime("tank", iter(first)) == 3
+    rows, cursor = backend.read_realtime("tank")
+    assert rows == [(reading.time, reading.values) for reading in first]
+
+    backend.append_realtime("tank", iter([Reading("2025-01-01 00:05:00", {"PH": 8.3})]))
+    assert backend.realtime_watermark("tank") == "2025-01-01 00:05:00"
+    assert backend.read_realtime("tank", cursor)[0] == [("2025-01-01 00:05:00", {"PH": 8.3})]
+    in_range = backend.iter_realtime("tank", "2025-01-01 00:01:00", "2025-01-01 00:02:00")
+    assert [time for time, _ in in_range] == ["2025-01-01 00:01:00", "2025-01-01 00:02:00"]
+
+
+def test_nodes_put_reorder_and_page(backend):
+    backend.put_nodes("summary", None, {
+        "a": {"id": "a", "order": 2},
+        "b": {"id": "b", "order": 1},
+        "c": {"id": "c", "order": 3},
+    })
+    backend.put_node("summary", None, "a", {"id": "a", "order": 2, "title": "A"})
+    assert backend.get_node("summary", None, "a")["title"] == "A"
+    assert list(backend.load_nodes("summary")) == ["a", "b", "c"]
+
+    backend.reorder_nodes("summary", None, {"c": {"order": 0}, "missing": {"order": 5}})
+    assert list(backend.load_nodes("summary")) == ["c", "b", "a"]
+
+    assert backend.delete_node("summary", None, "b") is True
+    assert backend.delete_node("summary", None, "b") is False
+    nodes, cursor = backend.node_page("summary", limit=1)
+    assert [node["id"] for node in nodes] == ["c"] and cursor == "c"
+    nodes, cursor = backend.node_page("summary", limit=1, after=cursor)
+    assert [node["id"] for node in nodes] == ["a"] and cursor is None
+
+
+def test_chart_config_and_realtime_sources(backend):
+    assert backend.get_chart_config("tank") is None
+    backend.set_chart_config("tank", {"realtimesource": "http://controller/tank"})
+    assert backend.get_chart_config("tank")["realtimesource"] == "http://controller/tank"
+    assert backend.list_realtime_sources() == [("tank", "http://controller/tank")]
@@ -0,0 +1,20 @@
+import base64
+import os
+
+import pytest
+
+from images import ImageError
+from images import iter_base64
+
+
+@pytest.mark.parametrize("chunk_size", [3, 10, 4096])
+def test_iter_base64_accepts_wrapped_lines(chunk_size):
+    raw = os.urandom(20001)
+    # MIME 风格：每 76 列一个换行
+    data = "data:image/png;base64," + base64.encodebytes(raw).decode().replace("\n", "\r\n")
+    assert b"".join(iter_base64(data, chunk_size)) == raw
+
+
+def test_iter_base64_rejects_truncated_input():
+    with pytest.raises(ImageError):
+        list(iter_base64("abcde"))
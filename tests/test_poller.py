@@ -0,0 +1,55 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+import poller
+from poller import RealtimePoller
+from realtime import fetch_feed
+from standin import StandInController
+
+
+@pytest.fixture
+def controller():
+    with StandInController() as controller:
+        # 远大于一次 read() 的缓冲
+        controller.fill("tank", count=2000)
+        yield controller
+
+
+@pytest.mark.parametrize("framing", ["length", "close", "chunked"])
+def test_fetch_feed_reads_whole_body(controller, framing):
+    controller.framing = framing
+    body = fetch_feed(controller.url("tank"))
+    assert body == controller.payload("tank")
+    assert len(body) > 64 * 1024
+
+
+@pytest.mark.parametrize("framing", ["length", "close", "chunked"])
+def test_fetch_feed_rejects_oversized_body(controller, framing):
+    controller.framing = framing
+    with pytest.raises(ValueError):
+        fetch_feed(controller.url("tank"), max_bytes=10000)
+
+
+def test_fetch_feed_raises_on_error_status(controller):
+    controller.status = 503
+    with pytest.raises(requests.HTTPError):
+        fetch_feed(controller.url("tank"))
+
+
+def test_discover_failure_is_logged_and_keeps_sources(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(poller.logger, "warning", warnings.append)
+
+    def broken():
+        raise OSError("data dir unavailable")
+
+    realtime_poller = RealtimePoller(discover=broken)
+    realtime_poller.sources = {"tank": poller.SourceState("tank", "http://127.0.0.1/tank")}
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        realtime_poller._executor = executor
+        asyncio.run(realtime_poller._discover())
+    assert list(realtime_poller.sources) == ["tank"]
+    assert len(warnings) == 1 and "data dir unavailable" in warnings[0]
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from realtime import RealtimeCache
+
+
+def _wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_cache_hits_within_ttl_and_serves_stale_while_refreshing():
+    cache = RealtimeCache(ttl=0.05, stale_ttl=10)
+    values = iter(["first", "second"])
+    loader = lambda: next(values)
+    assert cache.get("tank", loader) == "first"
+    assert cache.get("tank", loader) == "first"
+    assert cache.stats()["hits"] == 1
+
+    time.sleep(0.06)
+    # 过期后先返回旧值，后台刷新
+    assert cache.get("tank", loader) == "first"
+    _wait_for(lambda: cache.stats()["refreshes"] == 2)
+    assert cache.get("tank", loader) == "second"
+
+
+def test_failed_refresh_keeps_old_value():
+    cache = RealtimeCache(ttl=0, stale_ttl=10)
+    cache.get("tank", lambda: "old")
+
+    def broken():
+        raise IOError("controller down")
+
+    assert cache.get("tank", broken) == "old"
+    _wait_for(lambda: cache.stats()["errors"] == 1)
+    assert cache.get("tank", broken) == "old"
+
+
+def test_concurrent_misses_share_one_load():
+    cache = RealtimeCache()
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        release.wait(2)
+        return "value"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("tank", loader))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    _wait_for(lambda: cache.stats()["coalesced"] == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["value"] * 5 and len(calls) == 1
+
+
+def test_miss_error_is_raised_and_not_cached():
+    cache = RealtimeCache()
+
+    def broken():
+        raise IOError("controller down")
+
+    with pytest.raises(IOError):
+        cache.get("tank", broken)
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = RealtimeCache(max_entries=2)
+    cache.get("a", lambda: 1)
+    cache.get("b", lambda: 2)
+    cache.get("a", lambda: 0)
+    cache.get("c", lambda: 3)
+    assert cache.stats()["evictions"] == 1
+    # b 最久没用，被淘汰后重新加载；a 和 c 仍在缓存中
+    assert cache.get("a", lambda: 0) == 1
+    assert cache.get("c", lambda: 0) == 3
+    assert cache.get("b", lambda: 22) == 22
@@ -0,0 +1,49 @@
+import datetime
+
+import pytest
+
+from backends import JsonBackend
+from backends import SqliteBackend
+from backends import migrate_static_dates
+from timeseries import full_static_date
+from timeseries import parse_static_date
+from timeseries import resolve_yearless_dates
+
+TODAY = datetime.date(2026, 1, 5)
+
+
+def test_full_static_date_picks_the_latest_past_occurrence():
+    assert full_static_date("Jan 05", TODAY) == "2026-01-05"
+    assert full_static_date("Dec 30", TODAY) == "2025-12-30"
+    assert full_static_date("Feb 29", TODAY) == "2024-02-29"
+    assert full_static_date("2024-07-01", TODAY) == "2024-07-01"
+    assert full_static_date("nope", TODAY) is None
+
+
+def test_yearless_dates_are_not_guessed():
+    assert parse_static_date("Jan 05") is None
+    assert parse_static_date("2026-01-05") == parse_static_date("2026-01-05 00:00:00")
+
+
+def test_resolve_yearless_dates_follows_insertion_order():
+    # Dec 28 是后来补录的，带年份的记录不作为参照
+    dates = ["Nov 20", "Dec 20", "2019-01-01", "Jan 3", "Dec 28"]
+    assert resolve_yearless_dates(dates, TODAY) == [
+        "2025-11-20", "2025-12-20", "2019-01-01", "2026-01-03", "2025-12-28",
+    ]
+
+
+@pytest.mark.parametrize("backend_class", [JsonBackend, SqliteBackend])
+def test_migrate_static_dates_keeps_raw_value(tmp_path, backend_class):
+    backend = backend_class(data_dir=str(tmp_path))
+    backend.upsert_static_many("tank", [{"date": "Dec 20", "N": 1}, {"date": "Jan 3", "N": 2}])
+    # 读取不改写存储的数据
+    assert backend.static_latest("tank", 5) == []
+    assert [entry["date"] for entry in backend.static_entries("tank")] == ["Dec 20", "Jan 3"]
+
+    assert migrate_static_dates(backend, TODAY) == {"tanks": 1, "entries": 2}
+    assert backend.static_latest("tank", 5) == [
+        {"date": "2025-12-20", "N": 1, "raw_date": "Dec 20"},
+        {"date": "2026-01-03", "N": 2, "raw_date": "Jan 3"},
+    ]
+    assert migrate_static_dates(backend, TODAY) == {"tanks": 0, "entries": 0}
@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+
+import pytest
+
+from storage import SnapshotLog
+from storage import document_cache
+from storage import file_lock
+from storage import save_json
+from storage import write_json_atomic
+
+
+def test_write_json_atomic_keeps_old_file_on_failure(tmp_path):
+    path = str(tmp_path / "doc.json")
+    write_json_atomic(path, {"n": 1})
+    with pytest.raises(TypeError):
+        write_json_atomic(path, {"n": object()})
+    with open(path) as f:
+        assert json.load(f) == {"n": 1}
+    # 失败时临时文件被清理
+    assert os.listdir(tmp_path) == ["doc.json"]
+
+
+def test_file_lock_serializes_read_modify_write(tmp_path):
+    path = str(tmp_path / "counter.json")
+    save_json(path, {"n": 0})
+
+    def increment():
+        for _ in range(50):
+            with file_lock(path):
+                # 可重入：嵌套获取同一把锁不会死锁
+                with file_lock(path):
+                    doc = document_cache.load(path)
+                save_json(path, {"n": doc["n"] + 1})
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert document_cache.load(path) == {"n": 200}
+
+
+def _snapshot_log(tmp_path, compact_every=100):
+    return SnapshotLog(
+        str(tmp_path / "data.json"), str(tmp_path / "data.wal"), key=lambda record: record["date"],
+        compact_every=compact_every, sort_key=lambda record: record["date"],
+    )
+
+
+def test_snapshot_log_replays_wal_in_a_fresh_instance(tmp_path):
+    log = _snapshot_log(tmp_path)
+    log.upsert_many([{"date": "2025-01-02", "N": 1}, {"date": "2025-01-01", "N": 2}])
+    log.upsert({"date": "2025-01-02", "N": 3})
+    # 写了一半的最后一行（崩溃）在重放时被忽略
+    with open(tmp_path / "data.wal", "ab") as f:
+        f.write(b'{"date": "2025-01-03"')
+
+    replayed = _snapshot_log(tmp_path)
+    assert replayed.records() == [{"date": "2025-01-02", "N": 3}, {"date": "2025-01-01", "N": 2}]
+    assert replayed.wal_size() == 3
+    assert replayed.latest(1) == [{"date": "2025-01-02", "N": 3}]
+    assert replayed.range("2025-01-01", "2025-01-01") == [{"date": "2025-01-01", "N": 2}]
+
+
+def test_snapshot_log_compacts_into_snapshot(tmp_path):
+    log = _snapshot_log(tmp_path, compact_every=3)
+    for day in range(1, 5):
+        log.upsert({"date": f"2025-01-0{day}", "N": day})
+    # 第 3 条触发合并：快照里有前三条，WAL 只剩第 4 条
+    with open(tmp_path / "data.json") as f:
+        assert [record["N"] for record in json.load(f)["data"]] == [1, 2, 3]
+    assert log.wal_size() == 1
+
+    log.compact()
+    assert os.path.getsize(tmp_path / "data.wal") == 0
+    assert [record["N"] for record in _snapshot_log(tmp_path).records()] == [1, 2, 3, 4]